@@ -0,0 +1,104 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+"""
+Measure the cost of diffing cluster states that differ in some nodes, against
+the size of the cluster.
+"""
+
+import argparse
+from time import time
+from uuid import uuid4
+
+from twisted.python.filepath import FilePath
+
+from flocker.control import (
+    DeploymentState, NodeState, Manifestation, Dataset,
+)
+from flocker.control._diffing import create_diff
+from flocker.control._persistence import wire_encode, wire_decode
+
+
+def build_node_state(number_of_datasets):
+    """
+    :param int number_of_datasets: The number of datasets on the node.
+
+    :return NodeState: The state of a node with the given number of
+        datasets.
+    """
+    manifestations = {}
+    paths = {}
+    devices = {}
+    for index in range(number_of_datasets):
+        dataset_id = uuid4()
+        manifestations[unicode(dataset_id)] = Manifestation(
+            dataset=Dataset(dataset_id=dataset_id, maximum_size=1024 ** 3),
+            primary=True,
+        )
+        paths[unicode(dataset_id)] = FilePath(b"/flocker/%d" % (index,))
+        devices[dataset_id] = FilePath(b"/dev/sd%d" % (index,))
+    return NodeState(
+        uuid=uuid4(), hostname=u"192.0.2.1", applications=None,
+        manifestations=manifestations, paths=paths, devices=devices,
+    )
+
+
+def change_nodes(state, number_of_changes, number_of_datasets):
+    """
+    :return DeploymentState: ``state`` with ``number_of_changes`` of its
+        nodes replaced, sharing everything else with ``state``.
+    """
+    for uuid in list(state.nodes)[:number_of_changes]:
+        state = state.transform(
+            ["nodes", uuid],
+            build_node_state(number_of_datasets).set(uuid=uuid))
+    return state
+
+
+def measure(function, repeats):
+    """
+    :return: The fastest of ``repeats`` calls of ``function``, in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time()
+        function()
+        timings.append(time() - start)
+    return min(timings)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--nodes', type=int, nargs='+', default=[10, 100, 1000],
+        help='Numbers of nodes in the cluster.')
+    parser.add_argument(
+        '--changed', type=int, nargs='+', default=[1, 10],
+        help='Numbers of nodes that differ.')
+    parser.add_argument(
+        '--datasets', type=int, default=10,
+        help='Number of datasets on each node.')
+    parser.add_argument(
+        '--repeats', type=int, default=5,
+        help='Number of times to repeat each measurement.')
+    options = parser.parse_args(args)
+
+    print "{:>8} {:>8} {:>12} {:>12}".format(
+        u"nodes", u"changed", u"shared s", u"copied s")
+    for number_of_nodes in options.nodes:
+        state = DeploymentState(nodes={
+            build_node_state(options.datasets)
+            for _ in range(number_of_nodes)
+        })
+        # An equal state that shares nothing with the original, as when it
+        # has been decoded from the network:
+        copy = wire_decode(wire_encode(state))
+        for number_of_changes in options.changed:
+            if number_of_changes > number_of_nodes:
+                continue
+            changed = change_nodes(
+                state, number_of_changes, options.datasets)
+            shared = measure(
+                lambda: create_diff(state, changed), options.repeats)
+            copied = measure(
+                lambda: create_diff(copy, changed), options.repeats)
+            print "{:>8} {:>8} {:>12.5f} {:>12.5f}".format(
+                number_of_nodes, number_of_changes, shared, copied)
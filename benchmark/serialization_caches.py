@@ -0,0 +1,134 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+"""
+Compare the cost of the serialization and generation hash caches when they
+are keyed on the value of pyrsistent objects and when they are keyed on their
+identity.
+"""
+
+import argparse
+from time import time
+from uuid import uuid4
+from weakref import WeakKeyDictionary
+
+from flocker.control import Manifestation, Dataset
+from flocker.control import _compact, _persistence, _protocol
+from flocker.control._cache import IdentityCache
+from flocker.control._persistence import (
+    generation_hash, to_unserialized_json, wire_encode, WIRE_ENCODINGS,
+    WIRE_ENCODING_COMPACT,
+)
+from flocker.control._protocol import caching_wire_encode
+
+from .wire_encoding import build_deployment
+
+
+def use_caches(factory):
+    """
+    Replace the serialization and generation hash caches.
+
+    :param factory: Callable returning a new, empty cache.
+
+    :return: ``dict`` mapping names to the new caches.
+    """
+    caches = dict(
+        serialize=factory(), generation_hash=factory(), compact=factory(),
+    )
+    _persistence._cached_dfs_serialize_cache = caches["serialize"]
+    _persistence._generation_hash_cache = caches["generation_hash"]
+    _compact._encode_cache = caches["compact"]
+    for encoding in WIRE_ENCODINGS:
+        caches[encoding] = _protocol._wire_encode_caches[encoding] = factory()
+    return caches
+
+
+def add_dataset(deployment):
+    """
+    :return: ``deployment`` with a new dataset on one of its nodes, sharing
+        everything else with ``deployment``.
+    """
+    node_uuid = next(iter(deployment.nodes))
+    dataset_id = unicode(uuid4())
+    return deployment.transform(
+        ["nodes", node_uuid, "manifestations", dataset_id],
+        Manifestation(dataset=Dataset(dataset_id=dataset_id), primary=True),
+    )
+
+
+def changed(operation):
+    """
+    :param operation: A one-argument callable.
+
+    :return: A callable which measures ``operation`` on a configuration that
+        differs by one dataset from one it has already been applied to.
+    """
+    def measure(deployment):
+        operation(deployment)
+        latest = add_dataset(deployment)
+        start = time()
+        operation(latest)
+        return time() - start
+    return measure
+
+
+def repeated(operation, calls):
+    """
+    :param operation: A one-argument callable.
+    :param int calls: The number of times to call it.
+
+    :return: A callable which measures calling ``operation`` on a
+        configuration it has already been applied to ``calls`` times, as
+        happens when it is sent to each connected agent.
+    """
+    def measure(deployment):
+        operation(deployment)
+        start = time()
+        for _ in range(calls):
+            operation(deployment)
+        return time() - start
+    return measure
+
+
+OPERATIONS = [
+    (u"generation_hash", changed(generation_hash)),
+    (u"to_unserialized_json", changed(to_unserialized_json)),
+    (u"wire_encode compact",
+     changed(lambda d: wire_encode(d, WIRE_ENCODING_COMPACT))),
+    (u"caching_wire_encode x100", repeated(caching_wire_encode, 100)),
+]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--nodes', type=int, default=10, help='Number of nodes.')
+    parser.add_argument(
+        '--datasets', type=int, default=10000, help='Number of datasets.')
+    parser.add_argument(
+        '--repeats', type=int, default=5,
+        help='Number of times to repeat each measurement.')
+    options = parser.parse_args(args)
+
+    print "{:>26} {:>12} {:>12}".format(u"", u"by value s", u"identity s")
+    statistics = {}
+    for name, operation in OPERATIONS:
+        timings = []
+        for factory in (WeakKeyDictionary, IdentityCache):
+            caches = use_caches(factory)
+            # Each repeat uses a newly built configuration, so that earlier
+            # repeats don't warm the caches:
+            timings.append(min(
+                operation(build_deployment(options.nodes, options.datasets))
+                for _ in range(options.repeats)
+            ))
+        for cache_name, cache in caches.items():
+            statistics.setdefault(cache_name, []).append(cache.statistics())
+        print "{:>26} {:>12.4f} {:>12.4f}".format(name, *timings)
+
+    print
+    print "{:>26} {:>10} {:>10} {:>10}".format(
+        u"identity cache", u"hits", u"misses", u"evictions")
+    for cache_name, results in sorted(statistics.items()):
+        print "{:>26} {:>10} {:>10} {:>10}".format(
+            cache_name,
+            *(sum(result[counter] for result in results)
+              for counter in (u"hits", u"misses", u"evictions")))
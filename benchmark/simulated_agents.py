@@ -0,0 +1,469 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+"""
+Measure how the control service copes with increasing numbers of agents,
+using simulated agents on this machine instead of a cluster.
+
+A real control service is started in this process.  Simulated agents connect
+to it over loopback TLS from child processes, each periodically sending
+synthetic node state.  For each number of agents, the configuration is
+changed a number of times and the time until every agent has acknowledged
+each change is measured, along with the CPU and memory used by the control
+service and the bytes of cluster updates it sent.
+
+The simulated agents decode every update they are sent, as real ones do, so
+give their processes enough CPUs that the latencies measured are those of the
+control service rather than of the agents.  Thousands of agents need as many
+file descriptors in this process, so raise the hard limit on open files
+(``ulimit -Hn``) if necessary.
+"""
+
+import argparse
+import os
+import resource
+import socket
+import sys
+from random import Random
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+from uuid import uuid4
+
+import psutil
+
+from eliot import Logger, start_action
+from zope.interface import implementer
+
+from twisted.internet.defer import (
+    Deferred, DeferredSemaphore, gatherResults, inlineCallbacks, returnValue,
+)
+from twisted.internet.endpoints import (
+    TCP4ClientEndpoint, TCP4ServerEndpoint, connectProtocol, wrapClientTLS,
+)
+from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.task import LoopingCall, deferLater, react
+from twisted.python.filepath import FilePath
+
+from flocker.ca import (
+    RootCredential, ControlCredential, NodeCredential, ControlServicePolicy,
+    amp_server_context_factory,
+)
+from flocker.control import (
+    AgentAMP, IConvergenceAgent, NodeState, NodeStateCommand,
+)
+from flocker.control._clusterstate import ClusterStateService
+from flocker.control._metrics import MetricsRegistry
+from flocker.control._persistence import (
+    ConfigurationPersistenceService, make_generation_hash,
+)
+from flocker.control._protocol import ControlAMPService
+from flocker.control.testtools import node_strategy
+
+from .serialization_caches import add_dataset
+from .wire_encoding import build_deployment
+
+# Run in the child processes to connect their share of the agents:
+_AGENTS_SCRIPT = (
+    b"import sys; from benchmark.simulated_agents import agents_main; "
+    b"agents_main(sys.argv[1:])"
+)
+
+# The commands the control service sends cluster updates with:
+_UPDATE_COMMANDS = [u"ClusterStatusCommand", u"ClusterStatusDiffCommand"]
+
+
+def raise_file_limit():
+    """
+    Allow this process to open as many files as its hard limit allows.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def free_port():
+    """
+    :return int: A loopback TCP port nothing is currently listening on.
+    """
+    probe = socket.socket()
+    try:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+    finally:
+        probe.close()
+
+
+def synthetic_states(count, seed):
+    """
+    Generate the applications and datasets of simulated nodes.
+
+    :param int count: The number of different nodes to generate.
+    :param int seed: Seed for choosing the nodes' addresses.
+
+    :return: ``list`` of functions which take a node UUID and return a
+        ``NodeState`` for that node.
+    """
+    random = Random(seed)
+    states = []
+    for _ in range(count):
+        node = node_strategy().example()
+        hostname = u"10.{}.{}.{}".format(
+            *(random.randrange(256) for _ in range(3)))
+        states.append(
+            lambda uuid, node=node, hostname=hostname: NodeState(
+                uuid=uuid,
+                hostname=hostname,
+                applications=node.applications,
+                manifestations=node.manifestations,
+                paths={
+                    dataset_id: FilePath(b"/flocker").child(dataset_id)
+                    for dataset_id in node.manifestations
+                },
+                devices={},
+            )
+        )
+    return states
+
+
+@implementer(IConvergenceAgent)
+class SimulatedAgent(object):
+    """
+    An agent that sends the control service a different synthetic state of
+    its node at a regular interval, and otherwise ignores the cluster.
+
+    :ivar int updates: The number of cluster updates received.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, states, interval, random):
+        """
+        :param reactor: The reactor to use.
+        :param states: ``list`` of functions returning ``NodeState`` s, as
+            returned by ``synthetic_states``.
+        :param float interval: Seconds between sending states.
+        :param Random random: Source of the states to send.
+        """
+        self._reactor = reactor
+        self._states = states
+        self._interval = interval
+        self._random = random
+        self._uuid = uuid4()
+        self._client = None
+        self._sending = None
+        self._outstanding = False
+        self.updates = 0
+
+    def connected(self, client):
+        self._client = client
+        # Agents report their state as soon as they connect:
+        self._sending = LoopingCall(self.send_state)
+        self._sending.clock = self._reactor
+        self._sending.start(self._interval, now=True)
+
+    def disconnected(self):
+        self._client = None
+        if self._sending is not None and self._sending.running:
+            self._sending.stop()
+
+    def cluster_updated(self, configuration, cluster_state):
+        self.updates += 1
+
+    def send_state(self):
+        """
+        Send a new state unless the previous one is still unacknowledged, as
+        the convergence loop does.
+        """
+        if self._outstanding or self._client is None:
+            return
+        state = self._random.choice(self._states)(self._uuid)
+        self._outstanding = True
+        with start_action(
+                self.logger, u"benchmark:simulated_agent:send_state"
+        ) as action:
+            d = self._client.callRemote(
+                NodeStateCommand, state_changes=(state,),
+                eliot_context=action)
+
+        def acknowledged(result):
+            self._outstanding = False
+            return result
+        d.addBoth(acknowledged)
+        d.addErrback(lambda failure: sys.stderr.write(
+            "Sending state failed: {}\n".format(failure.getErrorMessage())))
+
+
+@inlineCallbacks
+def run_agents(reactor, options):
+    """
+    Connect simulated agents to a control service and keep them running
+    until this process is killed.
+    """
+    raise_file_limit()
+    certificates = FilePath(options.certificates_directory)
+    root = RootCredential.from_path(certificates)
+    node = NodeCredential.from_path(certificates, options.node_uuid)
+    policy = ControlServicePolicy(
+        ca_certificate=root.credential.certificate,
+        client_credential=node.credential)
+    endpoint = wrapClientTLS(
+        policy.creatorForNetloc(options.host, options.port),
+        TCP4ClientEndpoint(reactor, options.host, options.port))
+
+    random = Random(options.seed)
+    states = synthetic_states(options.states, options.seed)
+    # Too many simultaneous handshakes overflow the listen backlog:
+    connecting = DeferredSemaphore(100)
+    yield gatherResults([
+        connecting.run(
+            connectProtocol, endpoint, AgentAMP(
+                reactor, SimulatedAgent(
+                    reactor, states, options.interval, random)))
+        for _ in range(options.agents)
+    ], consumeErrors=True)
+    yield Deferred()
+
+
+def agents_main(args):
+    parser = argparse.ArgumentParser(
+        description="Simulated agents for the simulated-agents benchmark.")
+    parser.add_argument('--host', default=b"127.0.0.1")
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--certificates-directory', required=True)
+    parser.add_argument('--node-uuid', required=True)
+    parser.add_argument('--agents', type=int, required=True)
+    parser.add_argument('--interval', type=float, required=True)
+    parser.add_argument('--states', type=int, required=True)
+    parser.add_argument('--seed', type=int, required=True)
+    options = parser.parse_args(args)
+    react(run_agents, [options])
+
+
+class AgentProcess(ProcessProtocol):
+    """
+    A child process running simulated agents.
+
+    :ivar ended: ``Deferred`` that fires when the process exits.
+    """
+    def __init__(self):
+        self.ended = Deferred()
+        self.stopping = False
+        self._errors = []
+
+    def errReceived(self, data):
+        self._errors.append(data)
+
+    def processEnded(self, reason):
+        if not self.stopping:
+            sys.stderr.write(
+                "Simulated agent process exited unexpectedly:\n{}\n".format(
+                    b"".join(self._errors)))
+        self.ended.callback(None)
+
+    def stop(self):
+        """
+        Kill the process.
+
+        :return: ``Deferred`` that fires when it has exited.
+        """
+        self.stopping = True
+        self.transport.signalProcess("KILL")
+        return self.ended
+
+
+@inlineCallbacks
+def wait_for(reactor, predicate, timeout, description):
+    """
+    Poll until a condition is true.
+
+    :param reactor: The reactor to use.
+    :param predicate: No-argument callable returning whether to stop waiting.
+    :param float timeout: Seconds to wait before giving up.
+    :param str description: What is being waited for, for the error raised
+        on timeout.
+
+    :return: ``Deferred`` firing with the seconds waited.
+    """
+    start = time()
+    while not predicate():
+        if time() - start > timeout:
+            raise RuntimeError(
+                "Timed out after {}s waiting for {}".format(
+                    timeout, description))
+        yield deferLater(reactor, 0.01, lambda: None)
+    returnValue(time() - start)
+
+
+def all_acknowledged(service, generation):
+    """
+    :param ControlAMPService service: The control service.
+    :param GenerationHash generation: A generation of the configuration.
+
+    :return bool: Whether every connected agent has acknowledged receiving
+        that configuration.
+    """
+    received = service._last_received_generation
+    return all(
+        connection in received and
+        received[connection].config_hash == generation
+        for connection in service._connections
+    )
+
+
+def update_bytes(metrics):
+    """
+    :param MetricsRegistry metrics: The control service's metrics.
+
+    :return int: The bytes of cluster updates sent to agents.
+    """
+    return sum(
+        metrics.distribution(
+            u"amp.{}.request_bytes".format(command))["total"]
+        for command in _UPDATE_COMMANDS
+    )
+
+
+@inlineCallbacks
+def measure(reactor, service, persistence, options):
+    """
+    Change the configuration repeatedly and measure how the control service
+    copes with the agents currently connected.
+
+    :return: ``Deferred`` firing with a ``dict`` of the measurements.
+    """
+    process = psutil.Process()
+    service.metrics.clear()
+    cpu = process.cpu_times()
+    start = time()
+    latencies = []
+    for _ in range(options.changes):
+        yield deferLater(reactor, options.change_interval, lambda: None)
+        configuration = add_dataset(persistence.get())
+        generation = make_generation_hash(configuration)
+        sent = time()
+        yield persistence.save(configuration)
+        yield wait_for(
+            reactor, lambda: all_acknowledged(service, generation),
+            options.timeout, "agents to acknowledge the configuration")
+        latencies.append(time() - sent)
+    elapsed = time() - start
+    used = process.cpu_times()
+    latencies.sort()
+    returnValue(dict(
+        median=latencies[len(latencies) // 2],
+        maximum=latencies[-1],
+        cpu=(used.user + used.system - cpu.user - cpu.system) / elapsed,
+        rss=process.memory_info().rss,
+        sent=update_bytes(service.metrics) / elapsed,
+    ))
+
+
+@inlineCallbacks
+def run(reactor, options):
+    raise_file_limit()
+    directory = FilePath(mkdtemp())
+    processes = []
+    services = []
+    try:
+        certificates = directory.child(b"certificates")
+        certificates.makedirs()
+        root = RootCredential.initialize(certificates, b"simulated-agents")
+        control = ControlCredential.initialize(
+            certificates, root, b"127.0.0.1")
+        node = NodeCredential.initialize(certificates, root)
+
+        persistence = ConfigurationPersistenceService(
+            reactor, directory.child(b"data"))
+        cluster_state = ClusterStateService(reactor)
+        port = free_port()
+        service = ControlAMPService(
+            reactor, cluster_state, persistence,
+            TCP4ServerEndpoint(reactor, port, interface=b"127.0.0.1"),
+            amp_server_context_factory(
+                root.credential.certificate, control),
+            metrics=MetricsRegistry())
+        for child in [persistence, cluster_state, service]:
+            child.startService()
+            services.insert(0, child)
+        yield persistence.save(
+            build_deployment(options.nodes, options.datasets))
+
+        environment = os.environ.copy()
+        environment[b"PYTHONPATH"] = os.pathsep.join(
+            [FilePath(__file__).parent().parent().path] +
+            filter(None, [environment.get(b"PYTHONPATH")]))
+
+        print "{:>7} {:>10} {:>10} {:>7} {:>9} {:>12}".format(
+            "agents", "median s", "max s", "cpu %", "rss MiB", "sent KiB/s")
+        started = 0
+        for count in sorted(options.agents):
+            while started < count:
+                batch = min(options.agents_per_process, count - started)
+                process = AgentProcess()
+                reactor.spawnProcess(
+                    process, sys.executable, [
+                        sys.executable, b"-c", _AGENTS_SCRIPT,
+                        b"--port", bytes(port),
+                        b"--certificates-directory", certificates.path,
+                        b"--node-uuid", bytes(node.uuid),
+                        b"--agents", bytes(batch),
+                        b"--interval", bytes(options.state_interval),
+                        b"--states", bytes(options.states),
+                        b"--seed", bytes(len(processes)),
+                    ],
+                    env=environment)
+                processes.append(process)
+                started += batch
+            yield wait_for(
+                reactor, lambda: len(service._connections) >= count,
+                options.timeout, "{} agents to connect".format(count))
+            # Let newly connected agents catch up before measuring:
+            current = make_generation_hash(persistence.get())
+            yield wait_for(
+                reactor, lambda: all_acknowledged(service, current),
+                options.timeout, "agents to receive the configuration")
+            result = yield measure(reactor, service, persistence, options)
+            print (
+                "{:>7} {:>10.3f} {:>10.3f} {:>7.1f} {:>9.1f} {:>12.1f}".format(
+                    count, result["median"], result["maximum"],
+                    result["cpu"] * 100, result["rss"] / 1024.0 ** 2,
+                    result["sent"] / 1024.0))
+    finally:
+        yield gatherResults([process.stop() for process in processes])
+        for child in services:
+            yield child.stopService()
+        rmtree(directory.path)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--agents', type=int, nargs='+', default=[10, 100, 1000, 5000],
+        help='Numbers of agents to measure the control service with.')
+    parser.add_argument(
+        '--agents-per-process', type=int, default=500,
+        help='Number of agents to simulate in each child process.')
+    parser.add_argument(
+        '--state-interval', type=float, default=30.0,
+        help='Seconds between each agent sending its state.')
+    parser.add_argument(
+        '--states', type=int, default=20,
+        help='Number of different synthetic node states each child process '
+             'chooses from.')
+    parser.add_argument(
+        '--nodes', type=int, default=10,
+        help='Number of nodes in the configuration.')
+    parser.add_argument(
+        '--datasets', type=int, default=1000,
+        help='Number of datasets in the configuration.')
+    parser.add_argument(
+        '--changes', type=int, default=5,
+        help='Number of configuration changes to measure for each number '
+             'of agents.')
+    parser.add_argument(
+        '--change-interval', type=float, default=5.0,
+        help='Seconds to wait before each configuration change.')
+    parser.add_argument(
+        '--timeout', type=float, default=600.0,
+        help='Seconds to wait for agents to connect or acknowledge a change.')
+    options = parser.parse_args(args)
+    react(run, [options])
@@ -0,0 +1,97 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+"""
+Compare the size and speed of the wire encodings of the cluster
+configuration.
+"""
+
+import argparse
+from functools import partial
+from time import time
+from uuid import uuid4
+
+from flocker.control import Deployment, Node, Manifestation, Dataset
+from flocker.control._persistence import (
+    wire_encode, wire_decode, WIRE_ENCODINGS,
+)
+
+
+def build_deployment(number_of_nodes, number_of_datasets):
+    """
+    Build a configuration with datasets spread evenly across nodes.
+
+    :param int number_of_nodes: The number of nodes.
+    :param int number_of_datasets: The number of datasets.
+
+    :return Deployment: The configuration.
+    """
+    nodes = [Node(uuid=uuid4()) for _ in range(number_of_nodes)]
+    evolvers = [node.manifestations.evolver() for node in nodes]
+    for index in range(number_of_datasets):
+        dataset_id = unicode(uuid4())
+        evolvers[index % number_of_nodes][dataset_id] = Manifestation(
+            dataset=Dataset(
+                dataset_id=dataset_id,
+                maximum_size=1024 * 1024 * 1024,
+                metadata={u"name": u"dataset-%d" % (index,)},
+            ),
+            primary=True,
+        )
+    return Deployment(nodes={
+        node.set(manifestations=evolver.persistent())
+        for node, evolver in zip(nodes, evolvers)
+    })
+
+
+def measure(build, encoding, repeats):
+    """
+    Measure encoding and decoding a configuration.
+
+    Each repeat encodes a newly built configuration, so that the caches of
+    previously encoded objects do not flatter the results.
+
+    :param build: Callable returning the ``Deployment`` to encode.
+    :param unicode encoding: The encoding to use.
+    :param int repeats: The number of times to encode and decode.
+
+    :return: ``dict`` of the encoded size and the fastest encode and decode
+        times.
+    """
+    encode_times = []
+    decode_times = []
+    for _ in range(repeats):
+        deployment = build()
+        start = time()
+        encoded = wire_encode(deployment, encoding)
+        encode_times.append(time() - start)
+        start = time()
+        decoded = wire_decode(encoded)
+        decode_times.append(time() - start)
+        if decoded != deployment:
+            raise AssertionError(
+                "{} encoding did not roundtrip".format(encoding))
+    return dict(
+        size=len(encoded), encode=min(encode_times), decode=min(decode_times),
+    )
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--nodes', type=int, default=10, help='Number of nodes.')
+    parser.add_argument(
+        '--datasets', type=int, nargs='+', default=[1000, 10000],
+        help='Numbers of datasets to measure configurations with.')
+    parser.add_argument(
+        '--repeats', type=int, default=5,
+        help='Number of times to repeat each measurement.')
+    options = parser.parse_args(args)
+
+    print "{:>9} {:>10} {:>12} {:>10} {:>10}".format(
+        "datasets", "encoding", "bytes", "encode s", "decode s")
+    for number_of_datasets in options.datasets:
+        build = partial(build_deployment, options.nodes, number_of_datasets)
+        for encoding in WIRE_ENCODINGS:
+            result = measure(build, encoding, options.repeats)
+            print "{:>9} {:>10} {:>12} {:>10.4f} {:>10.4f}".format(
+                number_of_datasets, encoding, result["size"],
+                result["encode"], result["decode"])
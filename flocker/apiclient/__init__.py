@@ -9,10 +9,10 @@ This may eventually be a standalone package.
 from ._client import (
     IFlockerAPIV1Client, FakeFlockerClient, Dataset, DatasetState,
     DatasetAlreadyExists, FlockerClient, Lease, LeaseAlreadyHeld,
-    conditional_create, DatasetsConfiguration, Node, MountedDataset,
+    conditional_create, DatasetsConfiguration, Node, MountedDataset, NotFound,
 )
 
 __all__ = ["IFlockerAPIV1Client", "FakeFlockerClient", "Dataset",
            "DatasetState", "DatasetAlreadyExists", "FlockerClient",
            "Lease", "LeaseAlreadyHeld", "conditional_create",
-           "DatasetsConfiguration", "Node", "MountedDataset", ]
+           "DatasetsConfiguration", "Node", "MountedDataset", "NotFound", ]
@@ -8,6 +8,7 @@ from uuid import UUID, uuid4
 from json import dumps
 from datetime import datetime
 from os import environ
+from functools import partial
 
 from ipaddr import IPv4Address, IPv6Address, IPAddress
 
@@ -20,10 +21,10 @@ from pyrsistent import PClass, field, pmap_field, pmap
 from eliot import ActionType, Field
 from eliot.twisted import DeferredContext
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import succeed, fail, maybeDeferred
 from twisted.python.filepath import FilePath
 from twisted.web.http import (
-    CREATED, OK, CONFLICT, NOT_FOUND, PRECONDITION_FAILED,
+    CREATED, OK, CONFLICT, NOT_FOUND, PRECONDITION_FAILED, NOT_MODIFIED,
 )
 from twisted.internet.utils import getProcessOutput
 from twisted.internet.task import deferLater
@@ -288,6 +289,51 @@ class IFlockerAPIV1Client(Interface):
         been deleted, after the configuration has been updated.
         """
 
+    def create_datasets(datasets, configuration_tag=None):
+        """
+        Create several new datasets in the configuration at once.
+
+        :param datasets: Iterable of ``dict`` s of the keyword arguments to
+            ``create_dataset`` for each dataset, other than
+            ``configuration_tag``.
+        :param configuration_tag: If not ``None``, should be
+            ``DatasetsConfiguration.tag``.
+
+        :return: ``Deferred`` that fires after the configuration has been
+            updated with a ``list`` giving, in order, the resulting
+            ``Dataset`` for each dataset created or the exception, such as
+            ``DatasetAlreadyExists``, explaining why it was not.
+        """
+
+    def move_datasets(moves, configuration_tag=None):
+        """
+        Move several datasets to new locations at once.
+
+        :param moves: Iterable of ``(primary, dataset_id)`` pairs of the
+            arguments to ``move_dataset`` for each dataset.
+        :param configuration_tag: If not ``None``, should be
+            ``DatasetsConfiguration.tag``.
+
+        :return: ``Deferred`` that fires after the configuration has been
+            updated with a ``list`` giving, in order, the resulting
+            ``Dataset`` for each dataset moved or the exception explaining
+            why it was not.
+        """
+
+    def delete_datasets(dataset_ids, configuration_tag=None):
+        """
+        Delete several datasets at once.
+
+        :param dataset_ids: Iterable of the UUIDs of the datasets to delete.
+        :param configuration_tag: If not ``None``, should be
+            ``DatasetsConfiguration.tag``.
+
+        :return: ``Deferred`` that fires after the configuration has been
+            updated with a ``list`` giving, in order, the ``Dataset`` that
+            has been deleted for each dataset or the exception explaining
+            why it was not.
+        """
+
     def list_datasets_configuration():
         """
         Return the configured datasets, excluding any datasets that
@@ -296,6 +342,16 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with a ``DatasetsConfiguration``.
         """
 
+    def get_dataset_configuration(dataset_id):
+        """
+        Return a configured dataset.
+
+        :param UUID dataset_id: The dataset to look up.
+
+        :return: ``Deferred`` firing with the ``Dataset``, or failing with
+            ``NotFound`` if it is not configured or has been deleted.
+        """
+
     def list_datasets_state():
         """
         Return the actual datasets in the cluster.
@@ -303,6 +359,16 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with iterable of ``DatasetState``.
         """
 
+    def get_dataset_state(dataset_id):
+        """
+        Return the actual state of a dataset in the cluster.
+
+        :param UUID dataset_id: The dataset to look up.
+
+        :return: ``Deferred`` firing with the ``DatasetState``, or failing
+            with ``NotFound`` if the dataset is not known to exist.
+        """
+
     def acquire_lease(dataset_id, node_uuid, expires):
         """
         Acquire a lease on a dataset on a given node.
@@ -336,6 +402,16 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with a list of ``Lease`` instance.
         """
 
+    def get_lease(dataset_id):
+        """
+        Return the current lease on a dataset.
+
+        :param UUID dataset_id: The dataset for which the lease applies.
+
+        :return: ``Deferred`` firing with the ``Lease``, or failing with
+            ``NotFound`` if there is no lease on the dataset.
+        """
+
     def version():
         """
         Return current version.
@@ -352,6 +428,16 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with a ``list`` of ``Node``.
         """
 
+    def get_node(node_uuid):
+        """
+        Get information about an active cluster node.
+
+        :param UUID node_uuid: The node to look up.
+
+        :return: ``Deferred`` firing with the ``Node``, or failing with
+            ``NotFound`` if the node is not active.
+        """
+
     def create_container(node_uuid, name, image, volumes=None):
         """
         :param UUID node_uuid: The ``UUID`` of the node where the container
@@ -372,6 +458,14 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with ``iterable`` of ``Container``.
         """
 
+    def get_container_configuration(name):
+        """
+        :param unicode name: The name of the container to look up.
+
+        :return: ``Deferred`` firing with the configured ``Container``, or
+            failing with ``NotFound`` if it is not configured.
+        """
+
     def list_containers_state():
         """
         Return the actual containers in the cluster.
@@ -461,6 +555,40 @@ class FakeFlockerClient(object):
             [dataset_id, "primary"], primary)
         return succeed(self._configured_datasets[dataset_id])
 
+    def _apply_all(self, operations, configuration_tag):
+        """
+        Call each of the no-argument functions ``operations``, collecting
+        their results or the exceptions they failed with.
+        """
+        try:
+            self._ensure_matching_tag(configuration_tag)
+        except:
+            return fail()
+
+        results = []
+        for operation in operations:
+            d = maybeDeferred(operation)
+            d.addErrback(lambda failure: failure.value)
+            d.addCallback(results.append)
+        return succeed(results)
+
+    def create_datasets(self, datasets, configuration_tag=None):
+        return self._apply_all(
+            [partial(self.create_dataset, **dataset) for dataset in datasets],
+            configuration_tag)
+
+    def move_datasets(self, moves, configuration_tag=None):
+        return self._apply_all(
+            [partial(self.move_dataset, primary, dataset_id)
+             for primary, dataset_id in moves],
+            configuration_tag)
+
+    def delete_datasets(self, dataset_ids, configuration_tag=None):
+        return self._apply_all(
+            [partial(self.delete_dataset, dataset_id)
+             for dataset_id in dataset_ids],
+            configuration_tag)
+
     def list_datasets_configuration(self):
         return succeed(DatasetsConfiguration(
             # Since the tag is opaque object, using the actual configuration
@@ -468,9 +596,21 @@ class FakeFlockerClient(object):
             tag=self._configured_datasets,
             datasets=self._configured_datasets))
 
+    def get_dataset_configuration(self, dataset_id):
+        dataset = self._configured_datasets.get(dataset_id)
+        if dataset is None:
+            return fail(NotFound())
+        return succeed(dataset)
+
     def list_datasets_state(self):
         return succeed(self._state_datasets)
 
+    def get_dataset_state(self, dataset_id):
+        for dataset in self._state_datasets:
+            if dataset.dataset_id == dataset_id:
+                return succeed(dataset)
+        return fail(NotFound())
+
     def synchronize_state(self):
         """
         Copy configuration into state.
@@ -508,17 +648,26 @@ class FakeFlockerClient(object):
         # expand this logic.
         lease = self._leases[dataset_id]
         self._leases = self._leases.release(dataset_id, lease.node_id)
-        return succeed(
-            Lease(dataset_id=dataset_id, node_uuid=lease.node_id,
-                  expires=((lease.expiration - self._NOW).total_seconds()
-                           if lease.expiration is not None else None)))
+        return succeed(self._lease(lease))
+
+    def _lease(self, lease):
+        """
+        :param flocker.control.Lease lease: A lease in the configuration.
+
+        :return: The corresponding ``Lease``.
+        """
+        return Lease(dataset_id=lease.dataset_id, node_uuid=lease.node_id,
+                     expires=((lease.expiration - self._NOW).total_seconds()
+                              if lease.expiration is not None else None))
 
     def list_leases(self):
-        return succeed([
-            Lease(dataset_id=l.dataset_id, node_uuid=l.node_id,
-                  expires=((l.expiration - self._NOW).total_seconds()
-                           if l.expiration is not None else None))
-            for l in self._leases.values()])
+        return succeed([self._lease(l) for l in self._leases.values()])
+
+    def get_lease(self, dataset_id):
+        lease = self._leases.get(dataset_id)
+        if lease is None:
+            return fail(NotFound())
+        return succeed(self._lease(lease))
 
     def version(self):
         return succeed(
@@ -528,6 +677,12 @@ class FakeFlockerClient(object):
     def list_nodes(self):
         return succeed(self._nodes)
 
+    def get_node(self, node_uuid):
+        for node in self._nodes:
+            if node.uuid == node_uuid:
+                return succeed(node)
+        return fail(NotFound())
+
     def create_container(self, node_uuid, name, image, volumes=None):
         if name in self._configured_containers:
             return fail(ContainerAlreadyExists())
@@ -545,6 +700,12 @@ class FakeFlockerClient(object):
     def list_containers_configuration(self):
         return succeed(self._configured_containers.values())
 
+    def get_container_configuration(self, name):
+        container = self._configured_containers.get(name)
+        if container is None:
+            return fail(NotFound())
+        return succeed(container)
+
     def list_containers_state(self):
         return succeed(self._state_containers)
 
@@ -556,6 +717,21 @@ class FakeFlockerClient(object):
         return succeed(self._this_node_uuid)
 
 
+def _dataset_creation(primary, maximum_size=None, dataset_id=None,
+                      metadata=pmap()):
+    """
+    :return: ``dict`` describing a dataset to create, as sent to the REST
+        API, from the arguments to ``IFlockerAPIV1Client.create_dataset``.
+    """
+    dataset = {u"primary": unicode(primary),
+               u"metadata": dict(metadata)}
+    if dataset_id is not None:
+        dataset[u"dataset_id"] = unicode(dataset_id)
+    if maximum_size is not None:
+        dataset[u"maximum_size"] = maximum_size
+    return dataset
+
+
 class ResponseError(Exception):
     """
     An unexpected response from the REST API.
@@ -576,6 +752,12 @@ class NotFound(Exception):
 class FlockerClient(object):
     """
     A client for the Flocker V1 REST API.
+
+    :ivar dict _entity_cache: Map the paths of ``GET`` requests whose
+        responses had an ``ETag`` header to a tuple of the tag, the decoded
+        JSON body and the headers of the most recent such response.  The
+        tag is sent back in an ``If-None-Match`` header, so the server can
+        answer ``NOT_MODIFIED`` instead of sending the body again.
     """
     def __init__(self, reactor, host, port,
                  ca_cluster_path, cert_path, key_path):
@@ -591,6 +773,7 @@ class FlockerClient(object):
         self._treq = treq_with_authentication(reactor, ca_cluster_path,
                                               cert_path, key_path)
         self._base_url = b"https://%s:%d/v1" % (host, port)
+        self._entity_cache = {}
 
     def _request_with_headers(
             self, method, path, body, success_codes, error_codes=None,
@@ -610,9 +793,14 @@ class FlockerClient(object):
             ``X-If-Configuration-Matches`` header.
 
         :return: ``Deferred`` firing a tuple of (decoded JSON,
-            response headers).
+            response headers).  For a ``GET`` request which the server says
+            has not changed since the previous response, these are those of
+            the previous response.
         """
         url = self._base_url + path
+        cached = None
+        if method == b"GET":
+            cached = self._entity_cache.get(path)
         action = _LOG_HTTP_REQUEST(url=url, method=method, request_body=body)
 
         if error_codes is None:
@@ -623,12 +811,27 @@ class FlockerClient(object):
                 raise error_codes[code](body)
             raise ResponseError(code, body)
 
+        def remember(result, response_headers):
+            entity_tag = response_headers.getRawHeaders(b"ETag", [None])[0]
+            if entity_tag is None:
+                self._entity_cache.pop(path, None)
+            else:
+                self._entity_cache[path] = (entity_tag,) + result
+            return result
+
         def got_response(response):
+            if cached is not None and response.code == NOT_MODIFIED:
+                action.addSuccessFields(response_code=response.code)
+                d = content(response)
+                d.addCallback(lambda _: cached[1:])
+                return d
             if response.code in success_codes:
                 action.addSuccessFields(response_code=response.code)
                 d = json_content(response)
                 d.addCallback(lambda decoded_body:
                               (decoded_body, response.headers))
+                if method == b"GET":
+                    d.addCallback(remember, response.headers)
                 return d
             else:
                 d = content(response)
@@ -645,6 +848,8 @@ class FlockerClient(object):
         if configuration_tag is not None:
             headers["X-If-Configuration-Matches"] = [
                 configuration_tag.encode("utf-8")]
+        if cached is not None:
+            headers[b"If-None-Match"] = [cached[0]]
 
         with action.context():
             request = DeferredContext(self._treq.request(
@@ -690,14 +895,58 @@ class FlockerClient(object):
         request.addCallback(self._parse_configuration_dataset)
         return request
 
+    def _bulk_update_datasets(self, operations, configuration_tag):
+        """
+        Apply several operations to datasets with a single request.
+
+        :param list operations: ``dict`` s describing the operations, as
+            accepted by the bulk dataset endpoint.
+        :param configuration_tag: If not ``None``, include value as
+            ``X-If-Configuration-Matches`` header.
+
+        :return: ``Deferred`` firing with a ``list`` of the resulting
+            ``Dataset`` or an exception for each operation.
+        """
+        request = self._request(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": operations}, {OK},
+            {PRECONDITION_FAILED: ConfigurationChanged},
+            configuration_tag=configuration_tag)
+
+        def parse_result(result):
+            if u"dataset" in result:
+                return self._parse_configuration_dataset(result[u"dataset"])
+            error = result[u"error"]
+            if error[u"code"] == CONFLICT:
+                return DatasetAlreadyExists(error)
+            return ResponseError(error[u"code"], error)
+        request.addCallback(
+            lambda body: [parse_result(result) for result in body[u"results"]])
+        return request
+
+    def create_datasets(self, datasets, configuration_tag=None):
+        return self._bulk_update_datasets(
+            [dict(_dataset_creation(**dataset), operation=u"create")
+             for dataset in datasets],
+            configuration_tag)
+
+    def move_datasets(self, moves, configuration_tag=None):
+        return self._bulk_update_datasets(
+            [{u"operation": u"move", u"primary": unicode(primary),
+              u"dataset_id": unicode(dataset_id)}
+             for primary, dataset_id in moves],
+            configuration_tag)
+
+    def delete_datasets(self, dataset_ids, configuration_tag=None):
+        return self._bulk_update_datasets(
+            [{u"operation": u"delete", u"dataset_id": unicode(dataset_id)}
+             for dataset_id in dataset_ids],
+            configuration_tag)
+
     def create_dataset(self, primary, maximum_size=None, dataset_id=None,
                        metadata=pmap(), configuration_tag=None):
-        dataset = {u"primary": unicode(primary),
-                   u"metadata": dict(metadata)}
-        if dataset_id is not None:
-            dataset[u"dataset_id"] = unicode(dataset_id)
-        if maximum_size is not None:
-            dataset[u"maximum_size"] = maximum_size
+        dataset = _dataset_creation(primary, maximum_size, dataset_id,
+                                    metadata)
         request = self._request(b"POST", b"/configuration/datasets",
                                 dataset, {CREATED},
                                 {CONFLICT: DatasetAlreadyExists,
@@ -732,24 +981,49 @@ class FlockerClient(object):
         )
         return request
 
-    def list_datasets_state(self):
-        request = self._request(b"GET", b"/state/datasets", None, {OK})
+    def get_dataset_configuration(self, dataset_id):
+        request = self._request(
+            b"GET", b"/configuration/datasets/%s" % (dataset_id,),
+            None, {OK}, {NOT_FOUND: NotFound})
+
+        def got_dataset(dataset_dict):
+            # Deleted datasets aren't listed either:
+            if dataset_dict[u"deleted"]:
+                raise NotFound(dataset_dict)
+            return self._parse_configuration_dataset(dataset_dict)
+        request.addCallback(got_dataset)
+        return request
 
-        def parse_dataset_state(dataset_dict):
-            primary = dataset_dict.get(u"primary")
-            if primary is not None:
-                primary = UUID(primary)
-            path = dataset_dict.get(u"path")
-            if path is not None:
-                path = FilePath(path)
-            return DatasetState(primary=primary,
-                                maximum_size=dataset_dict.get(
-                                    u"maximum_size", None),
-                                dataset_id=UUID(dataset_dict[u"dataset_id"]),
-                                path=path)
+    def _parse_dataset_state(self, dataset_dict):
+        """
+        Convert a dictionary decoded from JSON with a dataset's state.
+
+        :param dataset_dict: Dictionary describing a dataset.
+        :return: ``DatasetState`` instance.
+        """
+        primary = dataset_dict.get(u"primary")
+        if primary is not None:
+            primary = UUID(primary)
+        path = dataset_dict.get(u"path")
+        if path is not None:
+            path = FilePath(path)
+        return DatasetState(primary=primary,
+                            maximum_size=dataset_dict.get(
+                                u"maximum_size", None),
+                            dataset_id=UUID(dataset_dict[u"dataset_id"]),
+                            path=path)
 
+    def list_datasets_state(self):
+        request = self._request(b"GET", b"/state/datasets", None, {OK})
         request.addCallback(
-            lambda results: [parse_dataset_state(d) for d in results])
+            lambda results: [self._parse_dataset_state(d) for d in results])
+        return request
+
+    def get_dataset_state(self, dataset_id):
+        request = self._request(
+            b"GET", b"/state/datasets/%s" % (dataset_id,), None, {OK},
+            {NOT_FOUND: NotFound})
+        request.addCallback(self._parse_dataset_state)
         return request
 
     def _parse_lease(self, dictionary):
@@ -787,6 +1061,13 @@ class FlockerClient(object):
             lambda results: [self._parse_lease(l) for l in results])
         return request
 
+    def get_lease(self, dataset_id):
+        request = self._request(
+            b"GET", b"/configuration/leases/" + bytes(dataset_id),
+            None, {OK}, {NOT_FOUND: NotFound})
+        request.addCallback(self._parse_lease)
+        return request
+
     def version(self):
         return self._request(
             b"GET", b"/version", None, {OK}
@@ -838,6 +1119,16 @@ class FlockerClient(object):
         )
         return d
 
+    def get_container_configuration(self, name):
+        d = self._request(
+            b"GET", b"/configuration/containers/%s" % (
+                name.encode('ascii'),
+            ),
+            None, {OK}, {NOT_FOUND: NotFound},
+        )
+        d.addCallback(self._parse_configuration_container)
+        return d
+
     def list_containers_state(self):
         d = self._request(b"GET", b"/state/containers", None, {OK})
 
@@ -857,25 +1148,33 @@ class FlockerClient(object):
 
         return d
 
+    def _parse_node(self, node_dict):
+        """
+        Convert a dictionary decoded from JSON describing a node.
+
+        :param node_dict: Dictionary describing a node.
+        :return: ``Node`` instance.
+        """
+        return Node(
+            uuid=UUID(hex=node_dict['uuid'], version=4),
+            public_address=IPAddress(node_dict['host']),
+        )
+
     def list_nodes(self):
         request = self._request(
             b"GET", b"/state/nodes", None, {OK}
         )
+        request.addCallback(
+            lambda result: [self._parse_node(node_dict)
+                            for node_dict in result])
+        return request
 
-        def to_nodes(result):
-            """
-            Turn the list of dicts into ``Node`` instances.
-            """
-            nodes = []
-            for node_dict in result:
-                node = Node(
-                    uuid=UUID(hex=node_dict['uuid'], version=4),
-                    public_address=IPAddress(node_dict['host']),
-                )
-                nodes.append(node)
-            return nodes
-        request.addCallback(to_nodes)
-
+    def get_node(self, node_uuid):
+        request = self._request(
+            b"GET", b"/state/nodes/%s" % (node_uuid,), None, {OK},
+            {NOT_FOUND: NotFound},
+        )
+        request.addCallback(self._parse_node)
         return request
 
     def delete_container(self, name):
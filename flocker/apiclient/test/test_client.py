@@ -23,7 +23,7 @@ from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ServerEndpoint
-from twisted.web.http import BAD_REQUEST
+from twisted.web.http import BAD_REQUEST, NOT_MODIFIED, OK
 from twisted.internet.defer import gatherResults
 from twisted.python.runtime import platform
 from twisted.python.procutils import which
@@ -33,7 +33,7 @@ from .._client import (
     DatasetState, FlockerClient, ResponseError, _LOG_HTTP_REQUEST,
     Lease, LeaseAlreadyHeld, Node, Container, ContainerAlreadyExists,
     DatasetsConfiguration, ConfigurationChanged, conditional_create,
-    _LOG_CONDITIONAL_CREATE, ContainerState, MountedDataset,
+    _LOG_CONDITIONAL_CREATE, ContainerState, MountedDataset, NotFound,
 )
 from ...ca import rest_api_context_factory
 from ...ca.testtools import get_credential_sets
@@ -269,6 +269,39 @@ def make_clientv1_tests():
             d.addCallback(not_listed)
             return d
 
+        def test_get_dataset_configuration(self):
+            """
+            ``get_dataset_configuration`` returns a ``Deferred`` firing with
+            the configured ``Dataset``.
+            """
+            dataset_id = uuid4()
+            d = self.assert_creates(self.client, primary=self.node_1.uuid,
+                                    maximum_size=DATASET_SIZE,
+                                    dataset_id=dataset_id)
+            d.addCallback(
+                lambda _: self.client.get_dataset_configuration(dataset_id))
+            d.addCallback(self.assertEqual, Dataset(
+                dataset_id=dataset_id, primary=self.node_1.uuid,
+                maximum_size=DATASET_SIZE))
+            return d
+
+        def test_get_deleted_dataset_configuration(self):
+            """
+            ``get_dataset_configuration`` fails with ``NotFound`` for a
+            deleted dataset.
+            """
+            dataset_id = uuid4()
+            d = self.assert_creates(self.client, primary=self.node_1.uuid,
+                                    maximum_size=DATASET_SIZE,
+                                    dataset_id=dataset_id)
+            d.addCallback(
+                lambda _: self.client.delete_dataset(dataset_id))
+            d.addCallback(
+                lambda _: self.assertFailure(
+                    self.client.get_dataset_configuration(dataset_id),
+                    NotFound))
+            return d
+
         def test_delete_matching_tag(self):
             """
             If a matching tag is given the delete succeeds.
@@ -347,6 +380,101 @@ def make_clientv1_tests():
                                          configuration_tag=u"willnotmatch")
             return self.assertFailure(d, ConfigurationChanged)
 
+        def test_create_datasets(self):
+            """
+            ``create_datasets`` creates each of the datasets, returning the
+            resulting ``Dataset`` or why it could not be created.
+            """
+            dataset_id = uuid4()
+            d = self.client.create_datasets([
+                dict(primary=self.node_1.uuid, dataset_id=dataset_id,
+                     maximum_size=DATASET_SIZE),
+                dict(primary=self.node_2.uuid, metadata={u"x": u"y"}),
+                dict(primary=self.node_2.uuid, dataset_id=dataset_id),
+            ])
+
+            def got_result(results):
+                created, generated, conflict = results
+                self.assertEqual(
+                    ([Dataset(dataset_id=dataset_id, primary=self.node_1.uuid,
+                              maximum_size=DATASET_SIZE),
+                      Dataset(dataset_id=generated.dataset_id,
+                              primary=self.node_2.uuid, maximum_size=None,
+                              metadata={u"x": u"y"})],
+                     DatasetAlreadyExists),
+                    ([created, generated], type(conflict)))
+                listed = self.client.list_datasets_configuration()
+                listed.addCallback(lambda result: self.assertEqual(
+                    {created, generated}, set(result)))
+                return listed
+            d.addCallback(got_result)
+            return d
+
+        def test_move_datasets(self):
+            """
+            ``move_datasets`` changes the primary of each of the datasets.
+            """
+            d = self.client.create_datasets([
+                dict(primary=self.node_1.uuid),
+                dict(primary=self.node_2.uuid),
+            ])
+            d.addCallback(lambda datasets: self.client.move_datasets([
+                (self.node_2.uuid, datasets[0].dataset_id),
+                (self.node_1.uuid, datasets[1].dataset_id),
+            ]))
+
+            def got_result(moved):
+                self.assertEqual(
+                    [self.node_2.uuid, self.node_1.uuid],
+                    [dataset.primary for dataset in moved])
+                listed = self.client.list_datasets_configuration()
+                listed.addCallback(
+                    lambda result: self.assertEqual(set(moved), set(result)))
+                return listed
+            d.addCallback(got_result)
+            return d
+
+        def test_delete_datasets(self):
+            """
+            ``delete_datasets`` deletes each of the datasets, returning the
+            deleted ``Dataset`` s.
+            """
+            d = self.client.create_datasets([
+                dict(primary=self.node_1.uuid),
+                dict(primary=self.node_2.uuid),
+            ])
+
+            def created(datasets):
+                deleting = self.client.delete_datasets(
+                    [dataset.dataset_id for dataset in datasets])
+                deleting.addCallback(self.assertEqual, datasets)
+                return deleting
+            d.addCallback(created)
+            d.addCallback(lambda _: self.client.list_datasets_configuration())
+            d.addCallback(lambda result: self.assertFalse(result.datasets))
+            return d
+
+        def test_bulk_matching_tag(self):
+            """
+            If a matching tag is given the bulk operations succeed.
+            """
+            d = self.client.create_datasets(
+                [dict(primary=self.node_1.uuid)],
+                configuration_tag=self.get_configuration_tag())
+            d.addCallback(lambda _: self.client.list_datasets_configuration())
+            d.addCallback(
+                lambda result: self.assertEqual(1, len(result.datasets)))
+            return d
+
+        def test_bulk_conflicting_tag(self):
+            """
+            If a conflicting tag is given then an appropriate exception is
+            raised.
+            """
+            d = self.client.delete_datasets([uuid4()],
+                                            configuration_tag=u"willnotmatch")
+            return self.assertFailure(d, ConfigurationChanged)
+
         def test_dataset_state(self):
             """
             ``list_datasets_state`` returns information about state.
@@ -367,6 +495,34 @@ def make_clientv1_tests():
                               states))
             return d
 
+        def test_get_dataset_state(self):
+            """
+            ``get_dataset_state`` returns a ``Deferred`` firing with the
+            ``DatasetState`` of the given dataset.
+            """
+            dataset_id = uuid4()
+            expected_path = FilePath(b"/flocker/{}".format(dataset_id))
+            d = self.assert_creates(self.client, primary=self.node_1.uuid,
+                                    maximum_size=DATASET_SIZE * 2,
+                                    dataset_id=dataset_id)
+            d.addCallback(lambda _: self.synchronize_state())
+            d.addCallback(
+                lambda _: self.client.get_dataset_state(dataset_id))
+            d.addCallback(self.assertEqual,
+                          DatasetState(dataset_id=dataset_id,
+                                       primary=self.node_1.uuid,
+                                       maximum_size=DATASET_SIZE * 2,
+                                       path=expected_path))
+            return d
+
+        def test_get_unknown_dataset_state(self):
+            """
+            ``get_dataset_state`` fails with ``NotFound`` for a dataset that
+            is not known to exist.
+            """
+            return self.assertFailure(
+                self.client.get_dataset_state(uuid4()), NotFound)
+
         def test_acquire_lease_result(self):
             """
             ``acquire_lease`` returns a ``Deferred`` firing with ``Lease``
@@ -419,6 +575,31 @@ def make_clientv1_tests():
             )
             return d
 
+        def test_get_lease(self):
+            """
+            ``get_lease`` returns a ``Deferred`` firing with the ``Lease`` on
+            the given dataset.
+            """
+            dataset_id = uuid4()
+            d = self.client.acquire_lease(dataset_id, self.node_1.uuid, 10)
+            d.addCallback(lambda _: self.client.get_lease(dataset_id))
+            d.addCallback(self.assertEqual, Lease(dataset_id=dataset_id,
+                                                  node_uuid=self.node_1.uuid,
+                                                  expires=10))
+            return d
+
+        def test_get_released_lease(self):
+            """
+            ``get_lease`` fails with ``NotFound`` once the lease has been
+            released.
+            """
+            dataset_id = uuid4()
+            d = self.client.acquire_lease(dataset_id, self.node_1.uuid, 10)
+            d.addCallback(lambda _: self.client.release_lease(dataset_id))
+            d.addCallback(lambda _: self.assertFailure(
+                self.client.get_lease(dataset_id), NotFound))
+            return d
+
         def test_renew_lease(self):
             """
             Acquiring a lease twice on the same dataset and node renews it.
@@ -629,6 +810,33 @@ def make_clientv1_tests():
             )
             return d
 
+        def test_get_container_configuration(self):
+            """
+            ``get_container_configuration`` returns a ``Deferred`` firing
+            with the configured ``Container``.
+            """
+            expected_container, d = create_container_for_test(
+                self, self.client
+            )
+            d.addCallback(
+                lambda ignored: self.client.get_container_configuration(
+                    expected_container.name
+                )
+            )
+            d.addCallback(self.assertEqual, expected_container)
+            return d
+
+        def test_get_unknown_container_configuration(self):
+            """
+            ``get_container_configuration`` fails with ``NotFound`` for a
+            container that is not configured.
+            """
+            return self.assertFailure(
+                self.client.get_container_configuration(
+                    random_name(case=self)),
+                NotFound,
+            )
+
         def test_list_nodes(self):
             """
             ``list_nodes`` returns a ``Deferred`` firing with a ``list`` of
@@ -642,6 +850,22 @@ def make_clientv1_tests():
             )
             return d
 
+        def test_get_node(self):
+            """
+            ``get_node`` returns a ``Deferred`` firing with the ``Node`` with
+            the given UUID.
+            """
+            d = self.client.get_node(self.node_2.uuid)
+            d.addCallback(self.assertEqual, self.node_2)
+            return d
+
+        def test_get_unknown_node(self):
+            """
+            ``get_node`` fails with ``NotFound`` for a node that is not
+            active.
+            """
+            return self.assertFailure(self.client.get_node(uuid4()), NotFound)
+
         def test_this_node_uuid(self):
             """
             ``this_node_uuid`` returns ``Deferred`` firing the UUID of the
@@ -855,6 +1079,45 @@ class FlockerClientTests(make_clientv1_tests()):
                           states))
         return d
 
+    @capture_logging(None)
+    def test_not_modified(self, logger):
+        """
+        Listing the dataset state again when it has not changed gets a
+        ``NOT_MODIFIED`` response, and the same result as before.
+        """
+        d = self.client.list_datasets_state()
+
+        def listed(first):
+            listing = self.client.list_datasets_state()
+            listing.addCallback(self.assertEqual, first)
+            return listing
+        d.addCallback(listed)
+        d.addCallback(lambda _: self.assertEqual(
+            [OK, NOT_MODIFIED],
+            [action.end_message["response_code"]
+             for action in LoggedAction.ofType(
+                 logger.messages, _LOG_HTTP_REQUEST)]))
+        return d
+
+    def test_modified(self):
+        """
+        Listing the dataset configuration again after it has changed gets the
+        new configuration.
+        """
+        d = self.client.list_datasets_configuration()
+        d.addCallback(lambda _: self.client.create_dataset(
+            primary=self.node_1.uuid))
+
+        def created(dataset):
+            listing = self.client.list_datasets_configuration()
+            listing.addCallback(
+                lambda configuration: self.assertEqual(
+                    ([dataset], self.get_configuration_tag()),
+                    (list(configuration), configuration.tag)))
+            return listing
+        d.addCallback(created)
+        return d
+
     def test_this_node_uuid_retry(self):
         """
         ``this_node_uuid`` retries if the node UUID is unknown.
@@ -26,8 +26,11 @@ from ._model import (
 from ._protocol import (
     IConvergenceAgent,
     NodeStateCommand,
+    NodeStateDiffCommand,
     AgentAMP,
+    ReceivedClusterStatus,
     SetNodeEraCommand,
+    SetNodeScopeCommand,
     SetBlockDeviceIdForDatasetId,
 )
 from ._registry import (
@@ -62,9 +65,12 @@ __all__ = [
 
     'IConvergenceAgent',
     'NodeStateCommand',
+    'NodeStateDiffCommand',
     'SetNodeEraCommand',
+    'SetNodeScopeCommand',
     'SetBlockDeviceIdForDatasetId',
     'AgentAMP',
+    'ReceivedClusterStatus',
     'pmap_field',
     'Lease',
     'Leases',
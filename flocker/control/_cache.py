@@ -0,0 +1,90 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_cache -*-
+
+"""
+Caches of values computed from immutable objects.
+"""
+
+from weakref import KeyedRef
+
+
+class IdentityCache(object):
+    """
+    A cache of values computed from immutable objects, keyed on the identity
+    of the object rather than on its value.
+
+    A ``WeakKeyDictionary`` looks keys up by hash and equality, which for a
+    pyrsistent object means hashing and comparing its whole structure on
+    every lookup.  Looking up by ``id`` costs the same however big the
+    object is, at the price of missing objects that are equal to, but not
+    the same as, one that has been cached.
+
+    Entries are evicted when their object is garbage collected, so a cached
+    value must not refer to its object.  Objects that can't be weakly
+    referenced are not cached.
+
+    :ivar int hits: The number of lookups that found a value.
+    :ivar int misses: The number of lookups that found no value.
+    :ivar int evictions: The number of entries removed because their object
+        was garbage collected.
+    """
+    def __init__(self):
+        # Maps ``id(obj)`` to a ``(KeyedRef to obj, value)`` tuple:
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        :param key: An object.
+        :param default: The value to return if ``key`` is not cached.
+
+        :return: The value cached for ``key``, or ``default``.
+        """
+        entry = self._entries.get(id(key))
+        # Check the object is still the one that was cached, to be robust
+        # against an evicted object's identity being reused:
+        if entry is not None and entry[0]() is key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        identity = id(key)
+        try:
+            reference = KeyedRef(key, self._evict, identity)
+        except TypeError:
+            return
+        self._entries[identity] = (reference, value)
+
+    def _evict(self, reference):
+        """
+        Remove the entry for an object that has been garbage collected.
+
+        :param KeyedRef reference: The now dead reference to the object.
+        """
+        entry = self._entries.get(reference.key)
+        if entry is not None and entry[0] is reference:
+            self._entries.pop(reference.key, None)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        self._entries.clear()
+
+    def statistics(self):
+        """
+        :return: ``dict`` of the ``hits``, ``misses`` and ``evictions``
+            counters and the current ``size`` of the cache.
+        """
+        return dict(
+            hits=self.hits, misses=self.misses, evictions=self.evictions,
+            size=len(self._entries),
+        )
@@ -5,6 +5,10 @@ Combine and retrieve current cluster state.
 """
 
 from datetime import datetime, timedelta
+from heapq import heappush, heappop
+from itertools import count
+
+from eliot import MessageType, Field, write_traceback
 
 from twisted.python.versions import Version
 from twisted.python.deprecate import deprecated
@@ -20,6 +24,16 @@ EXPIRATION_TIME = timedelta(seconds=120)
 
 v1_0 = Version("flocker", 1, 0, 0)
 
+_EPOCH = datetime.utcfromtimestamp(0)
+
+_LOG_WIPE_EXPIRED = MessageType(
+    u"flocker-control:clusterstate:wipe-expired",
+    [Field.for_types(u"sources", [int],
+                     u"The number of inactive sources whose information "
+                     u"was wiped."),
+     Field.for_types(u"wipes", [int], u"The number of wipes applied.")],
+    u"Information from inactive sources was wiped from the cluster state.")
+
 
 class _WiperAndSource(PClass):
     """
@@ -51,10 +65,25 @@ class ClusterStateService(MultiService):
     Eventually we'll probably want a better policy:
     https://clusterhq.atlassian.net/browse/FLOC-1896
 
+    Sources are kept in a heap ordered by the time their information would
+    expire if there were no further activity, so each check for expired
+    information only looks at the sources which may have expired.  A source
+    which has had activity since it was added to the heap is added back with
+    its new expiration time when it reaches the top.
+
     :ivar DeploymentState _deployment_state: The current known cluster state.
     :ivar PMap _information_wipers: Map (wiper class, wiper key) to
         ``_WiperAndSource``.
+    :ivar dict _source_keys: Map each ``IClusterStateSource`` in the heap to
+        the ``set`` of keys of ``_information_wipers`` that came from it.
+    :ivar list _expiry_heap: A heap of ``(float, int, IClusterStateSource)``
+        tuples of the time in seconds since the epoch at which a source was
+        last known to expire, a tie-breaker, and the source.
     :ivar _clock: ``IReactorTime`` provider.
+    :ivar int wipes_applied: The number of wipes applied because their source
+        was inactive.
+    :ivar list _change_callbacks: Callables to call with no arguments when
+        the cluster state changes.
     """
     def __init__(self, reactor):
         MultiService.__init__(self)
@@ -63,22 +92,78 @@ class ClusterStateService(MultiService):
         timer.clock = reactor
         timer.setServiceParent(self)
         self._information_wipers = pmap()
+        self._source_keys = {}
+        self._expiry_heap = []
+        self._sequence = count()
         self._clock = reactor
+        self.wipes_applied = 0
+        self._change_callbacks = []
+
+    def register(self, change_callback):
+        """
+        Register a function to be called whenever the cluster state changes.
+
+        :param change_callback: Callable that takes no arguments, will be
+            called when the cluster state changes.
+        """
+        self._change_callbacks.append(change_callback)
+
+    def _notify_changed(self):
+        """
+        Call all registered change callbacks.
+        """
+        for callback in self._change_callbacks:
+            try:
+                callback()
+            except:
+                write_traceback()
+
+    def _schedule_expiry(self, source):
+        """
+        Add a source to the heap at the time its information will expire if
+        there is no further activity.
+
+        :param IClusterStateSource source: The source to add.
+        """
+        expires = (source.last_activity() - _EPOCH + EXPIRATION_TIME)
+        heappush(self._expiry_heap, (
+            expires.total_seconds(), next(self._sequence), source))
 
     def _wipe_expired(self):
         """
         Clear any expired state from memory.
         """
-        current_time = datetime.utcfromtimestamp(self._clock.seconds())
+        now = self._clock.seconds()
+        current_time = datetime.utcfromtimestamp(now)
+        active = []
+        expired = 0
+        wipes = 0
         evolver = self._information_wipers.evolver()
-        for key, wipe in self._information_wipers.items():
-            last_activity = wipe.last_activity()
-            if current_time - last_activity >= EXPIRATION_TIME:
-                self._deployment_state = wipe.update_cluster_state(
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, _, source = heappop(self._expiry_heap)
+            if not self._source_keys[source]:
+                # All of its information has since come from other sources:
+                del self._source_keys[source]
+                continue
+            if current_time - source.last_activity() < EXPIRATION_TIME:
+                active.append(source)
+                continue
+            expired += 1
+            for key in self._source_keys.pop(source):
+                self._deployment_state = evolver[key].update_cluster_state(
                     self._deployment_state
                 )
                 evolver.remove(key)
+                wipes += 1
         self._information_wipers = evolver.persistent()
+        # Added back once the loop is done so a source is checked at most
+        # once per call:
+        for source in active:
+            self._schedule_expiry(source)
+        if wipes:
+            self.wipes_applied += wipes
+            _LOG_WIPE_EXPIRED(sources=expired, wipes=wipes).write()
+            self._notify_changed()
 
     def manifestation_path(self, node_uuid, dataset_id):
         """
@@ -113,16 +198,29 @@ class ClusterStateService(MultiService):
         # XXX: Multiple nodes may report being primary for a dataset. Enforce
         # consistency here. See
         # https://clusterhq.atlassian.net/browse/FLOC-1303
+        previous_state = self._deployment_state
         for change in changes:
             self._deployment_state = change.update_cluster_state(
                 self._deployment_state
             )
+        if source not in self._source_keys:
+            self._source_keys[source] = set()
+            self._schedule_expiry(source)
+        keys = self._source_keys[source]
         for change in changes:
             wiper = change.get_information_wipe()
             key = (wiper.__class__, wiper.key())
+            previous = self._information_wipers.get(key)
+            if previous is not None and previous.source is not source:
+                self._source_keys[previous.source].discard(key)
+            keys.add(key)
             self._information_wipers = self._information_wipers.set(
                 key, _WiperAndSource(wiper=wiper, source=source)
             )
+        # Agents report their full state repeatedly, which rebuilds an equal
+        # but distinct ``DeploymentState``, so identity isn't enough here:
+        if self._deployment_state != previous_state:
+            self._notify_changed()
 
     @deprecated(v1_0, "ClusterStateService.apply_changes_from_source")
     def apply_changes(self, changes):
@@ -0,0 +1,439 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_compact -*-
+
+"""
+A compact binary encoding of configuration model objects.
+
+This is an alternative to the JSON encoding produced by ``wire_encode`` and
+decodes to exactly the same objects, but is considerably smaller and faster:
+
+* Every value starts with a single tag byte rather than a quoted class name.
+* Serializable classes are identified by an index into ``_CLASS_NAMES``.
+* Lengths and integers are variable length ("varint") encoded.
+* ``UUID`` s are 16 raw bytes rather than 36 hex digits and a class marker.
+
+Encoded data always starts with ``COMPACT_MAGIC``, which is never the start
+of a JSON document, so ``wire_decode`` can tell the two encodings apart.
+"""
+
+from calendar import timegm
+from datetime import datetime
+from struct import Struct, error as struct_error
+from uuid import UUID
+
+from pyrsistent import PRecord, PVector, PMap, PSet, PClass, pmap
+
+from pytz import UTC
+
+from twisted.python.filepath import FilePath
+
+from ._cache import IdentityCache
+from ._model import SERIALIZABLE_CLASSES
+
+
+# Prefix of all compact encoded data.  The final byte is the format version.
+COMPACT_MAGIC = b"\xfc\x01"
+
+# The name used to negotiate this encoding.  It changes whenever the format
+# does, including when ``_CLASS_NAMES`` changes.
+COMPACT_ENCODING = u"compact-1"
+
+# Serializable classes, by their identifier in the encoding.  Only ever add
+# to the end of this; reordering it is a format change.
+_CLASS_NAMES = (
+    u"Deployment", u"Node", u"DockerImage", u"Port", u"Link",
+    u"RestartNever", u"RestartAlways", u"RestartOnFailure", u"Application",
+    u"Dataset", u"Manifestation", u"AttachedVolume", u"NodeState",
+    u"DeploymentState", u"NonManifestDatasets", u"Configuration", u"Lease",
+    u"PersistentState", u"GenerationHash", u"_Set", u"_Remove", u"_Add",
+    u"Diff", u"_Replace",
+)
+
+_CLASS_IDS = {name: index for index, name in enumerate(_CLASS_NAMES)}
+
+_CLASSES = {
+    cls.__name__: cls for cls in SERIALIZABLE_CLASSES
+    if cls.__name__ in _CLASS_IDS
+}
+
+_NONE = b"\x00"
+_FALSE = b"\x01"
+_TRUE = b"\x02"
+_INTEGER = b"\x03"
+_FLOAT = b"\x04"
+_STRING = b"\x05"
+_LIST = b"\x06"
+_DICT = b"\x07"
+_PMAP = b"\x08"
+_OBJECT = b"\x09"
+_UUID = b"\x0a"
+_FILEPATH = b"\x0b"
+_DATETIME = b"\x0c"
+
+_DOUBLE = Struct(">d")
+
+_encode_cache = IdentityCache()
+
+
+def _varint(value):
+    """
+    Encode a non-negative integer seven bits at a time, least significant
+    first, with the high bit of each byte set if more bytes follow.
+
+    :param int value: The integer to encode.
+
+    :return bytes: The encoded integer.
+    """
+    if value < 0x80:
+        return chr(value)
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _string(value):
+    """
+    Encode the length and UTF-8 bytes of a string, without a tag.
+
+    :param value: ``unicode`` or UTF-8 encoded ``bytes``.
+
+    :return bytes: The encoded string.
+    """
+    if type(value) is unicode:
+        value = value.encode("utf-8")
+    return _varint(len(value)) + value
+
+
+def _zigzag(value):
+    """
+    Encode a possibly negative integer so that ones of small magnitude stay
+    small.
+
+    :param int value: The integer to encode.
+
+    :return bytes: The encoded integer.
+    """
+    return _varint(value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _encode_integer(obj, chunks):
+    chunks.append(_INTEGER)
+    chunks.append(_zigzag(obj))
+
+
+def _encode_string(obj, chunks):
+    chunks.append(_STRING)
+    chunks.append(_string(obj))
+
+
+def _encode_sequence(obj, chunks):
+    chunks.append(_LIST)
+    chunks.append(_varint(len(obj)))
+    for item in obj:
+        _encode(item, chunks)
+
+
+def _encode_dict(obj, chunks):
+    chunks.append(_DICT)
+    chunks.append(_varint(len(obj)))
+    for key, value in obj.iteritems():
+        _encode(key, chunks)
+        _encode(value, chunks)
+
+
+def _encode_pmap(obj, chunks):
+    chunks.append(_PMAP)
+    chunks.append(_varint(len(obj)))
+    for key, value in obj.iteritems():
+        _encode(key, chunks)
+        _encode(value, chunks)
+
+
+def _encode_object(obj, fields, chunks):
+    """
+    Encode a ``PClass`` or ``PRecord`` as its class identifier followed by
+    its fields.
+
+    :param obj: The object to encode.
+    :param dict fields: The fields of ``obj`` to encode.
+    :param list chunks: Encoded bytes are appended to this.
+    """
+    class_name = obj.__class__.__name__
+    try:
+        class_id = _CLASS_IDS[class_name]
+    except KeyError:
+        raise TypeError("{} is not serializable".format(class_name))
+    chunks.append(_OBJECT)
+    chunks.append(_varint(class_id))
+    chunks.append(_varint(len(fields)))
+    for key, value in fields.iteritems():
+        chunks.append(_string(key))
+        _encode(value, chunks)
+
+
+def _encode_pyrsistent(obj, chunks):
+    """
+    Encode a pyrsistent object, reusing the encoding from a previous call if
+    the same object has been encoded before.
+
+    Large parts of the configuration are shared between successive versions
+    of it, so this avoids most of the work of encoding a new version.
+
+    :param obj: The pyrsistent object to encode.
+    :param list chunks: Encoded bytes are appended to this.
+    """
+    cached = _encode_cache.get(obj)
+    if cached is None:
+        encoded = []
+        if isinstance(obj, PRecord):
+            _encode_object(obj, obj, encoded)
+        elif isinstance(obj, PClass):
+            _encode_object(obj, obj._to_dict(), encoded)
+        elif isinstance(obj, PMap):
+            _encode_pmap(obj, encoded)
+        else:
+            _encode_sequence(obj, encoded)
+        cached = b"".join(encoded)
+        _encode_cache[obj] = cached
+    chunks.append(cached)
+
+
+def _encode_other(obj, chunks):
+    """
+    Encode an object whose exact type has no entry in ``_ENCODERS``.
+
+    :param obj: The object to encode.
+    :param list chunks: Encoded bytes are appended to this.
+    """
+    if isinstance(obj, (PRecord, PClass, PMap, PSet, PVector)):
+        _encode_pyrsistent(obj, chunks)
+    elif isinstance(obj, UUID):
+        chunks.append(_UUID)
+        chunks.append(obj.bytes)
+    elif isinstance(obj, FilePath):
+        chunks.append(_FILEPATH)
+        chunks.append(_string(obj.path))
+    elif isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            raise ValueError(
+                "Datetime without a timezone: {}".format(obj))
+        chunks.append(_DATETIME)
+        chunks.append(_zigzag(timegm(obj.utctimetuple())))
+    elif isinstance(obj, (set, frozenset, list, tuple)):
+        _encode_sequence(obj, chunks)
+    elif isinstance(obj, dict):
+        _encode_dict(obj, chunks)
+    else:
+        raise TypeError("{!r} is not serializable".format(obj))
+
+
+# Encoders for the most common exact types, to avoid ``isinstance`` checks.
+_ENCODERS = {
+    type(None): lambda obj, chunks: chunks.append(_NONE),
+    bool: lambda obj, chunks: chunks.append(_TRUE if obj else _FALSE),
+    int: _encode_integer,
+    long: _encode_integer,
+    float: lambda obj, chunks: chunks.extend((_FLOAT, _DOUBLE.pack(obj))),
+    unicode: _encode_string,
+    bytes: _encode_string,
+    list: _encode_sequence,
+    tuple: _encode_sequence,
+    dict: _encode_dict,
+    UUID: _encode_other,
+}
+
+
+def _encode(obj, chunks):
+    """
+    Append the encoding of an object to a list of ``bytes``.
+
+    :param obj: The object to encode.
+    :param list chunks: Encoded bytes are appended to this.
+    """
+    _ENCODERS.get(type(obj), _encode_other)(obj, chunks)
+
+
+def compact_encode(obj):
+    """
+    Encode the given model object into compact bytes.
+
+    :param obj: An object from the configuration model, e.g. ``Deployment``.
+
+    :return bytes: Encoded object.
+    """
+    chunks = [COMPACT_MAGIC]
+    _encode(obj, chunks)
+    return b"".join(chunks)
+
+
+# The decoders below take the encoded data and the offset of the value to
+# decode in it, and return the decoded value and the offset just past it.  They
+# do not check for reading past the end of the data: that raises
+# ``IndexError`` or leaves the final offset past the end, either of which
+# ``compact_decode`` reports as truncated data.
+
+def _decode_varint(data, position):
+    byte = ord(data[position])
+    position += 1
+    if byte < 0x80:
+        return byte, position
+    result = byte & 0x7f
+    shift = 7
+    while True:
+        byte = ord(data[position])
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def _decode_zigzag(data, position):
+    value, position = _decode_varint(data, position)
+    if value & 1:
+        return -(value >> 1) - 1, position
+    return value >> 1, position
+
+
+def _decode_bytes(data, position):
+    length, position = _decode_varint(data, position)
+    end = position + length
+    return data[position:end], end
+
+
+def _decode_string(data, position):
+    length, position = _decode_varint(data, position)
+    end = position + length
+    return data[position:end].decode("utf-8"), end
+
+
+def _decode_list(data, position):
+    count, position = _decode_varint(data, position)
+    result = []
+    append = result.append
+    for _ in xrange(count):
+        value, position = _decode(data, position)
+        append(value)
+    return result, position
+
+
+def _decode_pairs(data, position):
+    count, position = _decode_varint(data, position)
+    result = {}
+    for _ in xrange(count):
+        key, position = _decode(data, position)
+        result[key], position = _decode(data, position)
+    return result, position
+
+
+def _decode_pmap(data, position):
+    result, position = _decode_pairs(data, position)
+    return pmap(result), position
+
+
+# Field names recur for every instance of a class, so only decode each once:
+_field_names = {}
+
+
+def _decode_object(data, position):
+    class_id, position = _decode_varint(data, position)
+    try:
+        cls = _CLASSES[_CLASS_NAMES[class_id]]
+    except (IndexError, KeyError):
+        raise ValueError("Unknown class identifier {}".format(class_id))
+    count, position = _decode_varint(data, position)
+    fields = {}
+    for _ in xrange(count):
+        raw_name, position = _decode_bytes(data, position)
+        name = _field_names.get(raw_name)
+        if name is None:
+            name = _field_names[raw_name] = raw_name.decode("utf-8")
+        fields[name], position = _decode(data, position)
+    return cls.create(fields), position
+
+
+def _decode_float(data, position):
+    end = position + _DOUBLE.size
+    return _DOUBLE.unpack(data[position:end])[0], end
+
+
+def _decode_uuid(data, position):
+    end = position + 16
+    return UUID(bytes=data[position:end]), end
+
+
+def _decode_filepath(data, position):
+    path, position = _decode_bytes(data, position)
+    return FilePath(path), position
+
+
+def _decode_datetime(data, position):
+    seconds, position = _decode_zigzag(data, position)
+    return datetime.fromtimestamp(seconds, UTC), position
+
+
+def _constant(value):
+    """
+    :return: A decoder for a tag which is not followed by any data.
+    """
+    return lambda data, position: (value, position)
+
+
+_DECODERS = {
+    _NONE: _constant(None),
+    _FALSE: _constant(False),
+    _TRUE: _constant(True),
+    _INTEGER: _decode_zigzag,
+    _FLOAT: _decode_float,
+    _STRING: _decode_string,
+    _LIST: _decode_list,
+    _DICT: _decode_pairs,
+    _PMAP: _decode_pmap,
+    _OBJECT: _decode_object,
+    _UUID: _decode_uuid,
+    _FILEPATH: _decode_filepath,
+    _DATETIME: _decode_datetime,
+}
+
+
+def _decode(data, position):
+    """
+    Decode the value at the given offset.
+
+    :param bytes data: The encoded data.
+    :param int position: The offset of the tag of the value to decode.
+
+    :return: The decoded value and the offset just past it.
+    """
+    tag = data[position]
+    try:
+        decoder = _DECODERS[tag]
+    except KeyError:
+        raise ValueError("Unknown compact encoding tag {!r}".format(tag))
+    return decoder(data, position + 1)
+
+
+def compact_decode(data):
+    """
+    Decode the given model object from compact bytes.
+
+    :param bytes data: Encoded object, as returned by ``compact_encode``.
+
+    :raises ValueError: If ``data`` is not a valid compact encoding.
+
+    :return: The decoded object.
+    """
+    if not data.startswith(COMPACT_MAGIC):
+        raise ValueError("Data is not compact encoded")
+    try:
+        result, position = _decode(data, len(COMPACT_MAGIC))
+    except (IndexError, struct_error):
+        raise ValueError("Truncated compact encoded data")
+    if position > len(data):
+        raise ValueError("Truncated compact encoded data")
+    elif position < len(data):
+        raise ValueError("Trailing data after compact encoded object")
+    return result
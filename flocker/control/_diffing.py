@@ -448,6 +448,9 @@ def _create_diffs_for_sets(current_path, set_a, set_b):
     assuming that these sets are at ``current_path`` inside a nested pyrsistent
     object.
 
+    Items the two sets share are recognized by identity first, so only the
+    items that differ are hashed and compared.
+
     :param current_path: An iterable of pyrsistent object describing the path
         inside the root pyrsistent object where the other arguments are
         located.  See ``PMap.transform`` for the format of this sort of path.
@@ -460,14 +463,18 @@ def _create_diffs_for_sets(current_path, set_a, set_b):
         ``set_b``.
     """
     resulting_diffs = pvector([]).evolver()
-    for item in set_a.difference(set_b):
-        resulting_diffs.append(
-            _Remove(path=current_path, item=item)
-        )
-    for item in set_b.difference(set_a):
-        resulting_diffs.append(
-            _Add(path=current_path, item=item)
-        )
+    shared = {id(item) for item in set_a}.intersection(
+        id(item) for item in set_b)
+    for item in set_a:
+        if id(item) not in shared and item not in set_b:
+            resulting_diffs.append(
+                _Remove(path=current_path, item=item)
+            )
+    for item in set_b:
+        if id(item) not in shared and item not in set_a:
+            resulting_diffs.append(
+                _Add(path=current_path, item=item)
+            )
     return resulting_diffs.persistent()
 
 
@@ -489,25 +496,24 @@ def _create_diffs_for_mappings(current_path, mapping_a, mapping_b):
         into ``mapping_b``.
     """
     resulting_diffs = pvector([]).evolver()
-    a_keys = frozenset(mapping_a.keys())
-    b_keys = frozenset(mapping_b.keys())
-    for key in a_keys.intersection(b_keys):
-        if mapping_a[key] != mapping_b[key]:
+    added = []
+    for key, value_b in mapping_b.iteritems():
+        value_a = mapping_a.get(key, _sentinel)
+        if value_a is _sentinel:
+            added.append(key)
+        elif value_a is not value_b:
             resulting_diffs.extend(
-                _create_diffs_for(
-                    current_path.append(key),
-                    mapping_a[key],
-                    mapping_b[key]
-                )
+                _create_diffs_for(current_path.append(key), value_a, value_b)
             )
-    for key in b_keys.difference(a_keys):
+    for key in added:
         resulting_diffs.append(
             _Set(path=current_path, key=key, value=mapping_b[key])
         )
-    for key in a_keys.difference(b_keys):
-        resulting_diffs.append(
-            _Remove(path=current_path, item=key)
-        )
+    for key in mapping_a:
+        if key not in mapping_b:
+            resulting_diffs.append(
+                _Remove(path=current_path, item=key)
+            )
     return resulting_diffs.persistent()
 
 
@@ -517,6 +523,11 @@ def _create_diffs_for(current_path, subobj_a, subobj_b):
     ``subobj_b`` assuming that these subobjs are at ``current_path`` inside a
     nested pyrsistent object.
 
+    Pyrsistent objects derived from one another share their unchanged parts,
+    so objects are first compared by identity and only then for equality.
+    Members of containers are likewise only recursed into if they are not
+    identical, so parts that are shared are never compared.
+
     :param current_path: An iterable of pyrsistent object describing the path
         inside the root pyrsistent object where the other arguments are
         located.  See ``PMap.transform`` for the format of this sort of path.
@@ -528,7 +539,7 @@ def _create_diffs_for(current_path, subobj_a, subobj_b):
     :returns: An iterable of ``_IDiffChange`` s that will turn ``subobj_a``
         into ``subobj_b``.
     """
-    if subobj_a == subobj_b:
+    if subobj_a is subobj_b or subobj_a == subobj_b:
         return pvector([])
     elif isinstance(subobj_a, PClass) and isinstance(subobj_b, PClass):
         a_dict = subobj_a._to_dict()
@@ -574,6 +585,48 @@ def create_diff(object_a, object_b):
     return Diff(changes=changes)
 
 
+def _target(change):
+    """
+    :param change: A ``_Set``, ``_Remove``, ``_Add`` or ``_Replace``.
+
+    :return tuple: The path of the object that ``change`` writes: the key or
+        item it sets, adds or removes, or the root for a ``_Replace``.
+    """
+    if isinstance(change, _Replace):
+        return ()
+    elif isinstance(change, _Set):
+        return tuple(change.path) + (change.key,)
+    else:
+        return tuple(change.path) + (change.item,)
+
+
+def _squash_changes(changes):
+    """
+    Drop the changes whose effect is entirely overwritten by later ones.
+
+    A change is overwritten by a later change that writes the same path, or
+    one of the paths containing it: the last write to a key or set item wins,
+    an item that is added and then removed is only removed, and changes
+    within an object that is later replaced or removed are dropped.  The
+    changes that remain are kept in their original order.
+
+    :param changes: A sequence of ``_IDiffChange`` s, applied in order.
+
+    :return: A ``list`` of the ``_IDiffChange`` s with the same effect.
+    """
+    written = set()
+    kept = []
+    for change in reversed(changes):
+        target = _target(change)
+        if any(target[:length] in written
+               for length in range(len(target) + 1)):
+            continue
+        written.add(target)
+        kept.append(change)
+    kept.reverse()
+    return kept
+
+
 def compose_diffs(iterable_of_diffs):
     """
     Compose multiple ``Diff`` objects into a single diff.
@@ -582,18 +635,21 @@ def compose_diffs(iterable_of_diffs):
     If you pass [AB, BC] into this function it will return AC, a diff that when
     applied to object A, will return C.
 
+    Changes in earlier diffs that are overwritten by later ones are dropped,
+    so composing many diffs that change the same parts of an object gives a
+    diff no bigger than the changes themselves.
+
     :param iterable_of_diffs: An iterable of diffs to be composed.
 
     :returns: A new diff such that applying this diff is equivalent to applying
         each of the input diffs in serial.
     """
-    return Diff(
-        changes=reduce(
-            lambda x, y: x.extend(y.changes),
-            iterable_of_diffs,
-            pvector().evolver()
-        ).persistent()
-    )
+    changes = reduce(
+        lambda x, y: x.extend(y.changes),
+        iterable_of_diffs,
+        pvector().evolver()
+    ).persistent()
+    return Diff(changes=_squash_changes(changes))
 
 
 # Ensure that the representation of a ``Diff`` is entirely serializable:
@@ -7,10 +7,12 @@ diffs to change objects from one generation to another.
 """
 
 from collections import deque
+from itertools import islice
+
 from pyrsistent import PClass, field
 
 from ._model import GenerationHash
-from ._persistence import make_generation_hash
+from ._persistence import make_generation_hash, update_generation_hash
 from ._diffing import Diff, create_diff, compose_diffs
 
 
@@ -39,11 +41,24 @@ class GenerationTracker(object):
     This lets you quickly look up a diff to convert an object X from generation
     hash H to the latest version of the object.
 
+    Diffs are looked up by an index of the generations in the queue, and
+    the composed diff from each generation to the latest is kept until a new
+    generation is inserted, so many agents at the same generation share one
+    diff.
+
     :ivar _queue: A queue of ``_GenerationRecord`` s describing a series of
         ``Diff`` s to convert objects from a specific hash to the latest
         version.
+    :ivar int _first: The position of the oldest record in ``_queue``,
+        counting every record ever added.
+    :ivar dict _index: Map each ``GenerationHash`` in ``_queue`` to the
+        position of its most recent record.
+    :ivar dict _diffs: Map ``GenerationHash`` es to the composed ``Diff``
+        from that generation to the latest.
     :ivar _latest_object: The most recent version of the object being tracked.
     :ivar _latest_hash: The most recent hash of the object being tracked.
+    :ivar int hits: The number of diffs found in ``_diffs``.
+    :ivar int misses: The number of diffs that had to be composed.
     """
 
     def __init__(self, cache_size):
@@ -55,8 +70,30 @@ class GenerationTracker(object):
             changes ago are dropped.
         """
         self._queue = deque(maxlen=cache_size)
+        self._first = 0
+        self._index = {}
+        self._diffs = {}
         self._latest_object = None
         self._latest_hash = None
+        self.hits = 0
+        self.misses = 0
+
+    def _append(self, record):
+        """
+        Add a record to the queue, dropping the oldest if it is full.
+
+        :param _GenerationRecord record: The record to add.
+        """
+        if self._queue.maxlen == 0:
+            return
+        position = self._first + len(self._queue)
+        if len(self._queue) == self._queue.maxlen:
+            oldest = self._queue[0]
+            if self._index.get(oldest.generation_hash) == self._first:
+                del self._index[oldest.generation_hash]
+            self._first += 1
+        self._index[record.generation_hash] = position
+        self._queue.append(record)
 
     def get_latest(self):
         """
@@ -85,21 +122,49 @@ class GenerationTracker(object):
         """
         if latest == self._latest_object:
             return
-        latest_hash = make_generation_hash(latest)
 
-        if (self._latest_object is not None and
-                latest_hash != self._latest_hash):
+        if self._latest_object is None:
+            latest_hash = make_generation_hash(latest)
+        else:
             new_diff = create_diff(self._latest_object, latest)
-            self._queue.append(
-                _GenerationRecord(
-                    generation_hash=self._latest_hash,
-                    diff_to_next=new_diff
-                )
+            # Only the parts of the object that changed need to be hashed:
+            latest_hash = GenerationHash(
+                hash_value=update_generation_hash(
+                    self._latest_object, new_diff, latest)
             )
+            if latest_hash != self._latest_hash:
+                self._append(
+                    _GenerationRecord(
+                        generation_hash=self._latest_hash,
+                        diff_to_next=new_diff
+                    )
+                )
+                self._diffs.clear()
 
         self._latest_object = latest
         self._latest_hash = latest_hash
 
+    def load_history(self, latest, history):
+        """
+        Replace the tracked generations with a previously recorded history,
+        for example one persisted across a restart.
+
+        :param latest: The latest version of the object.
+        :param history: An iterable of ``(GenerationHash, Diff)`` pairs, oldest
+            first, where applying the ``Diff`` s in order to the object with
+            the first hash gives ``latest``.  Only the most recent
+            ``cache_size`` of them are kept.
+        """
+        self._queue.clear()
+        self._first = 0
+        self._index.clear()
+        self._diffs.clear()
+        for generation_hash, diff in history:
+            self._append(_GenerationRecord(
+                generation_hash=generation_hash, diff_to_next=diff))
+        self._latest_object = latest
+        self._latest_hash = make_generation_hash(latest)
+
     def get_diff_from_hash_to_latest(self, generation_hash):
         """
         Compute and return the diff from a previous version of the object to
@@ -118,14 +183,15 @@ class GenerationTracker(object):
         if self._latest_hash == generation_hash:
             return compose_diffs([])
 
-        results = []
-        for record in self._queue:
-            if record.generation_hash == generation_hash:
-                results = [record.diff_to_next]
-            elif results:
-                results.append(record.diff_to_next)
-
-        if results:
-            return compose_diffs(results)
-        else:
+        diff = self._diffs.get(generation_hash)
+        if diff is not None:
+            self.hits += 1
+            return diff
+        position = self._index.get(generation_hash)
+        if position is None:
             return None
+        self.misses += 1
+        diff = self._diffs[generation_hash] = compose_diffs(
+            record.diff_to_next for record in
+            islice(self._queue, position - self._first, None))
+        return diff
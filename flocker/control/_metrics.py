@@ -0,0 +1,119 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_metrics -*-
+
+"""
+In-process counters and measurements of the control service and agents.
+"""
+
+
+class _Distribution(object):
+    """
+    A summary of the values recorded for a measurement.
+
+    :ivar int count: The number of values recorded.
+    :ivar total: The sum of the values.
+    :ivar minimum: The smallest value, or ``None`` if none were recorded.
+    :ivar maximum: The largest value, or ``None`` if none were recorded.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    def record(self, value):
+        """
+        :param value: A number to add to the summary.
+        """
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def statistics(self):
+        """
+        :return: ``dict`` of the ``count``, ``total``, ``minimum`` and
+            ``maximum`` of the values recorded.
+        """
+        return dict(
+            count=self.count, total=self.total,
+            minimum=self.minimum, maximum=self.maximum,
+        )
+
+
+class MetricsRegistry(object):
+    """
+    Named counters and distributions of measurements, such as the sizes of
+    messages or how long operations take.
+
+    Names are ``unicode`` with dot-separated parts, most general first, so
+    related metrics can be queried together by prefix.
+
+    :ivar dict _counters: Map names to ``int`` counts.
+    :ivar dict _distributions: Map names to ``_Distribution`` s.
+    """
+    def __init__(self):
+        self._counters = {}
+        self._distributions = {}
+
+    def increment(self, name, amount=1):
+        """
+        :param unicode name: The counter to add to.
+        :param int amount: How much to add.
+        """
+        self._counters[name] = self._counters.get(name, 0) + amount
+
+    def record(self, name, value):
+        """
+        :param unicode name: The measurement to record a value of.
+        :param value: The number measured.
+        """
+        distribution = self._distributions.get(name)
+        if distribution is None:
+            distribution = self._distributions[name] = _Distribution()
+        distribution.record(value)
+
+    def counter(self, name):
+        """
+        :param unicode name: A counter.
+
+        :return int: Its count, zero if it was never incremented.
+        """
+        return self._counters.get(name, 0)
+
+    def distribution(self, name):
+        """
+        :param unicode name: A measurement.
+
+        :return: ``dict`` of the statistics of the values recorded for it; see
+            ``_Distribution.statistics``.
+        """
+        return self._distributions.get(name, _Distribution()).statistics()
+
+    def snapshot(self, prefix=u""):
+        """
+        :param unicode prefix: Only include the metrics whose names start
+            with this.
+
+        :return: ``dict`` mapping the names of the metrics to their counts or
+            to the statistics of their distributions.
+        """
+        result = {
+            name: count for name, count in self._counters.items()
+            if name.startswith(prefix)
+        }
+        result.update(
+            (name, distribution.statistics())
+            for name, distribution in self._distributions.items()
+            if name.startswith(prefix)
+        )
+        return result
+
+    def clear(self):
+        """
+        Forget all the metrics.
+        """
+        self._counters.clear()
+        self._distributions.clear()
@@ -12,6 +12,7 @@ upgrading from older versions of Flocker.
 
 from uuid import UUID
 from warnings import warn
+from weakref import ref
 from hashlib import md5
 from datetime import datetime, timedelta
 from collections import Mapping
@@ -20,12 +21,13 @@ from characteristic import attributes
 from twisted.python.filepath import FilePath
 
 from pyrsistent import (
-    pmap, PClass, PRecord, field, PMap, CheckedPSet, CheckedPMap, discard,
-    optional as optional_type, CheckedPVector
+    pmap, pset, PClass, PRecord, field, PMap, CheckedPSet, CheckedPMap,
+    discard, optional as optional_type, CheckedPVector
     )
 
 from zope.interface import Interface, implementer
 
+from ._cache import IdentityCache
 from ._diffing import DIFF_SERIALIZABLE_CLASSES
 
 
@@ -541,6 +543,120 @@ def _get_node(default_factory):
     return get_node
 
 
+class _NodeIndex(object):
+    """
+    An index of the nodes of ``Deployment`` or ``DeploymentState`` objects
+    by the keys of one of the mappings on each node, such as the dataset IDs
+    of their manifestations.
+
+    The index of a ``nodes`` map is a ``PMap`` of each key to the ``PSet`` of
+    the UUIDs of the nodes with that key.  Indexes are cached on the identity
+    of the ``nodes`` map and derived from the index of an earlier version of
+    it, so only nodes which have been replaced need to be looked at.
+
+    :ivar bytes _attribute: The name of the node attribute to index by.
+    :ivar IdentityCache _cache: The index of each ``nodes`` map.
+    :ivar _latest: A weak reference to the ``nodes`` map most recently
+        indexed, or ``None``.
+    """
+    def __init__(self, attribute):
+        self._attribute = attribute
+        self._cache = IdentityCache()
+        self._latest = None
+
+    def _keys(self, node):
+        """
+        :return: The keys of ``node`` to index it by.
+        """
+        if node is None:
+            return frozenset()
+        mapping = getattr(node, self._attribute)
+        if mapping is None:
+            return frozenset()
+        return frozenset(mapping)
+
+    def _replace(self, index, uuid, old, new):
+        """
+        :param PMap index: An index including ``old``.
+        :param UUID uuid: The UUID of the node being replaced.
+        :param old: The node being replaced, or ``None``.
+        :param new: The node replacing it, or ``None``.
+
+        :return PMap: ``index`` updated to include ``new`` instead.
+        """
+        if old is not None and new is not None and (
+                getattr(old, self._attribute) is
+                getattr(new, self._attribute)):
+            return index
+        old_keys = self._keys(old)
+        new_keys = self._keys(new)
+        for key in old_keys - new_keys:
+            uuids = index[key].remove(uuid)
+            index = index.set(key, uuids) if uuids else index.remove(key)
+        for key in new_keys - old_keys:
+            index = index.set(key, index.get(key, pset()).add(uuid))
+        return index
+
+    def _store(self, nodes, index):
+        self._cache[nodes] = index
+        self._latest = ref(nodes)
+        return index
+
+    def index(self, nodes):
+        """
+        :param PMap nodes: The ``nodes`` of a ``Deployment`` or
+            ``DeploymentState``.
+
+        :return PMap: The index of ``nodes``.
+        """
+        index = self._cache.get(nodes)
+        if index is not None:
+            return index
+        previous = None if self._latest is None else self._latest()
+        if previous is None:
+            previous = pmap()
+        index = self._cache.get(previous, pmap())
+        for uuid, node in nodes.iteritems():
+            old = previous.get(uuid)
+            if old is not node:
+                index = self._replace(index, uuid, old, node)
+        for uuid, old in previous.iteritems():
+            if uuid not in nodes:
+                index = self._replace(index, uuid, old, None)
+        return self._store(nodes, index)
+
+    def replaced(self, before, after, uuid):
+        """
+        Index ``nodes`` maps that differ by one node, from the index of the
+        earlier one if it has been indexed.
+
+        :param PMap before: The earlier ``nodes`` map.
+        :param PMap after: The later ``nodes`` map.
+        :param UUID uuid: The UUID of the node that differs.
+        """
+        index = self._cache.get(before)
+        if index is not None and after is not before:
+            self._store(after, self._replace(
+                index, uuid, before.get(uuid), after.get(uuid)))
+
+    def nodes_with(self, deployment, key):
+        """
+        :param deployment: A ``Deployment`` or ``DeploymentState``.
+        :param key: The key to look for.
+
+        :return: A ``list`` of the nodes of ``deployment`` with ``key``.
+        """
+        nodes = deployment.nodes
+        return [nodes[uuid] for uuid in self.index(nodes).get(key, ())]
+
+
+# Indexes of configuration nodes by dataset ID and by application name, and
+# of state nodes by dataset ID:
+_CONFIGURATION_DATASETS = _NodeIndex("manifestations")
+_CONFIGURATION_APPLICATIONS = _NodeIndex("applications")
+_STATE_DATASETS = _NodeIndex("manifestations")
+
+
 LEASE_ACTION_ACQUIRE = u"acquire"
 LEASE_ACTION_RELEASE = u"release"
 
@@ -733,6 +849,29 @@ class Deployment(PClass):
 
     get_node = _get_node(Node)
 
+    def nodes_with_manifestation(self, dataset_id):
+        """
+        Find the nodes with a manifestation of a dataset, without looking at
+        every node.
+
+        :param unicode dataset_id: The ID of the dataset.
+
+        :return: A ``list`` of the ``Node`` s with a manifestation of the
+            dataset.
+        """
+        return _CONFIGURATION_DATASETS.nodes_with(self, dataset_id)
+
+    def nodes_with_application(self, name):
+        """
+        Find the nodes with an application, without looking at every node.
+
+        :param unicode name: The name of the application.
+
+        :return: A ``list`` of the ``Node`` s with an application with that
+            name.
+        """
+        return _CONFIGURATION_APPLICATIONS.nodes_with(self, name)
+
     def applications(self):
         """
         Return all applications in all nodes.
@@ -754,9 +893,12 @@ class Deployment(PClass):
 
         :return Deployment: Updated with new ``Node``.
         """
-        return self.transform(
+        updated = self.transform(
             ['nodes', node.uuid], node
         )
+        for index in (_CONFIGURATION_DATASETS, _CONFIGURATION_APPLICATIONS):
+            index.replaced(self.nodes, updated.nodes, node.uuid)
+        return updated
 
     def move_application(self, application, target_node):
         """
@@ -771,7 +913,7 @@ class Deployment(PClass):
         :return Deployment: Updated to reflect the new desired state.
         """
         deployment = self
-        for node in deployment.nodes.values():
+        for node in deployment.nodes_with_application(application.name):
             container = node.applications.get(application.name)
             if container:
                 # We only need to perform a move if the node currently
@@ -1165,6 +1307,18 @@ class DeploymentState(PClass):
 
     get_node = _get_node(NodeState)
 
+    def nodes_with_manifestation(self, dataset_id):
+        """
+        Find the nodes with a manifestation of a dataset, without looking at
+        every node.
+
+        :param unicode dataset_id: The ID of the dataset.
+
+        :return: A ``list`` of the ``NodeState`` s with a manifestation of
+            the dataset.
+        """
+        return _STATE_DATASETS.nodes_with(self, dataset_id)
+
     def update_node(self, node_state):
         """
         Create new ``DeploymentState`` based on this one which updates an
@@ -1183,13 +1337,17 @@ class DeploymentState(PClass):
         """
         original_node = self.nodes.get(node_state.uuid)
         if original_node is None:
-            return self.transform(["nodes", node_state.uuid], node_state)
-        updated_node = original_node.evolver()
-        for key, value in node_state.items():
-            if value is not None:
-                updated_node = updated_node.set(key, value)
-        updated_node = updated_node.persistent()
-        return self.transform(["nodes", updated_node.uuid], updated_node)
+            updated = self.transform(["nodes", node_state.uuid], node_state)
+        else:
+            updated_node = original_node.evolver()
+            for key, value in node_state.items():
+                if value is not None:
+                    updated_node = updated_node.set(key, value)
+            updated_node = updated_node.persistent()
+            updated = self.transform(
+                ["nodes", updated_node.uuid], updated_node)
+        _STATE_DATASETS.replaced(self.nodes, updated.nodes, node_state.uuid)
+        return updated
 
     def remove_node(self, node_uuid):
         """
@@ -1237,6 +1395,65 @@ class NonManifestDatasets(PClass):
         return NoWipe()
 
 
+def node_view(configuration, state, node_uuid):
+    """
+    Project the cluster configuration and state onto the parts a convergence
+    agent needs to converge a single node.
+
+    The agent gets its own node's configuration, state and era, the leases,
+    the persistent state and the non-manifest datasets.  Of the other nodes
+    it only gets those which have manifestations of datasets configured on
+    its own node, with only those manifestations, so it knows where they
+    are.  The cost of the projection depends on the size of the node rather
+    than the size of the cluster.
+
+    :param Deployment configuration: The cluster configuration.
+    :param DeploymentState state: The cluster state.
+    :param UUID node_uuid: The node the agent converges.
+
+    :return: A ``tuple`` of the ``Deployment`` and ``DeploymentState`` for
+        the node.
+    """
+    node = configuration.nodes.get(node_uuid)
+    node_state = state.nodes.get(node_uuid)
+    era = state.node_uuid_to_era.get(node_uuid)
+
+    state_nodes = {}
+    if node_state is not None:
+        state_nodes[node_uuid] = node_state
+    for dataset_id in (() if node is None else node.manifestations):
+        for other in state.nodes_with_manifestation(dataset_id):
+            if other.uuid == node_uuid:
+                continue
+            elsewhere = state_nodes.get(other.uuid)
+            if elsewhere is None:
+                elsewhere = NodeState(
+                    uuid=other.uuid, hostname=other.hostname,
+                    manifestations={}, paths={}, devices={},
+                )
+            elsewhere = elsewhere.transform(
+                ["manifestations", dataset_id],
+                other.manifestations[dataset_id],
+            )
+            if dataset_id in other.paths:
+                elsewhere = elsewhere.transform(
+                    ["paths", dataset_id], other.paths[dataset_id])
+            if UUID(dataset_id) in other.devices:
+                elsewhere = elsewhere.transform(
+                    ["devices", UUID(dataset_id)],
+                    other.devices[UUID(dataset_id)])
+            state_nodes[other.uuid] = elsewhere
+
+    return (
+        configuration.set(
+            nodes={} if node is None else {node_uuid: node}),
+        state.set(
+            nodes=state_nodes,
+            node_uuid_to_era={} if era is None else {node_uuid: era},
+        ),
+    )
+
+
 def _generation_hash_value_factory(x):
     """
     Factory method to create a generation hash.
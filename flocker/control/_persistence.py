@@ -4,29 +4,40 @@
 Persistence of cluster configuration.
 """
 
-from base64 import b16encode
+import io
+import os
+
+from base64 import b16encode, b16decode
 from calendar import timegm
 from datetime import datetime
 from json import dumps, loads
 from mmh3 import hash_bytes as mmh3_hash_bytes
 from uuid import UUID
-from collections import Set, Mapping, Iterable
+from collections import Set, Mapping, Iterable, deque
+from heapq import heapify, heappop, heappush
+from math import floor
+from struct import Struct
 
 from eliot import Logger, write_traceback, MessageType, Field, ActionType
 
+from zope.interface import Interface, implementer
+
 from pyrsistent import PRecord, PVector, PMap, PSet, pmap, PClass
 
 from pytz import UTC
 
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service, MultiService
-from twisted.internet.defer import succeed
-from twisted.internet.task import LoopingCall
-
-from weakref import WeakKeyDictionary
+from twisted.internet.defer import Deferred, succeed, maybeDeferred
+from twisted.internet.threads import deferToThreadPool
 
 from ._model import (
-    SERIALIZABLE_CLASSES, Deployment, Configuration, GenerationHash
+    SERIALIZABLE_CLASSES, Deployment, Configuration, GenerationHash,
+)
+from ._cache import IdentityCache
+from ._diffing import create_diff, _Replace, _Set
+from ._compact import (
+    COMPACT_MAGIC, COMPACT_ENCODING, compact_encode, compact_decode,
 )
 
 # The class at the root of the configuration tree.
@@ -43,6 +54,29 @@ _CONFIG_VERSION = 6
 # Map of serializable class names to classes
 _CONFIG_CLASS_MAP = {cls.__name__: cls for cls in SERIALIZABLE_CLASSES}
 
+# Names of the encodings ``wire_encode`` supports:
+WIRE_ENCODING_JSON = u"json"
+WIRE_ENCODING_COMPACT = COMPACT_ENCODING
+
+# Supported encodings, most preferred first:
+WIRE_ENCODINGS = (WIRE_ENCODING_COMPACT, WIRE_ENCODING_JSON)
+
+# The number of diffs appended to the configuration journal after which the
+# journal is compacted into a new configuration snapshot.
+JOURNAL_COMPACTION_THRESHOLD = 100
+
+# The number of most recent configuration changes whose diffs are kept, both
+# in memory and on disk, so that agents can be sent diffs rather than the full
+# configuration even after the control service restarts.
+CONFIGURATION_HISTORY_SIZE = 100
+
+# Leases are expired in batches, every this many seconds at most:
+LEASE_EXPIRY_WINDOW = 1
+
+# How many entries the lease expiry heap may have beyond twice the number of
+# leases before it is rebuilt:
+_LEASE_HEAP_SLACK = 64
+
 
 class ConfigurationMigrationError(Exception):
     """
@@ -283,7 +317,7 @@ _BASIC_JSON_COLLECTIONS = frozenset([dict]).union(_BASIC_JSON_LISTS)
 _UNCACHED_SENTINEL = object()
 
 
-_cached_dfs_serialize_cache = WeakKeyDictionary()
+_cached_dfs_serialize_cache = IdentityCache()
 
 
 def _cached_dfs_serialize(input_object):
@@ -291,8 +325,8 @@ def _cached_dfs_serialize(input_object):
     This serializes an input object into something that can be serialized by
     the python json encoder.
 
-    This caches the serialization of pyrsistent objects in a
-    ``WeakKeyDictionary``, so the cache should be automatically cleared when
+    This caches the serialization of pyrsistent objects in an
+    ``IdentityCache``, so the cache should be automatically cleared when
     the input object that is cached is destroyed.
 
     :returns: An entirely serializable version of input_object.
@@ -347,29 +381,30 @@ _NULLSET_TOKEN = mmh3_hash_bytes(b'NULLSET')
 _MAPPING_TOKEN = mmh3_hash_bytes(b'MAPPING')
 _STR_TOKEN = mmh3_hash_bytes(b'STRING')
 
-_generation_hash_cache = WeakKeyDictionary()
+_generation_hash_cache = IdentityCache()
 
 
-def _xor_bytes(aggregating_bytearray, updating_bytes):
-    """
-    Aggregate bytes into a bytearray using XOR.
+# Generation hashes are 16 bytes; XOR them as two 64-bit integers:
+_HASH_HALVES = Struct(">QQ")
 
-    This function has a somewhat particular function signature in order for it
-    to be compatible with a call to `reduce`
 
-    :param bytearray aggregating_bytearray: Resulting bytearray to aggregate
-        the XOR of both input arguments byte-by-byte.
+def _xor_hashes(initial, hashes):
+    """
+    Aggregate hashes using XOR.
 
-    :param bytes updating_bytes: Additional bytes to be aggregated into the
-        other argument. It is assumed that this has the same size as
-        aggregating_bytearray.
+    :param bytes initial: The hash to start from.
+    :param hashes: Iterable of further hashes, each the same size as
+        ``initial``.
 
-    :returns: aggregating_bytearray, after it has been modified by XORing all
-        of the bytes in the input bytearray with ``updating_bytes``.
+    :returns bytes: ``initial`` XORed with each of ``hashes``.
     """
-    for i in xrange(len(aggregating_bytearray)):
-        aggregating_bytearray[i] ^= ord(updating_bytes[i])
-    return aggregating_bytearray
+    unpack = _HASH_HALVES.unpack
+    high, low = unpack(initial)
+    for updating_bytes in hashes:
+        updating_high, updating_low = unpack(updating_bytes)
+        high ^= updating_high
+        low ^= updating_low
+    return _HASH_HALVES.pack(high, low)
 
 
 def generation_hash(input_object):
@@ -420,10 +455,8 @@ def generation_hash(input_object):
         )
 
     if isinstance(object_to_process, Set):
-        sub_hashes = (generation_hash(x) for x in object_to_process)
-        result = bytes(
-            reduce(_xor_bytes, sub_hashes, bytearray(_NULLSET_TOKEN))
-        )
+        result = _xor_hashes(
+            _NULLSET_TOKEN, (generation_hash(x) for x in object_to_process))
     elif isinstance(object_to_process, Iterable):
         result = mmh3_hash_bytes(b''.join(
             generation_hash(x) for x in object_to_process
@@ -453,13 +486,139 @@ def make_generation_hash(x):
     )
 
 
-def wire_encode(obj):
+# Marker for a key that is missing from a ``PMap`` or ``PClass``:
+_MISSING = object()
+
+
+def _changed_paths(diff):
+    """
+    Find the parts of an object a ``Diff`` changes.
+
+    :param Diff diff: The diff.
+
+    :return: ``None`` if the ``Diff`` replaces the whole object.  Otherwise a
+        ``dict`` mapping each key of a ``PMap`` or ``PClass``, or item of a
+        ``PSet``, that the ``Diff`` changes to either ``None``, if it is
+        replaced wholesale, or a ``dict`` of the changes within it of the
+        same form.
+    """
+    changed = {}
+    for change in diff.changes:
+        if isinstance(change, _Replace):
+            return None
+        elif isinstance(change, _Set):
+            last = change.key
+        else:
+            last = change.item
+        node = changed
+        for segment in change.path:
+            child = node.get(segment, _MISSING)
+            if child is None:
+                # Already replaced wholesale.
+                break
+            elif child is _MISSING:
+                child = node[segment] = {}
+            node = child
+        else:
+            node[last] = None
+    return changed
+
+
+def _get_child(obj, key):
+    """
+    :return: The value of ``key`` in the ``PMap`` or ``PClass`` ``obj``, or
+        ``_MISSING`` if it has none.
+    """
+    if isinstance(obj, PClass):
+        return getattr(obj, key, _MISSING)
+    return obj.get(key, _MISSING)
+
+
+def _pair_hash(key, value_hash):
+    """
+    :return: The ``generation_hash`` of a ``(key, value)`` item of a mapping,
+        given the hash of the value.
+    """
+    return mmh3_hash_bytes(generation_hash(key) + value_hash)
+
+
+def _updated_generation_hash(previous, latest, changed):
+    """
+    Compute the ``generation_hash`` of ``latest`` from that of ``previous``.
+
+    The hashes of mappings and sets are the XOR of the hashes of their items,
+    so the hashes of changed items can be XORed out and those of their
+    replacements XORed in without visiting the unchanged items.
+
+    :param previous: The earlier version of the object.
+    :param latest: The new version of the object.
+    :param changed: The parts of ``previous`` that were changed to make
+        ``latest``, as returned by ``_changed_paths``.
+
+    :return bytes: The ``generation_hash`` of ``latest``.
+    """
+    if changed is None or previous is latest:
+        return generation_hash(latest)
+    if isinstance(previous, PSet) and isinstance(latest, PSet):
+        # Items that were both removed and added again cancel out.
+        item_hashes = [
+            generation_hash(item) for item in changed
+            for container in (previous, latest) if item in container
+        ]
+    elif (isinstance(previous, (PClass, PMap)) and
+          isinstance(latest, (PClass, PMap))):
+        item_hashes = []
+        for key, changed_within in changed.iteritems():
+            previous_value = _get_child(previous, key)
+            latest_value = _get_child(latest, key)
+            if previous_value is not _MISSING:
+                item_hashes.append(
+                    _pair_hash(key, generation_hash(previous_value)))
+                if latest_value is not _MISSING:
+                    item_hashes.append(_pair_hash(
+                        key, _updated_generation_hash(
+                            previous_value, latest_value, changed_within)))
+            elif latest_value is not _MISSING:
+                item_hashes.append(
+                    _pair_hash(key, generation_hash(latest_value)))
+    else:
+        return generation_hash(latest)
+    result = _xor_hashes(generation_hash(previous), item_hashes)
+    _generation_hash_cache[latest] = result
+    return result
+
+
+def update_generation_hash(previous, diff, latest):
+    """
+    Compute the ``generation_hash`` of an object from the hash of an earlier
+    version of it and the ``Diff`` between them.
+
+    The result is the same as ``generation_hash(latest)``, but the cost is
+    proportional to the size of ``diff`` rather than to the size of
+    ``latest``.
+
+    :param previous: The earlier version of the object.
+    :param Diff diff: A ``Diff`` which when applied to ``previous`` gives
+        ``latest``.
+    :param latest: The new version of the object.
+
+    :returns: The ``generation_hash`` of ``latest``.
+    """
+    return _updated_generation_hash(previous, latest, _changed_paths(diff))
+
+
+def wire_encode(obj, encoding=WIRE_ENCODING_JSON):
     """
     Encode the given model object into bytes.
 
     :param obj: An object from the configuration model, e.g. ``Deployment``.
+    :param unicode encoding: One of ``WIRE_ENCODINGS``.
     :return bytes: Encoded object.
     """
+    if encoding == WIRE_ENCODING_COMPACT:
+        return compact_encode(obj)
+    elif encoding != WIRE_ENCODING_JSON:
+        raise ValueError("Unknown wire encoding {}".format(encoding))
     return dumps(_cached_dfs_serialize(obj))
 
 
@@ -467,8 +626,11 @@ def wire_decode(data):
     """
     Decode the given model object from bytes.
 
-    :param bytes data: Encoded object.
+    :param bytes data: Encoded object, in any of ``WIRE_ENCODINGS``.
     """
+    if data.startswith(COMPACT_MAGIC):
+        return compact_decode(data)
+
     def decode(dictionary):
         class_name = dictionary.get(_CLASS_MARKER, None)
         if class_name == u"FilePath":
@@ -489,6 +651,21 @@ def wire_decode(data):
     return loads(data, object_hook=decode)
 
 
+def _configuration_hash(deployment):
+    """
+    Compute the hash identifying a configuration.
+
+    This is based on ``generation_hash`` rather than on the serialized
+    configuration so that it can be computed without encoding the whole
+    configuration.
+
+    :param Deployment deployment: The configuration to hash.
+
+    :return bytes: A lowercase hex encoded hash.
+    """
+    return b16encode(generation_hash(deployment)).lower()
+
+
 def to_unserialized_json(obj):
     """
     Convert a wire encodeable object into structured Python objects that
@@ -517,6 +694,22 @@ _LOG_EXPIRE = MessageType(
     [Field(u"dataset_id", unicode), Field(u"node_id", unicode)],
     u"A lease for a dataset has expired.")
 
+_LOG_JOURNAL_TRUNCATED = MessageType(
+    u"flocker-control:persistence:journal-truncated",
+    [Field.for_types(u"entries", [int, long],
+                     u"The number of journal entries that were replayed.")],
+    u"The final configuration journal entry was incomplete, presumably "
+    u"because of a crash while it was being written, and has been ignored."
+)
+
+_LOG_COMPACT_JOURNAL = ActionType(
+    u"flocker-control:persistence:compact-journal",
+    [Field.for_types(u"entries", [int, long],
+                     u"The number of journal entries being compacted.")],
+    [],
+    u"The configuration journal is being compacted into a new snapshot."
+)
+
 _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED = MessageType(
     u"flocker-control:persistence:unchanged-deployment-not-saved",
     [],
@@ -525,38 +718,181 @@ _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED = MessageType(
 )
 
 
+_EPOCH = datetime.fromtimestamp(0, tz=UTC)
+
+
+def _seconds_since_epoch(when):
+    """
+    :param datetime when: A timezone-aware date/time.
+
+    :return float: ``when`` as seconds since the epoch, the same scale as
+        ``IReactorTime.seconds``.
+    """
+    return (when - _EPOCH).total_seconds()
+
+
+def _expired(lease, now):
+    """
+    :param lease: A ``Lease`` or ``None``.
+    :param float now: The current time in seconds since the epoch.
+
+    :return bool: Whether ``lease`` is a lease which has expired.
+    """
+    return (lease is not None and lease.expiration is not None and
+            _seconds_since_epoch(lease.expiration) < now)
+
+
+def _changed_leases(diff):
+    """
+    :param diff: A ``Diff`` between two ``Deployment`` s, or ``None``.
+
+    :return: A ``set`` of the IDs of the datasets whose leases were added or
+        changed by ``diff``, or ``None`` if they can't be told apart from
+        those that were left alone.
+    """
+    if diff is None:
+        return None
+    changed = set()
+    for change in diff.changes:
+        path = getattr(change, "path", None)
+        if not path:
+            if isinstance(change, _Set) and change.key != u"leases":
+                continue
+            # The root or the whole of the leases was replaced:
+            return None
+        if path[0] != u"leases":
+            continue
+        if len(path) > 1:
+            changed.add(path[1])
+        elif isinstance(change, _Set):
+            changed.add(change.key)
+    return changed
+
+
 class LeaseService(Service):
     """
     Manage leases.
-    In particular, clear out expired leases once a second.
+    In particular, clear out expired leases.
+
+    Leases are kept in a heap ordered by expiration time, and a single
+    delayed call is armed for the earliest one, so the cost of expiring
+    leases does not grow with the number of leases that have not expired.
+    All leases expiring within the same window of ``window`` seconds are
+    removed together by one save of the configuration.
+
+    Each write of the configuration only adds the leases its ``Diff``
+    touched to the heap, so acquiring or renewing a lease costs the same
+    however many other leases there are.
 
     :ivar _reactor: A ``IReactorTime`` provider.
     :ivar _persistence_service: The persistence service to act with.
-    :ivar _lc: A ``twisted.internet.task.LoopingCall`` run every second
-        to update the configured leases by releasing leases that have
-        expired.
+    :ivar _window: The length in seconds of the windows in which expiring
+        leases are batched together.
+    :ivar list _heap: A heap of ``(float, UUID)`` pairs of the expiration
+        time in seconds since the epoch and dataset ID of each lease that
+        expires.  Leases which have since been released or renewed are only
+        removed when they reach the top of the heap.
+    :ivar _call: The ``IDelayedCall`` for the next expiry, or ``None``.
     """
-    def __init__(self, reactor, persistence_service):
+    def __init__(self, reactor, persistence_service,
+                 window=LEASE_EXPIRY_WINDOW):
         self._reactor = reactor
         self._persistence_service = persistence_service
+        self._window = window
+        self._heap = []
+        self._call = None
+        persistence_service.register(self._configuration_changed)
 
     def startService(self):
-        self._lc = LoopingCall(self._expire)
-        self._lc.clock = self._reactor
-        self._lc.start(1)
+        Service.startService(self)
+        self._rebuild()
 
     def stopService(self):
-        self._lc.stop()
+        Service.stopService(self)
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+    def _rebuild(self):
+        """
+        Replace the heap with one holding every lease that expires.
+        """
+        self._heap = [
+            (_seconds_since_epoch(lease.expiration), dataset_id)
+            for dataset_id, lease
+            in self._persistence_service.get().leases.iteritems()
+            if lease.expiration is not None
+        ]
+        heapify(self._heap)
+        self._schedule()
+
+    def _configuration_changed(self):
+        """
+        Add leases which are new or have been renewed by the configuration
+        just written to the heap.
+        """
+        if not self.running:
+            return
+        leases = self._persistence_service.get().leases
+        changed = _changed_leases(self._persistence_service._latest_change())
+        if (changed is None or
+                len(self._heap) > 2 * len(leases) + _LEASE_HEAP_SLACK):
+            # Either the change can't be narrowed down to particular leases,
+            # or the heap is mostly leases that have been renewed or
+            # released; rebuild it rather than let it grow:
+            self._rebuild()
+            return
+        for dataset_id in changed:
+            lease = leases.get(dataset_id)
+            if lease is not None and lease.expiration is not None:
+                heappush(
+                    self._heap,
+                    (_seconds_since_epoch(lease.expiration), dataset_id))
+        self._schedule()
+
+    def _schedule(self):
+        """
+        Arm the delayed call for the end of the window in which the earliest
+        lease expires.
+        """
+        if not self._heap:
+            if self._call is not None:
+                self._call.cancel()
+                self._call = None
+            return
+        window = self._window
+        when = (floor(self._heap[0][0] / window) + 1) * window
+        if self._call is not None:
+            if self._call.getTime() == when:
+                return
+            self._call.cancel()
+        self._call = self._reactor.callLater(
+            max(0, when - self._reactor.seconds()), self._expire)
 
     def _expire(self):
-        now = datetime.fromtimestamp(self._reactor.seconds(), tz=UTC)
+        self._call = None
+        now = self._reactor.seconds()
+        due = set()
+        while self._heap and self._heap[0][0] < now:
+            due.add(heappop(self._heap)[1])
+        self._schedule()
+        # Leases which were released or renewed since they were added to the
+        # heap don't need a save:
+        leases = self._persistence_service.get().leases
+        due = [dataset_id for dataset_id in due
+               if _expired(leases.get(dataset_id), now)]
+        if not due:
+            return succeed(None)
 
         def expire(leases):
-            updated_leases = leases.expire(now)
-            for dataset_id in set(leases) - set(updated_leases):
-                _LOG_EXPIRE(dataset_id=dataset_id,
-                            node_id=leases[dataset_id].node_id).write()
-            return updated_leases
+            evolver = leases.evolver()
+            for dataset_id in due:
+                lease = leases.get(dataset_id)
+                if _expired(lease, now):
+                    _LOG_EXPIRE(dataset_id=dataset_id,
+                                node_id=lease.node_id).write()
+                    evolver.remove(dataset_id)
+            return evolver.persistent()
         return update_leases(expire, self._persistence_service)
 
 
@@ -585,33 +921,86 @@ def update_leases(transform, persistence_service):
     return succeed(new_leases)
 
 
-class ConfigurationPersistenceService(MultiService):
+class IConfigurationStore(Interface):
     """
-    Persist configuration to disk, and load it back.
+    Durable storage for the cluster configuration.
 
-    :ivar Deployment _deployment: The current desired deployment configuration.
-    :ivar bytes _hash: A SHA256 hash of the configuration.
+    Methods are synchronous.  ``ConfigurationPersistenceService`` calls them
+    one at a time, from its writer thread if it has one, so implementations
+    need not be thread-safe but must not assume they are called in the
+    reactor thread.
+    """
+    def load():
+        """
+        Open the store, creating it if necessary, and read the configuration.
+
+        :return: A tuple of the most recently saved ``Deployment`` and a
+            ``list`` of ``(bytes, Diff)`` pairs for the changes leading up to
+            it that the store knows about, oldest first: the hash of a
+            configuration, as returned by ``_configuration_hash``, and the
+            ``Diff`` from it to the next one.
+        """
+
+    def save(deployment, change, history):
+        """
+        Durably record a new configuration.
+
+        :param Deployment deployment: The new configuration.
+        :param change: ``(bytes, Diff)`` pair of the hash of the previously
+            saved configuration and the ``Diff`` from it to ``deployment``.
+        :param tuple history: The most recent ``(bytes, Diff)`` pairs leading
+            up to ``deployment``, oldest first, for ``load`` to return.
+        """
+
+    def close():
+        """
+        Release any resources held by the store.  ``load`` may be called
+        again afterwards.
+        """
+
+
+@implementer(IConfigurationStore)
+class FileConfigurationStore(object):
+    """
+    Store the configuration in files in a directory.
+
+    The configuration is stored as a snapshot of the complete configuration
+    plus a journal of the ``Diff`` s applied to it since the snapshot was
+    written.  Saving a new configuration only appends the ``Diff`` from the
+    previous configuration to the journal, so the cost of a save is
+    proportional to the size of the change rather than the size of the
+    cluster.  Once the journal holds ``compaction_threshold`` entries it is
+    folded into a new snapshot.
+
+    :ivar int _journal_entries: The number of diffs currently in the journal.
     """
     logger = Logger()
 
-    def __init__(self, reactor, path):
+    def __init__(self, path,
+                 compaction_threshold=JOURNAL_COMPACTION_THRESHOLD,
+                 history_size=CONFIGURATION_HISTORY_SIZE,
+                 encoding=WIRE_ENCODING_JSON):
         """
-        :param reactor: Reactor to use for thread pool.
         :param FilePath path: Directory where desired deployment will be
             persisted.
+        :param int compaction_threshold: The number of journal entries after
+            which the journal is compacted into a new snapshot.
+        :param int history_size: The number of most recent changes to
+            remember diffs for.
+        :param unicode encoding: The ``WIRE_ENCODINGS`` member to write
+            configuration snapshots in.  Snapshots in any of them can be
+            loaded.
         """
-        MultiService.__init__(self)
         self._path = path
         self._config_path = self._path.child(b"current_configuration.json")
-        self._change_callbacks = []
-        LeaseService(reactor, self).setServiceParent(self)
-
-    def startService(self):
-        if not self._path.exists():
-            self._path.makedirs()
-        self.load_configuration()
-        MultiService.startService(self)
-        _LOG_STARTUP(configuration=self.get()).write(self.logger)
+        self._journal_path = self._path.child(
+            b"current_configuration.journal")
+        self._history_path = self._path.child(
+            b"current_configuration.history")
+        self._compaction_threshold = compaction_threshold
+        self._history_size = history_size
+        self._encoding = encoding
+        self._journal_entries = 0
 
     def _process_v1_config(self, file_name, archive_name):
         """
@@ -641,17 +1030,13 @@ class ConfigurationPersistenceService(MultiService):
                 self._config_path.setContent(updated_json)
                 v1_config_path.moveTo(v1_archived_path)
 
-    def configuration_hash(self):
-        """
-        :return bytes: A hash of the configuration.
-        """
-        return self._hash
-
-    def load_configuration(self):
+    def load(self):
         """
         Load the persisted configuration, upgrading the configuration format
         if an older version is detected.
         """
+        if not self._path.exists():
+            self._path.makedirs()
         # Version 1 configurations are a special case. They do not store
         # any version information in the configuration data itself, rather they
         # can only be identified by the use of the file name
@@ -666,24 +1051,306 @@ class ConfigurationPersistenceService(MultiService):
 
         # We can now safely attempt to detect and process a >v1 configuration
         # file as normal.
-        if self._config_path.exists():
-            config_json = self._config_path.getContent()
-            config_dict = loads(config_json)
-            config_version = config_dict['version']
-            if config_version < _CONFIG_VERSION:
-                with _LOG_UPGRADE(self.logger,
-                                  configuration=config_json,
-                                  source_version=config_version,
-                                  target_version=_CONFIG_VERSION):
-                    config_json = migrate_configuration(
-                        config_version, _CONFIG_VERSION,
-                        config_json, ConfigurationMigration)
-            config = wire_decode(config_json)
-            self._deployment = config.deployment
-            self._sync_save(config.deployment)
+        if not self._config_path.exists():
+            deployment = Deployment()
         else:
-            self._deployment = Deployment()
-            self._sync_save(self._deployment)
+            config_json = self._config_path.getContent()
+            if config_json.startswith(COMPACT_MAGIC):
+                # The compact encoding was introduced with version 6, so
+                # there are no older compact configurations to migrate.
+                config = wire_decode(config_json)
+            else:
+                config_dict = loads(config_json)
+                config_version = config_dict['version']
+                if config_version < _CONFIG_VERSION:
+                    with _LOG_UPGRADE(self.logger,
+                                      configuration=config_json,
+                                      source_version=config_version,
+                                      target_version=_CONFIG_VERSION):
+                        config_json = migrate_configuration(
+                            config_version, _CONFIG_VERSION,
+                            config_json, ConfigurationMigration)
+                config = wire_decode(config_json)
+            deployment = config.deployment
+        history = deque(self._load_history(deployment),
+                        maxlen=self._history_size)
+        deployment = self._replay_journal(deployment, history)
+        self._compact(deployment, tuple(history))
+        return deployment, list(history)
+
+    def _load_history(self, deployment):
+        """
+        Load the history of changes written by the last compaction, provided
+        it leads up to the configuration loaded from the snapshot.
+
+        :param Deployment deployment: The configuration loaded from the
+            snapshot.
+
+        :return: ``list`` of ``(bytes, Diff)`` pairs, oldest first.
+        """
+        if not self._history_path.exists():
+            return []
+        try:
+            history = wire_decode(self._history_path.getContent())
+        except ValueError:
+            # History is only an optimization; if it is unreadable agents
+            # will just be sent the full configuration.
+            write_traceback(self.logger, u"")
+            return []
+        if history[u"latest"] != _configuration_hash(deployment):
+            return []
+        return [
+            (entry[u"generation"], entry[u"diff"])
+            for entry in history[u"entries"]
+        ]
+
+    def _replay_journal(self, deployment, history):
+        """
+        Apply the ``Diff`` s recorded in the journal to the configuration
+        loaded from the snapshot.
+
+        Each journal entry records the hash of the configuration it applies
+        to.  Entries whose hash does not match are skipped: these were
+        already folded into the snapshot by a compaction that was interrupted
+        before the journal could be removed.
+
+        :param Deployment deployment: The configuration loaded from the
+            snapshot.
+        :param deque history: The history leading up to ``deployment``;
+            replayed changes are appended to it.
+
+        :return Deployment: The configuration with the journal applied.
+        """
+        if not self._journal_path.exists():
+            return deployment
+        lines = self._journal_path.getContent().splitlines()
+        current_hash = _configuration_hash(deployment)
+        for index, line in enumerate(lines):
+            try:
+                entry = wire_decode(line)
+            except ValueError:
+                if index == len(lines) - 1:
+                    # A torn write at the end of the journal; the save it
+                    # belonged to never completed.
+                    _LOG_JOURNAL_TRUNCATED(entries=index).write(self.logger)
+                    break
+                raise
+            if entry[u"generation"] != current_hash:
+                continue
+            history.append((current_hash, entry[u"diff"]))
+            previous = deployment
+            deployment = entry[u"diff"].apply(previous)
+            current_hash = b16encode(
+                update_generation_hash(previous, entry[u"diff"], deployment)
+            ).lower()
+        return deployment
+
+    def _compact(self, deployment, history):
+        """
+        Write a new snapshot of the configuration and discard the journal.
+
+        The history of recent changes is written first, so that if the
+        snapshot write is interrupted the history no longer matches the old
+        snapshot and is ignored rather than misapplied.
+
+        :param Deployment deployment: The configuration to write.
+        :param history: Sequence of ``(bytes, Diff)`` pairs, oldest first,
+            leading up to ``deployment``.
+        """
+        with _LOG_COMPACT_JOURNAL(self.logger, entries=self._journal_entries):
+            self._history_path.setContent(dumps({
+                u"latest": _configuration_hash(deployment),
+                u"entries": [
+                    {u"generation": generation,
+                     u"diff": to_unserialized_json(diff)}
+                    for generation, diff in history
+                ],
+            }))
+            config = Configuration(
+                version=_CONFIG_VERSION, deployment=deployment)
+            self._config_path.setContent(wire_encode(config, self._encoding))
+            if self._journal_path.exists():
+                self._journal_path.remove()
+            self._journal_entries = 0
+
+    def _append_to_journal(self, previous_hash, diff):
+        """
+        Durably append a ``Diff`` to the journal.
+
+        :param bytes previous_hash: The hash of the configuration to which
+            ``diff`` applies.
+        :param Diff diff: The change being saved.
+        """
+        entry = dumps({
+            u"generation": previous_hash,
+            u"diff": to_unserialized_json(diff),
+        }) + b"\n"
+        # Unbuffered, so nothing is left to be written on close once a
+        # failed append has been truncated away:
+        with io.open(self._journal_path.path, "ab", buffering=0) as journal:
+            length = journal.seek(0, os.SEEK_END)
+            try:
+                written = 0
+                while written < len(entry):
+                    written += journal.write(entry[written:])
+                os.fsync(journal.fileno())
+            except:
+                # The service carries on after a failed save, so drop any
+                # partial entry rather than leave a torn line for the next
+                # append to bury in the middle of the journal:
+                journal.truncate(length)
+                raise
+        self._journal_entries += 1
+
+    def save(self, deployment, change, history):
+        """
+        Only the ``Diff`` from the previously saved configuration is written,
+        unless the journal has grown large enough to be compacted.
+        """
+        self._append_to_journal(*change)
+        if self._journal_entries >= self._compaction_threshold:
+            self._compact(deployment, history)
+
+    def close(self):
+        pass
+
+
+class ConfigurationPersistenceService(MultiService):
+    """
+    Persist configuration to an ``IConfigurationStore``, and load it back.
+
+    Writes are group committed: while one write is in progress further saves
+    only update the in-memory configuration, and once the write finishes a
+    single write makes all of them durable together.  If a ``threadpool`` is
+    given the writes happen there rather than in the reactor thread.
+
+    :ivar IConfigurationStore _store: Where the configuration is stored.
+    :ivar Deployment _deployment: The current desired deployment configuration.
+        This may include changes which are not yet durable.
+    :ivar Deployment _durable_deployment: The most recent deployment
+        configuration known to have been written to the store.
+    :ivar bytes _hash: A hash of the configuration, or ``None`` if it has not
+        been computed yet.
+    :ivar deque _history: ``(bytes, Diff)`` pairs for the most recent durable
+        changes, oldest first: the hash of a configuration and the ``Diff``
+        from it to the next one.
+    :ivar list _waiting: ``Deferred`` s for saves which have not been included
+        in any write yet.
+    :ivar Deferred _writing: Fires when the write currently in progress is
+        finished, or ``None`` if no write is in progress.
+    :ivar int saves_requested: The number of saves which changed the
+        configuration.
+    :ivar int writes_performed: The number of writes of the configuration to
+        the store.  Together with ``saves_requested`` this shows how
+        effectively saves are being coalesced.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, path=None,
+                 compaction_threshold=JOURNAL_COMPACTION_THRESHOLD,
+                 threadpool=None, history_size=CONFIGURATION_HISTORY_SIZE,
+                 encoding=WIRE_ENCODING_JSON, store=None):
+        """
+        :param reactor: Reactor to use for thread pool.
+        :param FilePath path: Directory where desired deployment will be
+            persisted by a ``FileConfigurationStore``, if no ``store`` is
+            given.
+        :param int compaction_threshold: Passed to the
+            ``FileConfigurationStore``.
+        :param threadpool: A ``twisted.python.threadpool.ThreadPool`` to write
+            the configuration in, or ``None`` to write it synchronously in the
+            reactor thread.  The service starts and stops the thread pool.
+        :param int history_size: The number of most recent changes to
+            remember diffs for.
+        :param unicode encoding: Passed to the ``FileConfigurationStore``.
+        :param IConfigurationStore store: Where to store the configuration,
+            instead of in files in ``path``.
+        """
+        MultiService.__init__(self)
+        if store is None:
+            store = FileConfigurationStore(
+                path, compaction_threshold=compaction_threshold,
+                history_size=history_size, encoding=encoding,
+            )
+        self._reactor = reactor
+        self._store = store
+        self._history = deque(maxlen=history_size)
+        self._threadpool = threadpool
+        self._change_callbacks = []
+        self._waiting = []
+        self._writing = None
+        self.saves_requested = 0
+        self.writes_performed = 0
+        LeaseService(reactor, self).setServiceParent(self)
+
+    def startService(self):
+        self.load_configuration()
+        if self._threadpool is not None:
+            self._threadpool.start()
+        MultiService.startService(self)
+        _LOG_STARTUP(configuration=self.get()).write(self.logger)
+
+    def stopService(self):
+        """
+        Stop the service once any outstanding saves have been written.
+        """
+        d = maybeDeferred(MultiService.stopService, self)
+        d.addCallback(lambda _: self._flush())
+        d.addCallback(lambda _: self._store.close())
+        if self._threadpool is not None:
+            d.addCallback(lambda _: self._threadpool.stop())
+        return d
+
+    def _flush(self):
+        """
+        :return: A ``Deferred`` that fires when all saves requested so far
+            have been written.
+        """
+        if self._writing is None and not self._waiting:
+            return succeed(None)
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+    def configuration_hash(self):
+        """
+        :return bytes: A hash of the configuration.
+        """
+        if self._hash is None:
+            self._hash = _configuration_hash(self._deployment)
+        return self._hash
+
+    def configuration_history(self):
+        """
+        :return: A ``list`` of ``(GenerationHash, Diff)`` pairs for the most
+            recent changes to the configuration that have been written to
+            the store, oldest first.  Applying the ``Diff`` s in order to the
+            configuration with the first hash gives the configuration most
+            recently written.
+        """
+        return [
+            (GenerationHash(hash_value=b16decode(generation.upper())), diff)
+            for generation, diff in self._history
+        ]
+
+    def load_configuration(self):
+        """
+        Load the configuration from the store.
+        """
+        deployment, history = self._store.load()
+        self._history.clear()
+        self._history.extend(history)
+        self._deployment = self._durable_deployment = deployment
+        self._hash = _configuration_hash(deployment)
+
+    def _latest_change(self):
+        """
+        :return: The ``Diff`` written by the most recent write, or ``None`` if
+            it is not remembered.
+        """
+        if not self._history:
+            return None
+        return self._history[-1][1]
 
     def register(self, change_callback):
         """
@@ -694,39 +1361,120 @@ class ConfigurationPersistenceService(MultiService):
         """
         self._change_callbacks.append(change_callback)
 
-    def _sync_save(self, deployment):
+    def _sync_save(self, previous, deployment, history):
+        """
+        Save new configuration to the store synchronously.
+
+        :param Deployment previous: The configuration most recently written.
+        :param Deployment deployment: The configuration to write.
+        :param tuple history: The history of changes leading up to
+            ``previous``.
+
+        :return: The ``(bytes, Diff)`` history entry for this change.
         """
-        Save and flush new configuration to disk synchronously.
+        entry = (
+            _configuration_hash(previous), create_diff(previous, deployment))
+        self._store.save(
+            deployment, entry,
+            tuple(deque(history + (entry,), maxlen=self._history.maxlen)),
+        )
+        return entry
+
+    def _start_write(self):
+        """
+        Write the current configuration, and fire the ``Deferred`` s of all
+        saves waiting on it once it is durable.
+        """
+        waiting, self._waiting = self._waiting, []
+        previous = self._durable_deployment
+        deployment = self._deployment
+        if previous is deployment:
+            # Everything is already durable; these are only waiting for
+            # earlier writes to finish.
+            for d in waiting:
+                d.callback(None)
+            return
+        history = tuple(self._history)
+        if self._threadpool is None:
+            writing = maybeDeferred(
+                self._sync_save, previous, deployment, history)
+        else:
+            writing = deferToThreadPool(
+                self._reactor, self._threadpool,
+                self._sync_save, previous, deployment, history,
+            )
+        self.writes_performed += 1
+        self._writing = writing
+
+        def written(entry):
+            self._writing = None
+            self._durable_deployment = deployment
+            self._history.append(entry)
+            self._notify_changed()
+            for d in waiting:
+                d.callback(None)
+
+        def failed(reason):
+            self._writing = None
+            if self._deployment is deployment:
+                # Nothing newer was saved meanwhile, so stop serving the
+                # configuration that wasn't written; saving it again will
+                # then retry the write rather than being skipped as
+                # unchanged.
+                self._deployment = previous
+                self._hash = None
+            for d in waiting:
+                d.errback(reason)
+
+        writing.addCallbacks(written, failed)
+        writing.addCallback(self._maybe_start_write)
+
+    def _maybe_start_write(self, ignored=None):
+        """
+        Start another write if there are saves waiting for one and no write is
+        in progress.
         """
-        config = Configuration(version=_CONFIG_VERSION, deployment=deployment)
-        data = wire_encode(config)
-        self._hash = b16encode(mmh3_hash_bytes(data)).lower()
-        self._config_path.setContent(data)
+        if self._writing is None and self._waiting:
+            self._start_write()
+
+    def _notify_changed(self):
+        """
+        Call all registered change callbacks.
+        """
+        # At some future point this will likely involve talking to a
+        # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
+        # guarantee immediate saving of the data.
+        for callback in self._change_callbacks:
+            try:
+                callback()
+            except:
+                # Second argument will be ignored in next Eliot release, so
+                # not bothering with particular value.
+                write_traceback(self.logger, u"")
 
     def save(self, deployment):
         """
         Save and flush new deployment to disk.
 
-        :return Deferred: Fires when write is finished.
+        The new deployment is returned by ``get`` immediately.  It is written
+        to disk together with any other saves made while an earlier write is
+        still in progress.
+
+        :return Deferred: Fires when the write including this deployment is
+            finished.
         """
         if deployment == self._deployment:
             _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED().write(self.logger)
-            return succeed(None)
+            return self._flush()
 
         with _LOG_SAVE(self.logger, configuration=deployment):
-            self._sync_save(deployment)
+            self.saves_requested += 1
             self._deployment = deployment
-            # At some future point this will likely involve talking to a
-            # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
-            # guarantee immediate saving of the data.
-            for callback in self._change_callbacks:
-                try:
-                    callback()
-                except:
-                    # Second argument will be ignored in next Eliot release, so
-                    # not bothering with particular value.
-                    write_traceback(self.logger, u"")
-            return succeed(None)
+            self._hash = None
+            d = Deferred()
+            self._waiting.append(d)
+            self._maybe_start_write()
+            return d
 
     def get(self):
         """
@@ -27,14 +27,21 @@ Eliot contexts are transferred along with AMP commands, allowing tracing
 of logged actions across processes (see
 http://eliot.readthedocs.org/en/0.6.0/threads.html).
 
-:var _wire_encode_cache: ``LRUCache`` mapping serializable objects to
-    their ``wire_encode`` output.
+:var _wire_encode_caches: ``dict`` mapping each of ``WIRE_ENCODINGS`` to an
+    ``IdentityCache`` mapping serializable objects to their ``wire_encode``
+    output in that encoding.
+:var _compress_cache: ``IdentityCache`` mapping objects sent as ``Big``
+    arguments to a ``tuple`` of their serialized ``bytes`` and those bytes
+    compressed.
 """
 
 from collections import defaultdict
 from datetime import timedelta
 from io import BytesIO
 from itertools import count
+from math import exp
+from timeit import default_timer
+from zlib import compress, decompress
 from twisted.internet.defer import maybeDeferred
 from uuid import UUID
 from functools import partial
@@ -46,16 +53,15 @@ from eliot.twisted import DeferredContext
 
 from pyrsistent import PClass, field
 
-from repoze.lru import LRUCache
-
 from characteristic import with_cmp
 
 from zope.interface import Interface, Attribute
 
 from twisted.application.service import Service
 from twisted.protocols.amp import (
-    Argument, Command, Integer, CommandLocator, AMP, Unicode,
-    MAX_VALUE_LENGTH,
+    Argument, Command, Integer, CommandLocator, AMP, Unicode, ListOf,
+    Boolean, MAX_VALUE_LENGTH, COMMAND, ASK, ANSWER, ERROR,
+    _wireNameToPythonIdentifier,
 )
 from twisted.internet.error import AlreadyCalled
 from twisted.internet.task import LoopingCall
@@ -63,24 +69,92 @@ from twisted.internet.protocol import ServerFactory
 from twisted.application.internet import StreamServerEndpointService
 from twisted.protocols.tls import TLSMemoryBIOFactory
 
-from ._persistence import wire_encode, wire_decode, make_generation_hash
+from ._cache import IdentityCache
+from ._metrics import MetricsRegistry
+from ._persistence import (
+    wire_encode, wire_decode, make_generation_hash, CONFIGURATION_HISTORY_SIZE,
+    WIRE_ENCODING_JSON, WIRE_ENCODINGS,
+)
 from ._model import (
     Deployment, DeploymentState, ChangeSource, UpdateNodeStateEra,
-    BlockDeviceOwnership, DatasetAlreadyOwned, GenerationHash,
+    BlockDeviceOwnership, DatasetAlreadyOwned, GenerationHash, node_view,
 )
 from ._diffing import (
-    Diff
+    Diff, _Replace
 )
 from ._generations import GenerationTracker
 
 PING_INTERVAL = timedelta(seconds=30)
 
+# The compressions ``Big`` arguments can be sent with, most preferred first:
+WIRE_COMPRESSION_ZLIB = u"zlib"
+WIRE_COMPRESSIONS = [WIRE_COMPRESSION_ZLIB]
+
+# ``Big`` arguments which serialize to fewer bytes than this are not worth
+# compressing:
+_COMPRESSION_MINIMUM = 1024
+
+_compress_cache = IdentityCache()
+
+# The metrics of AMP traffic recorded by protocols and services which aren't
+# given their own registry:
+AMP_METRICS = MetricsRegistry()
+
+
+def _command_metric(command_name, *parts):
+    """
+    :param bytes command_name: The name of an AMP command.
+    :param parts: ``unicode`` parts of the name of a metric of the command.
+
+    :return unicode: The full name of the metric.
+    """
+    return u".".join((u"amp", command_name.decode("ascii")) + parts)
+
+
+def _box_size(box):
+    """
+    :param AmpBox box: An AMP box.
+
+    :return int: The number of bytes ``box`` takes on the wire.
+    """
+    # Each key and value is preceded by its two byte length, and the box ends
+    # with an empty key:
+    return sum(len(key) + len(value) + 4 for key, value in box.items()) + 2
+
+
+def _compressed(obj, serialized):
+    """
+    Compress the serialized form of an object, or return the cached result
+    if available.
+
+    :param obj: The object that was serialized.
+    :param bytes serialized: Its serialized form.
+
+    :return bytes: ``serialized`` compressed with zlib.
+    """
+    cached = _compress_cache.get(obj)
+    # The object may have been serialized differently, for example in
+    # another encoding, since it was cached:
+    if cached is not None and cached[0] is serialized:
+        return cached[1]
+    result = compress(serialized)
+    _compress_cache[obj] = (serialized, result)
+    return result
+
 
 class Big(Argument):
     """
     An ``Argument`` type which can handle objects which are larger than AMP's
     MAX_VALUE_LENGTH when serialized.
 
+    Values are compressed when the peer has agreed to a compression in
+    ``VersionCommand``, which is recorded in the protocol's
+    ``wire_compression`` attribute.  The compression used is sent alongside
+    the chunks, so a value can be decoded whatever has been agreed.
+
+    How long decoding each argument of a command takes is recorded in the
+    receiving protocol's ``metrics``, if it has them.
+
     Thanks to Glyph Lefkowitz for the idea:
     * http://bazaar.launchpad.net/~glyph/+junk/amphacks/view/head:/python/amphacks/mediumbox.py  # noqa
     """
@@ -89,6 +163,9 @@ class Big(Argument):
         :param Argument another_argument: The wrapped AMP ``Argument``.
         """
         self.another_argument = another_argument
+        # The last value serialized and its chunks, so the same value sent to
+        # many agents in a row is only split once:
+        self._last_chunks = (None, ())
 
     def toBox(self, name, strings, objects, proto):
         """
@@ -100,15 +177,26 @@ class Big(Argument):
 
         See ``IArgumentType`` for argument and return type documentation.
         """
+        obj = objects.get(_wireNameToPythonIdentifier(name))
         self.another_argument.toBox(name, strings, objects, proto)
-        value = BytesIO(strings.pop(name))
-        counter = 0
-        while True:
-            nextChunk = value.read(MAX_VALUE_LENGTH)
-            if not nextChunk:
-                break
-            strings["%s.%d" % (name, counter)] = nextChunk
-            counter += 1
+        serialized = strings.pop(name)
+        compression = getattr(proto, "wire_compression", None)
+        if (compression == WIRE_COMPRESSION_ZLIB and
+                len(serialized) >= _COMPRESSION_MINIMUM):
+            serialized = _compressed(obj, serialized)
+            strings["%s.compression" % (name,)] = compression.encode("ascii")
+        last_serialized, chunks = self._last_chunks
+        if serialized is not last_serialized:
+            value = BytesIO(serialized)
+            chunks = []
+            while True:
+                nextChunk = value.read(MAX_VALUE_LENGTH)
+                if not nextChunk:
+                    break
+                chunks.append(nextChunk)
+            self._last_chunks = (serialized, chunks)
+        for counter, chunk in enumerate(chunks):
+            strings["%s.%d" % (name, counter)] = chunk
 
     def fromBox(self, name, strings, objects, proto):
         """
@@ -121,7 +209,7 @@ class Big(Argument):
 
         See ``IArgumentType`` for argument and return type documentation.
         """
-
+        start = default_timer()
         value = BytesIO()
         for counter in count(0):
             chunk = strings.get("%s.%d" % (name, counter))
@@ -129,29 +217,49 @@ class Big(Argument):
                 break
             value.write(chunk)
             strings[name] = value.getvalue()
+        compression = strings.get("%s.compression" % (name,))
+        if compression is not None:
+            if compression.decode("ascii") != WIRE_COMPRESSION_ZLIB:
+                raise ValueError(
+                    "Unknown compression {!r}".format(compression))
+            strings[name] = decompress(strings[name])
         self.another_argument.fromBox(name, strings, objects, proto)
+        metrics = getattr(proto, "metrics", None)
+        # Responses don't say which command they answer:
+        command_name = strings.get(COMMAND)
+        if metrics is not None and command_name is not None:
+            metrics.record(
+                _command_metric(
+                    command_name, name.decode("ascii"), u"decode_seconds"),
+                default_timer() - start)
 
 
-# The configuration and state can get pretty big, so don't want too many:
-_wire_encode_cache = LRUCache(50)
+# Entries only live as long as the object they encode, so the encoding of the
+# latest configuration and state is kept however many others are encoded:
+_wire_encode_caches = {
+    encoding: IdentityCache() for encoding in WIRE_ENCODINGS
+}
 
 
-def caching_wire_encode(obj):
+def caching_wire_encode(obj, encoding=WIRE_ENCODING_JSON):
     """
     Encode an object to bytes using ``wire_encode`` and cache the result,
     or return cached result if available.
 
     This relies on cached objects being immutable, or at least not being
     modified. Given our usage patterns that is currently the case and
-    should continue to be, but worth keeping in mind.
+    should continue to be, but worth keeping in mind.  Results are cached
+    by identity, so encoding an equal but different object is a miss.
 
     :param obj: Object to encode.
+    :param unicode encoding: One of ``WIRE_ENCODINGS``.
     :return: Resulting ``bytes``.
     """
-    result = _wire_encode_cache.get(obj)
+    cache = _wire_encode_caches[encoding]
+    result = cache.get(obj)
     if result is None:
-        result = wire_encode(obj)
-        _wire_encode_cache.put(obj, result)
+        result = wire_encode(obj, encoding)
+        cache[obj] = result
     return result
 
 
@@ -159,6 +267,10 @@ class SerializableArgument(Argument):
     """
     AMP argument that takes an object that can be serialized by the
     configuration persistence layer.
+
+    Objects are encoded using the ``wire_encoding`` negotiated for the
+    connection, or JSON if none has been.  Any of ``WIRE_ENCODINGS`` can be
+    decoded.
     """
     def __init__(self, *classes):
         """
@@ -178,11 +290,15 @@ class SerializableArgument(Argument):
         return obj
 
     def toString(self, obj):
+        return self.toStringProto(obj, None)
+
+    def toStringProto(self, obj, proto):
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
             )
-        return caching_wire_encode(obj)
+        return caching_wire_encode(
+            obj, getattr(proto, "wire_encoding", WIRE_ENCODING_JSON))
 
 
 class _EliotActionArgument(Unicode):
@@ -203,9 +319,60 @@ class VersionCommand(Command):
     Return configuration protocol version of the control service.
 
     Semantic versioning: Major version changes implies incompatibility.
+
+    The caller may also list the ``WIRE_ENCODINGS`` it supports, most
+    preferred first, in which case the response includes the one that both
+    sides will use from then on to encode objects.  Peers that predate
+    encoding negotiation neither send nor answer this, and so continue using
+    JSON.
+
+    Likewise the caller may list the ``WIRE_COMPRESSIONS`` it supports, in
+    which case the response includes the one both sides will use from then
+    on to compress ``Big`` arguments, if any.  Peers that predate this send
+    everything uncompressed.
+
+    The response also says whether the control service accepts
+    ``NodeStateDiffCommand``; agents only send full states to control
+    services that don't say so.
+    """
+    arguments = [('encodings', ListOf(Unicode(), optional=True)),
+                 ('compressions', ListOf(Unicode(), optional=True))]
+    response = [('major', Integer()),
+                ('encoding', Unicode(optional=True)),
+                ('compression', Unicode(optional=True)),
+                ('node_state_diffs', Boolean(optional=True))]
+
+
+def choose_wire_encoding(encodings):
     """
-    arguments = []
-    response = [('major', Integer())]
+    Choose the encoding to use with a peer.
+
+    :param encodings: The ``WIRE_ENCODINGS`` the peer supports, most
+        preferred first, or ``None`` if it did not say.
+
+    :return unicode: The first of ``encodings`` that is also supported
+        locally, or JSON if there are none.
+    """
+    for encoding in encodings or ():
+        if encoding in WIRE_ENCODINGS:
+            return encoding
+    return WIRE_ENCODING_JSON
+
+
+def choose_wire_compression(compressions):
+    """
+    Choose the compression to use with a peer.
+
+    :param compressions: The ``WIRE_COMPRESSIONS`` the peer supports, most
+        preferred first, or ``None`` if it did not say.
+
+    :return: The first of ``compressions`` that is also supported locally,
+        or ``None`` if there are none.
+    """
+    for compression in compressions or ():
+        if compression in WIRE_COMPRESSIONS:
+            return compression
+    return None
 
 
 class NoOp(Command):
@@ -271,6 +438,17 @@ class ClusterStatusDiffCommand(Command):
     response = CLUSTER_UPDATE_RESPONSE
 
 
+class ClusterGenerationsCommand(Command):
+    """
+    Used by a convergence agent when it connects to tell the control service
+    which generations of the configuration and state it already has, so that
+    the control service can send it diffs rather than the full configuration
+    and state.
+    """
+    arguments = CLUSTER_UPDATE_RESPONSE
+    response = []
+
+
 class SetNodeEraCommand(Command):
     """
     Tell the control service the current era for a node.
@@ -285,6 +463,19 @@ class SetNodeEraCommand(Command):
     response = []
 
 
+class SetNodeScopeCommand(Command):
+    """
+    Used by a convergence agent to ask to be sent only the parts of the
+    configuration and state needed to converge its node, as described by
+    ``node_view``, rather than those of the whole cluster.
+
+    Control services that predate this command reject it, and continue to
+    send the whole cluster.
+    """
+    arguments = [('node_uuid', Unicode())]
+    response = []
+
+
 class NodeStateCommand(Command):
     """
     Used by a convergence agent to update the control service about the
@@ -314,6 +505,27 @@ class NodeStateCommand(Command):
     response = []
 
 
+class NodeStateDiffCommand(Command):
+    """
+    Used by a convergence agent to update the control service about the
+    status of a particular node, sending only the differences from the state
+    the control service last acknowledged over the same connection.
+
+    The state is the same sequence of changes ``NodeStateCommand`` sends,
+    with a ``Diff`` for each of them.  If the control service's copy of the
+    state doesn't have the start generation, or applying the diffs doesn't
+    give the end generation, the response says the diffs were not applied
+    and the agent sends the full state with ``NodeStateCommand`` instead.
+    """
+    arguments = [
+        ('state_diffs', Big(SerializableArgument(list, tuple))),
+        ('start_generation', Big(SerializableArgument(GenerationHash))),
+        ('end_generation', Big(SerializableArgument(GenerationHash))),
+        ('eliot_context', _EliotActionArgument()),
+    ]
+    response = [('applied', Boolean())]
+
+
 class SetBlockDeviceIdForDatasetId(Command):
     """
     Indicate a specific block device id is the one for given dataset id.
@@ -366,8 +578,13 @@ class ControlServiceLocator(CommandLocator):
     :ivar IClusterStateSource _source: The change source uniquely representing
         the AMP connection for which this locator is being used.
     :ivar _reactor: See ``reactor`` parameter of ``__init__``
+    :ivar _connection: See ``connection`` parameter of ``__init__``
+    :ivar tuple _node_state: The state changes most recently received from
+        the agent, which ``NodeStateDiffCommand`` diffs apply to, or ``None``
+        if none have been received.
     """
-    def __init__(self, reactor, control_amp_service, timeout):
+    def __init__(self, reactor, control_amp_service, timeout,
+                 connection=None):
         """
         :param IReactorTime reactor: A reactor to use to tell the time for
             activity/inactivity reporting.
@@ -375,6 +592,8 @@ class ControlServiceLocator(CommandLocator):
             connections to the control service.
         :param Timeout timeout: A ``Timeout`` object to reset when a message
             is received.
+        :param ControlAMP connection: The connection this locator responds to
+            commands for.
         """
         CommandLocator.__init__(self)
 
@@ -387,6 +606,8 @@ class ControlServiceLocator(CommandLocator):
         self._timeout = timeout
 
         self._reactor = reactor
+        self._connection = connection
+        self._node_state = None
         self.control_amp_service = control_amp_service
 
     def locateResponder(self, name):
@@ -402,6 +623,10 @@ class ControlServiceLocator(CommandLocator):
     def logger(self):
         return self.control_amp_service.logger
 
+    @property
+    def metrics(self):
+        return self.control_amp_service.metrics
+
     @NoOp.responder
     def noop(self):
         """
@@ -410,17 +635,58 @@ class ControlServiceLocator(CommandLocator):
         return {}
 
     @VersionCommand.responder
-    def version(self):
-        return {"major": 1}
+    def version(self, encodings=None, compressions=None):
+        result = {"major": 1, "node_state_diffs": True}
+        if encodings is not None and self._connection is not None:
+            encoding = choose_wire_encoding(encodings)
+            # Everything sent after this response uses the new encoding, and
+            # the agent can decode it even before it sees the response.
+            self._connection.wire_encoding = encoding
+            result["encoding"] = encoding
+        if compressions is not None and self._connection is not None:
+            compression = choose_wire_compression(compressions)
+            self._connection.wire_compression = compression
+            result["compression"] = compression
+        return result
 
     @NodeStateCommand.responder
     def node_changed(self, eliot_context, state_changes):
         with eliot_context:
+            self._node_state = tuple(state_changes)
             self.control_amp_service.node_changed(
                 self._source, state_changes,
             )
             return {}
 
+    @NodeStateDiffCommand.responder
+    def node_changed_diff(self, eliot_context, state_diffs, start_generation,
+                          end_generation):
+        with eliot_context:
+            if (self._node_state is None or
+                    len(state_diffs) != len(self._node_state) or
+                    make_generation_hash(self._node_state) !=
+                    start_generation):
+                return {"applied": False}
+            state_changes = tuple(
+                diff.apply(change)
+                for diff, change in zip(state_diffs, self._node_state))
+            if make_generation_hash(state_changes) != end_generation:
+                return {"applied": False}
+            self._node_state = state_changes
+            self.control_amp_service.node_changed(
+                self._source, state_changes,
+            )
+            return {"applied": True}
+
+    @ClusterGenerationsCommand.responder
+    def cluster_generations(self, current_configuration_generation,
+                            current_state_generation):
+        self.control_amp_service.agent_generations(
+            self._connection, current_configuration_generation,
+            current_state_generation,
+        )
+        return {}
+
     @SetNodeEraCommand.responder
     def set_node_era(self, era, node_uuid):
         # Further work will be done in FLOC-3380
@@ -432,6 +698,12 @@ class ControlServiceLocator(CommandLocator):
         # with more interesting information.
         return {}
 
+    @SetNodeScopeCommand.responder
+    def set_node_scope(self, node_uuid):
+        self.control_amp_service.scope_to_node(
+            self._connection, UUID(node_uuid))
+        return {}
+
     @SetBlockDeviceIdForDatasetId.responder
     def set_blockdevice_id(self, dataset_id, blockdevice_id):
         deployment = self.control_amp_service.configuration_service.get()
@@ -467,13 +739,101 @@ def timeout_for_protocol(reactor, protocol):
                    lambda: protocol.transport.abortConnection())
 
 
-class ControlAMP(AMP):
+class _InstrumentedAMP(AMP):
+    """
+    An ``AMP`` protocol which records its traffic in a ``MetricsRegistry``.
+
+    The sizes of the requests and responses of each command are recorded
+    whichever side sends them.  The side that sends a request also records
+    how long ``callRemote`` took to encode and send it and how long the
+    response took to arrive.
+
+    :ivar MetricsRegistry metrics: The registry to record metrics in.
+    :ivar _reactor: The ``IReactorTime`` used to time responses.
+    :ivar dict _unanswered_sent: Map the tags of requests sent that are
+        awaiting a response to the name of their command and the time they
+        were sent.
+    :ivar dict _unanswered_received: Map the tags of requests received that
+        haven't been responded to to the name of their command.
+    """
+    def __init__(self, reactor, metrics, locator):
+        """
+        :param IReactorTime reactor: See ``_reactor``.
+        :param MetricsRegistry metrics: See ``metrics``.
+        :param CommandLocator locator: The responders for commands received.
+        """
+        AMP.__init__(self, locator=locator)
+        self.metrics = metrics
+        self._reactor = reactor
+        self._unanswered_sent = {}
+        self._unanswered_received = {}
+
+    def callRemote(self, command, **kwargs):
+        start = default_timer()
+        try:
+            return AMP.callRemote(self, command, **kwargs)
+        finally:
+            self.metrics.record(
+                _command_metric(command.commandName, u"encode_seconds"),
+                default_timer() - start)
+
+    def sendBox(self, box):
+        if COMMAND in box:
+            name = box[COMMAND]
+            self.metrics.record(
+                _command_metric(name, u"request_bytes"), _box_size(box))
+            if ASK in box:
+                self._unanswered_sent[box[ASK]] = (
+                    name, self._reactor.seconds())
+        else:
+            name = self._unanswered_received.pop(
+                box.get(ANSWER, box.get(ERROR)), None)
+            if name is not None:
+                self.metrics.record(
+                    _command_metric(name, u"response_bytes"), _box_size(box))
+        AMP.sendBox(self, box)
+
+    def ampBoxReceived(self, box):
+        if COMMAND in box:
+            name = box[COMMAND]
+            self.metrics.record(
+                _command_metric(name, u"request_bytes"), _box_size(box))
+            if ASK in box:
+                self._unanswered_received[box[ASK]] = name
+        else:
+            sent = self._unanswered_sent.pop(
+                box.get(ANSWER, box.get(ERROR)), None)
+            if sent is not None:
+                name, when = sent
+                self.metrics.record(
+                    _command_metric(name, u"response_bytes"), _box_size(box))
+                self.metrics.record(
+                    _command_metric(name, u"round_trip_seconds"),
+                    self._reactor.seconds() - when)
+                if ERROR in box:
+                    self.metrics.increment(_command_metric(name, u"errors"))
+        AMP.ampBoxReceived(self, box)
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        self._unanswered_sent.clear()
+        self._unanswered_received.clear()
+
+
+class ControlAMP(_InstrumentedAMP):
     """
     AMP protocol for control service server.
 
     :ivar Pinger _pinger: Helper which periodically pings this protocol's peer
         to verify it's still alive.
+    :ivar unicode wire_encoding: The ``WIRE_ENCODINGS`` member used to encode
+        objects sent to the agent.
+    :ivar wire_compression: The ``WIRE_COMPRESSIONS`` member used to compress
+        ``Big`` arguments sent to the agent, or ``None``.
     """
+    wire_encoding = WIRE_ENCODING_JSON
+    wire_compression = None
+
     def __init__(self, reactor, control_amp_service):
         """
         :param reactor: See ``ControlServiceLocator.__init__``.
@@ -482,8 +842,9 @@ class ControlAMP(AMP):
         """
         self._ping_timeout = timeout_for_protocol(reactor, self)
         locator = ControlServiceLocator(reactor, control_amp_service,
-                                        self._ping_timeout)
-        AMP.__init__(self, locator=locator)
+                                        self._ping_timeout, self)
+        _InstrumentedAMP.__init__(
+            self, reactor, control_amp_service.metrics, locator)
 
         self.control_amp_service = control_amp_service
         self._pinger = Pinger(reactor)
@@ -494,7 +855,7 @@ class ControlAMP(AMP):
         self._pinger.start(self, PING_INTERVAL)
 
     def connectionLost(self, reason):
-        AMP.connectionLost(self, reason)
+        _InstrumentedAMP.connectionLost(self, reason)
         self.control_amp_service.disconnected(self)
         self._pinger.stop()
         self._ping_timeout.cancel()
@@ -572,12 +933,85 @@ class _UpdateState(PClass):
     next_scheduled = field()
 
 
-# The control service waits this long before sending any update to an agent.
-# This allows for a batch of updates to build up, and effectively puts a cap on
-# the maximum number of updates the control node will have to send over any
-# fixed period of time.
+AGENT_UPDATES_BATCHED = MessageType(
+    "flocker:controlservice:agent_updates_batched",
+    [Field.for_types(u"delay", [float],
+                     u"How long the batch waited to build up, in seconds."),
+     Field.for_types(u"coalesced", [int, long],
+                     u"The number of updates sent as part of the batch."),
+     Field.for_types(u"connections", [int, long],
+                     u"The number of agents the batch is sent to.")],
+    u"A batch of updates is being sent to agents.",
+)
+
+
+# The control service waits at most this long before sending any update to an
+# agent.  This allows for a batch of updates to build up, and effectively puts
+# a cap on the maximum number of updates the control node will have to send
+# over any fixed period of time.
 CONTROL_SERVICE_BATCHING_DELAY = 1.0
 
+# The control service waits at least this long before sending an update, even
+# when updates are rare and few agents are connected.
+CONTROL_SERVICE_MINIMUM_BATCHING_DELAY = 0.05
+
+# Each this many connected agents add the minimum delay again to the batching
+# delay, since every update costs a send to each of them.
+_BATCHING_CONNECTIONS_SCALE = 100.0
+
+
+class _BatchingWindow(object):
+    """
+    Choose how long to wait for updates to build up before sending them.
+
+    The window is the minimum delay scaled by the recent rate of updates and
+    by the number of connected agents, so that a quiet cluster is updated
+    almost immediately and a busy one sends fewer, larger batches.
+
+    :ivar float minimum: The shortest window, in seconds.
+    :ivar float maximum: The longest window, in seconds.  Update requests are
+        forgotten over about this long.
+    :ivar float _requests: The number of recent update requests, decayed
+        exponentially with their age.
+    :ivar _last_request: The time of the latest update request, or ``None``.
+    """
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self._requests = 0.0
+        self._last_request = None
+
+    def request(self, now):
+        """
+        Record a request for an update.
+
+        :param float now: The current time.
+        """
+        if self._last_request is not None:
+            age = now - self._last_request
+            if self.maximum > 0:
+                self._requests *= exp(-age / self.maximum)
+            else:
+                self._requests = 0.0
+        self._requests += 1
+        self._last_request = now
+
+    def delay(self, connections):
+        """
+        :param int connections: The number of connected agents.
+
+        :return float: How long to wait before sending a batch of updates.
+        """
+        delay = (self.minimum * max(self._requests, 1.0) *
+                 (1 + connections / _BATCHING_CONNECTIONS_SCALE))
+        return max(self.minimum, min(self.maximum, delay))
+
+
+# The number of generations of each node's view of the configuration and of
+# the state kept to send diffs from.  Views change far less often than the
+# whole cluster does.
+NODE_VIEW_HISTORY_SIZE = 10
+
 
 class _ConfigAndStateGeneration(PClass):
     """
@@ -592,6 +1026,60 @@ class _ConfigAndStateGeneration(PClass):
     state_hash = field(type=(GenerationHash, type(None)), initial=None)
 
 
+class _ClusterUpdate(PClass):
+    """
+    A command to bring agents with a particular pair of generations up to
+    date, shared by all of them.
+
+    :ivar command: ``ClusterStatusCommand`` or ``ClusterStatusDiffCommand``.
+    :ivar arguments: ``dict`` of the arguments of ``command`` other than the
+        Eliot context, which differs for each agent.
+    """
+    command = field()
+    arguments = field(type=dict)
+
+
+def _replacement_diff(generation, tracker):
+    """
+    Make a ``Diff`` that replaces an agent's copy of an object with the latest
+    one, for when the tracker no longer knows the agent's generation but a
+    ``Diff`` is needed anyway to send alongside one for the other object.
+
+    :param GenerationHash generation: The generation the agent has.
+    :param GenerationTracker tracker: The tracker of the object.
+
+    :return: A ``Diff`` or ``None`` if the agent has no copy of the object to
+        replace.
+    """
+    if generation is None:
+        return None
+    return Diff(changes=[_Replace(value=tracker.get_latest())])
+
+
+def _diff_worth_sending(diff, tracker, encoding):
+    """
+    Decide whether to send a ``Diff`` to an agent rather than the latest
+    object it leads to.  A diff composed from many generations can be bigger
+    than the object itself.
+
+    :param diff: A ``Diff`` to the latest version of the object, or ``None``.
+    :param GenerationTracker tracker: The tracker of the object.
+    :param unicode encoding: The ``WIRE_ENCODINGS`` member the agent's
+        connection uses.
+
+    :return: ``diff``, or ``None`` if it encodes to at least as many bytes
+        as the latest object.
+    """
+    if diff is None:
+        return None
+    # Both encodings are cached, so they are reused when the diff or the
+    # object is sent:
+    if (len(caching_wire_encode(diff, encoding)) >=
+            len(caching_wire_encode(tracker.get_latest(), encoding))):
+        return None
+    return diff
+
+
 class ControlAMPService(Service):
     """
     Control Service AMP server.
@@ -609,11 +1097,32 @@ class ControlAMPService(Service):
     :ivar IDelayedCall _current_pending_update_delayed_call: The
         ``IDelayedCall`` provider for the currently pending call to update
         state/configuration on connected nodes.
+    :ivar dict _node_scopes: Map connections of agents which asked to be sent
+        only the view of the cluster for their node to the node's ``UUID``.
+    :ivar dict _node_view_trackers: Map the ``UUID`` of each node in
+        ``_node_scopes`` to a ``tuple`` of the ``GenerationTracker`` s of its
+        view of the configuration and of the state.
+    :ivar _BatchingWindow _batching: Chooses how long pending updates wait.
+    :ivar float batching_delay: The delay chosen for the most recent batch of
+        updates.
+    :ivar int batches: The number of batches of updates sent.
+    :ivar int coalesced: The number of update requests which joined an
+        already pending batch rather than starting one.
+    :ivar int _pending_requests: The number of update requests in the pending
+        batch.
+    :ivar MetricsRegistry metrics: The registry the service and its
+        connections record metrics in.  Besides those of the AMP traffic, it
+        counts the cluster updates sent as diffs and in full, and the updates
+        elided and delayed because agents hadn't acknowledged earlier ones,
+        and records how long agents take to acknowledge updates.
     """
     logger = Logger()
 
     def __init__(self, reactor, cluster_state, configuration_service, endpoint,
-                 context_factory):
+                 context_factory,
+                 minimum_batching_delay=CONTROL_SERVICE_MINIMUM_BATCHING_DELAY,
+                 maximum_batching_delay=CONTROL_SERVICE_BATCHING_DELAY,
+                 metrics=None):
         """
         :param reactor: See ``ControlServiceLocator.__init__``.
         :param ClusterStateService cluster_state: Object that records known
@@ -622,17 +1131,35 @@ class ControlAMPService(Service):
             Persistence service for desired cluster configuration.
         :param endpoint: Endpoint to listen on.
         :param context_factory: TLS context factory.
+        :param float minimum_batching_delay: The shortest time, in seconds,
+            to wait for updates to build up before sending them to agents.
+        :param float maximum_batching_delay: The longest time, in seconds,
+            to wait for updates to build up before sending them to agents.
+        :param MetricsRegistry metrics: The registry to record metrics in, or
+            ``None`` to use ``AMP_METRICS``.
         """
         self._connections = set()
         self._reactor = reactor
         self._connections_pending_update = set()
         self._current_pending_update_delayed_call = None
+        self._batching = _BatchingWindow(
+            minimum_batching_delay, maximum_batching_delay)
+        self.batching_delay = None
+        self.batches = 0
+        self.coalesced = 0
+        self._pending_requests = 0
+        if metrics is None:
+            metrics = AMP_METRICS
+        self.metrics = metrics
         self._current_command = {}
         self._last_received_generation = defaultdict(
             lambda: _ConfigAndStateGeneration()
         )
-        self._configuration_generation_tracker = GenerationTracker(100)
+        self._configuration_generation_tracker = GenerationTracker(
+            CONFIGURATION_HISTORY_SIZE)
         self._state_generation_tracker = GenerationTracker(100)
+        self._node_scopes = {}
+        self._node_view_trackers = {}
         self.cluster_state = cluster_state
         self.configuration_service = configuration_service
         self.endpoint_service = StreamServerEndpointService(
@@ -647,6 +1174,12 @@ class ControlAMPService(Service):
         self.configuration_service.register(self._schedule_broadcast_update)
 
     def startService(self):
+        # Start from the configuration history persisted by the previous run
+        # so agents that reconnect after a restart can still be sent diffs.
+        self._configuration_generation_tracker.load_history(
+            self.configuration_service.get(),
+            self.configuration_service.configuration_history(),
+        )
         self.endpoint_service.startService()
 
     def stopService(self):
@@ -733,92 +1266,160 @@ class ControlAMPService(Service):
                 # Eliot wants those fields though.
                 action.add_success_fields(configuration=None, state=None)
 
+            # Set the configuration and the state to the latest versions. It
+            # is okay to call this even if the latest configuration is the
+            # same object.
+            self._configuration_generation_tracker.insert_latest(
+                configuration)
+            self._state_generation_tracker.insert_latest(state)
+            scopes = {self._node_scopes.get(connection)
+                      for connection in can_update}
+            scopes.discard(None)
+            for node_uuid in scopes:
+                configuration_view, state_view = node_view(
+                    configuration, state, node_uuid)
+                config_tracker, state_tracker = (
+                    self._node_view_trackers[node_uuid])
+                config_tracker.insert_latest(configuration_view)
+                state_tracker.insert_latest(state_view)
+
+            # Agents with the same generations using the same encoding are
+            # sent the same arguments, so they are only worked out and
+            # encoded once however many agents there are:
+            updates = {}
             for connection in can_update:
-                self._update_connection(connection, configuration, state)
+                node_uuid = self._node_scopes.get(connection)
+                generations = self._last_received_generation[connection]
+                if node_uuid is not None:
+                    config_tracker, state_tracker = (
+                        self._node_view_trackers[node_uuid])
+                    if generations == _ConfigAndStateGeneration(
+                            config_hash=config_tracker.get_latest_hash(),
+                            state_hash=state_tracker.get_latest_hash()):
+                        # Nothing relevant to the agent's node changed.
+                        continue
+                key = (generations, node_uuid,
+                       getattr(connection, "wire_encoding",
+                               WIRE_ENCODING_JSON))
+                updates.setdefault(key, []).append(connection)
+            for (generations, node_uuid, encoding), group in updates.items():
+                update = self._cluster_update(
+                    generations, encoding, *self._trackers(node_uuid))
+                for connection in group:
+                    self._update_connection(connection, update)
 
             for connection in elided_update:
                 AGENT_UPDATE_ELIDED(agent=connection).write()
+                self.metrics.increment(u"control.updates.elided")
 
             for connection in delayed_update:
                 self._delayed_update_connection(connection)
 
-    def _update_connection(self, connection, configuration, state):
+    def _trackers(self, node_uuid):
         """
-        Send the latest cluster configuration and state to ``connection``.
+        :param node_uuid: The ``UUID`` of the node whose view of the cluster
+            an agent is sent, or ``None`` if it is sent the whole cluster.
 
-        :param ControlAMP connection: The connection to use to send the
-            command.
+        :return: A ``tuple`` of the ``GenerationTracker`` s of the
+            configuration and of the state the agent is sent.
         """
+        if node_uuid is None:
+            return (self._configuration_generation_tracker,
+                    self._state_generation_tracker)
+        return self._node_view_trackers[node_uuid]
 
-        # Set the configuration and the state to the latest versions. It is
-        # okay to call this even if the latest configuration is the same
-        # object.
-        self._configuration_generation_tracker.insert_latest(configuration)
-        self._state_generation_tracker.insert_latest(state)
+    def _cluster_update(self, generations, encoding, config_gen_tracker,
+                        state_gen_tracker):
+        """
+        Work out the command that brings agents up to date with the latest
+        cluster configuration and state.
 
-        action = LOG_SEND_TO_AGENT(agent=connection)
-        with action.context():
+        :param _ConfigAndStateGeneration generations: The generations the
+            agents last received.
+        :param unicode encoding: The ``WIRE_ENCODINGS`` member the agents'
+            connections use.
+        :param GenerationTracker config_gen_tracker: The tracker of the
+            configuration the agents are sent.
+        :param GenerationTracker state_gen_tracker: The tracker of the state
+            the agents are sent.
 
-            # Attempt to compute a diff to send to the connection
-            last_received_generations = (
-                self._last_received_generation[connection]
-            )
+        :return _ClusterUpdate: The command to send them.
+        """
+        # Attempt to compute a diff to send to the agents
+        configuration_diff = config_gen_tracker.get_diff_from_hash_to_latest(
+            generations.config_hash
+        )
+        state_diff = state_gen_tracker.get_diff_from_hash_to_latest(
+            generations.state_hash
+        )
 
-            config_gen_tracker = self._configuration_generation_tracker
-            configuration_diff = (
-                config_gen_tracker.get_diff_from_hash_to_latest(
-                    last_received_generations.config_hash
-                )
-            )
+        configuration_diff = _diff_worth_sending(
+            configuration_diff, config_gen_tracker, encoding)
+        state_diff = _diff_worth_sending(
+            state_diff, state_gen_tracker, encoding)
 
-            state_gen_tracker = self._state_generation_tracker
-            state_diff = (
-                state_gen_tracker.get_diff_from_hash_to_latest(
-                    last_received_generations.state_hash
-                )
+        if configuration_diff is None and state_diff is not None:
+            configuration_diff = _replacement_diff(
+                generations.config_hash, config_gen_tracker,
+            )
+        elif state_diff is None and configuration_diff is not None:
+            state_diff = _replacement_diff(
+                generations.state_hash, state_gen_tracker,
             )
 
-            if configuration_diff is not None and state_diff is not None:
-                # If both diffs were successfully computed, send a command to
-                # send the diffs along with before and after hashes so the
-                # nodes can verify the application of the diffs.
-                d = DeferredContext(maybeDeferred(
-                    connection.callRemote,
-                    ClusterStatusDiffCommand,
+        if configuration_diff is not None and state_diff is not None:
+            # If both diffs were successfully computed, send a command to
+            # send the diffs along with before and after hashes so the
+            # nodes can verify the application of the diffs.
+            return _ClusterUpdate(
+                command=ClusterStatusDiffCommand,
+                arguments=dict(
                     configuration_diff=configuration_diff,
-                    start_configuration_generation=(
-                        last_received_generations.config_hash
-                    ),
+                    start_configuration_generation=generations.config_hash,
                     end_configuration_generation=(
                         config_gen_tracker.get_latest_hash()
                     ),
                     state_diff=state_diff,
-                    start_state_generation=(
-                        last_received_generations.state_hash
-                    ),
+                    start_state_generation=generations.state_hash,
                     end_state_generation=state_gen_tracker.get_latest_hash(),
-                    eliot_context=action
-                ))
-                d.addActionFinish()
-            else:
-                # Otherwise, just send the lastest configuration and state to
-                # the node.
-                configuration = config_gen_tracker.get_latest()
-                state = state_gen_tracker.get_latest()
-                # Use ``maybeDeferred`` so if an exception happens,
-                # it will be wrapped in a ``Failure`` - see FLOC-3221
-                d = DeferredContext(maybeDeferred(
-                    connection.callRemote,
-                    ClusterStatusCommand,
-                    configuration=configuration,
-                    configuration_generation=(
-                        config_gen_tracker.get_latest_hash()
-                    ),
-                    state=state,
-                    state_generation=state_gen_tracker.get_latest_hash(),
-                    eliot_context=action
-                ))
-                d.addActionFinish()
+                ),
+            )
+        # Otherwise, just send the lastest configuration and state to the
+        # node.
+        return _ClusterUpdate(
+            command=ClusterStatusCommand,
+            arguments=dict(
+                configuration=config_gen_tracker.get_latest(),
+                configuration_generation=config_gen_tracker.get_latest_hash(),
+                state=state_gen_tracker.get_latest(),
+                state_generation=state_gen_tracker.get_latest_hash(),
+            ),
+        )
+
+    def _update_connection(self, connection, update):
+        """
+        Send the latest cluster configuration and state to ``connection``.
+
+        :param ControlAMP connection: The connection to use to send the
+            command.
+        :param _ClusterUpdate update: The command to send.
+        """
+        if update.command is ClusterStatusDiffCommand:
+            self.metrics.increment(u"control.updates.diff")
+        else:
+            self.metrics.increment(u"control.updates.full")
+        sent = self._reactor.seconds()
+        action = LOG_SEND_TO_AGENT(agent=connection)
+        with action.context():
+            # Use ``maybeDeferred`` so if an exception happens,
+            # it will be wrapped in a ``Failure`` - see FLOC-3221
+            d = DeferredContext(maybeDeferred(
+                connection.callRemote,
+                update.command,
+                eliot_context=action,
+                **update.arguments
+            ))
+            d.addActionFinish()
             d.result.addErrback(lambda _: None)
 
         update = self._current_command[connection] = _UpdateState(
@@ -829,6 +1430,9 @@ class ControlAMPService(Service):
         def finished_update(response):
             del self._current_command[connection]
             if response:
+                self.metrics.record(
+                    u"control.updates.acknowledge_seconds",
+                    self._reactor.seconds() - sent)
                 config_gen = response['current_configuration_generation']
                 state_gen = response['current_state_generation']
                 self._last_received_generation[connection] = (
@@ -838,10 +1442,10 @@ class ControlAMPService(Service):
                     )
                 )
                 #  If the latest hash was not returned, schedule an update.
-                if (self._configuration_generation_tracker.get_latest_hash() !=
-                        config_gen or
-                        self._state_generation_tracker.get_latest_hash() !=
-                        state_gen):
+                config_tracker, state_tracker = self._trackers(
+                    self._node_scopes.get(connection))
+                if (config_tracker.get_latest_hash() != config_gen or
+                        state_tracker.get_latest_hash() != state_gen):
                     self._schedule_update([connection])
         update.response.addCallback(finished_update)
 
@@ -856,12 +1460,49 @@ class ControlAMPService(Service):
             related to this will be used and then updated.
         """
         AGENT_UPDATE_DELAYED(agent=connection).write()
+        self.metrics.increment(u"control.updates.delayed")
         update = self._current_command[connection]
         update.response.addCallback(
             lambda ignored: self._schedule_update([connection]),
         )
         self._current_command[connection] = update.set(next_scheduled=True)
 
+    def agent_generations(self, connection, configuration_generation,
+                          state_generation):
+        """
+        A connected agent has told us which generations of the configuration
+        and state it already has.
+
+        :param ControlAMP connection: The connection the agent is using.
+        :param GenerationHash configuration_generation: The generation of the
+            configuration the agent has.
+        :param GenerationHash state_generation: The generation of the state the
+            agent has.
+        """
+        if connection in self._connections:
+            self._last_received_generation[connection] = (
+                _ConfigAndStateGeneration(
+                    config_hash=configuration_generation,
+                    state_hash=state_generation,
+                )
+            )
+
+    def scope_to_node(self, connection, node_uuid):
+        """
+        A connected agent has asked to be sent only the view of the cluster
+        for its node.
+
+        :param ControlAMP connection: The connection the agent is using.
+        :param UUID node_uuid: The node the agent converges.
+        """
+        if connection in self._connections:
+            self._node_scopes[connection] = node_uuid
+            if node_uuid not in self._node_view_trackers:
+                self._node_view_trackers[node_uuid] = (
+                    GenerationTracker(NODE_VIEW_HISTORY_SIZE),
+                    GenerationTracker(NODE_VIEW_HISTORY_SIZE),
+                )
+
     def connected(self, connection):
         """
         A new connection has been made to the server.
@@ -883,6 +1524,10 @@ class ControlAMPService(Service):
             self._connections_pending_update.remove(connection)
         if connection in self._last_received_generation:
             del self._last_received_generation[connection]
+        node_uuid = self._node_scopes.pop(connection, None)
+        if (node_uuid is not None and
+                node_uuid not in self._node_scopes.values()):
+            del self._node_view_trackers[node_uuid]
 
     def _execute_update_connections(self):
         """
@@ -891,6 +1536,12 @@ class ControlAMPService(Service):
         connections_to_update = self._connections_pending_update
         self._connections_pending_update = set()
         self._current_pending_update_delayed_call = None
+        AGENT_UPDATES_BATCHED(
+            delay=self.batching_delay, coalesced=self._pending_requests,
+            connections=len(connections_to_update),
+        ).write(self.logger)
+        self.batches += 1
+        self._pending_requests = 0
         self._send_state_to_connections(connections_to_update)
 
     def _schedule_update(self, connections):
@@ -898,21 +1549,28 @@ class ControlAMPService(Service):
         Schedule a call to send_state_to_connections.
 
         This function adds a delay in the hopes that additional updates will be
-        scheduled and they can all be called at once in a batch.
+        scheduled and they can all be called at once in a batch.  The delay
+        grows with the recent rate of updates and the number of connected
+        agents, between the minimum and maximum batching delays.
 
         :param connections: An iterable of connections that will be passed to
             ``_send_state_to_connections``.
         """
         self._connections_pending_update.update(set(connections))
+        self._batching.request(self._reactor.seconds())
 
         # If there is no current pending update and there are connections
         # pending an update, we must schedule the delayed call to update
         # connections.
-        if (self._current_pending_update_delayed_call is None
-                and self._connections_pending_update):
+        if self._current_pending_update_delayed_call is not None:
+            self.coalesced += 1
+            self._pending_requests += 1
+        elif self._connections_pending_update:
+            self.batching_delay = self._batching.delay(len(self._connections))
+            self._pending_requests = 1
             self._current_pending_update_delayed_call = (
                 self._reactor.callLater(
-                    CONTROL_SERVICE_BATCHING_DELAY,
+                    self.batching_delay,
                     self._execute_update_connections
                 )
             )
@@ -924,8 +1582,8 @@ class ControlAMPService(Service):
         This is called when the state or configuration is updated, to trigger
         a broadcast of the current state and configuration to all nodes.
 
-        In general, it only schedules an update to be broadcast 1 second later
-        so that if we receive multiple updates within that second they are
+        In general, it only schedules an update to be broadcast a little later
+        so that if we receive multiple updates in the meantime they are
         coalesced down to a single update.
         """
         self._schedule_update(self._connections)
@@ -975,31 +1633,56 @@ class IConvergenceAgent(Interface):
         """
 
 
+class ReceivedClusterStatus(object):
+    """
+    The cluster configuration and state a convergence agent most recently
+    received from the control service.
+
+    This outlives any single connection so that an agent that reconnects can
+    tell the control service what it already has, and be sent diffs rather
+    than the full configuration and state.
+
+    :ivar configuration: The current configuration of the cluster.
+    :ivar GenerationHash configuration_generation: The current generation hash
+        of the configuration.
+    :ivar state: The current state of the cluster.
+    :ivar GenerationHash state_generation: The current generation hash of the
+        state.
+    """
+    def __init__(self):
+        self.configuration = None
+        self.configuration_generation = None
+        self.state = None
+        self.state_generation = None
+
+
 @with_cmp(["agent"])
 class _AgentLocator(CommandLocator):
     """
     Command locator for convergence agent.
 
-    :ivar _current_configuration: The current configuration of the cluster.
-    :ivar GenerationHash _current_configuration_generation: The current
-        generation hash of the configuration.
-    :ivar _current_state: The current state of the cluster.
-    :ivar GenerationHash _current_state_generation: The current generation hash
-        of the state.
+    :ivar ReceivedClusterStatus _received: The configuration and state
+        received from the control service.
     """
-    def __init__(self, agent, timeout):
+    def __init__(self, agent, timeout, received=None, metrics=None):
         """
         :param IConvergenceAgent agent: Convergence agent to notify of changes.
         :param Timeout timeout: A ``Timeout`` object to reset when a message
             is received.
+        :param ReceivedClusterStatus received: The configuration and state
+            received over earlier connections, or ``None`` if there were none.
+        :param MetricsRegistry metrics: The registry to record the metrics of
+            commands received in, or ``None`` to use ``AMP_METRICS``.
         """
         CommandLocator.__init__(self)
+        if metrics is None:
+            metrics = AMP_METRICS
+        self.metrics = metrics
         self.agent = agent
         self._timeout = timeout
-        self._current_configuration = None
-        self._current_configuration_generation = None
-        self._current_state = None
-        self._current_state_generation = None
+        if received is None:
+            received = ReceivedClusterStatus()
+        self._received = received
 
     def locateResponder(self, name):
         """
@@ -1038,8 +1721,8 @@ class _AgentLocator(CommandLocator):
         if candidate_hash != verify_hash:
             raise ValueError('Bad hash value %s is not %s' % (candidate_hash,
                                                               verify_hash))
-        self._current_configuration = configuration
-        self._current_configuration_generation = candidate_hash
+        self._received.configuration = configuration
+        self._received.configuration_generation = candidate_hash
 
     def _set_state(self, state, verify_hash):
         """
@@ -1054,8 +1737,8 @@ class _AgentLocator(CommandLocator):
         if candidate_hash != verify_hash:
             raise ValueError('Bad hash value %s is not %s' % (candidate_hash,
                                                               verify_hash))
-        self._current_state = state
-        self._current_state_generation = candidate_hash
+        self._received.state = state
+        self._received.state_generation = candidate_hash
 
     def _current_generations_response(self):
         """
@@ -1068,10 +1751,10 @@ class _AgentLocator(CommandLocator):
         """
         return {
             'current_configuration_generation': (
-                self._current_configuration_generation
+                self._received.configuration_generation
             ),
             'current_state_generation': (
-                self._current_state_generation
+                self._received.state_generation
             ),
         }
 
@@ -1081,8 +1764,8 @@ class _AgentLocator(CommandLocator):
         configuration and state.
         """
         self.agent.cluster_updated(
-            self._current_configuration,
-            self._current_state
+            self._received.configuration,
+            self._received.state
         )
 
     def _update_cluster(self, configuration, configuration_generation,
@@ -1153,17 +1836,17 @@ class _AgentLocator(CommandLocator):
         """
         with eliot_context:
             if (start_configuration_generation !=
-                    self._current_configuration_generation):
+                    self._received.configuration_generation):
                 return self._current_generations_response()
             if (start_state_generation !=
-                    self._current_state_generation):
+                    self._received.state_generation):
                 return self._current_generations_response()
 
             new_configuration = configuration_diff.apply(
-                self._current_configuration
+                self._received.configuration
             )
             new_state = state_diff.apply(
-                self._current_state
+                self._received.state
             )
             self._update_cluster(
                 new_configuration,
@@ -1174,7 +1857,7 @@ class _AgentLocator(CommandLocator):
             return self._current_generations_response()
 
 
-class AgentAMP(AMP):
+class AgentAMP(_InstrumentedAMP):
     """
     AMP protocol for convergence agent side of the protocol.
 
@@ -1182,26 +1865,73 @@ class AgentAMP(AMP):
 
     :ivar Pinger _pinger: Helper which periodically pings this protocol's peer
         to verify it's still alive.
+    :ivar ReceivedClusterStatus _received: The configuration and state
+        received from the control service.
+    :ivar unicode wire_encoding: The ``WIRE_ENCODINGS`` member used to encode
+        objects sent to the control service.
+    :ivar wire_compression: The ``WIRE_COMPRESSIONS`` member used to compress
+        ``Big`` arguments sent to the control service, or ``None``.
+    :ivar bool node_state_diffs: Whether the control service accepts
+        ``NodeStateDiffCommand``.
     """
-    def __init__(self, reactor, agent):
+    wire_encoding = WIRE_ENCODING_JSON
+    wire_compression = None
+    node_state_diffs = False
+
+    def __init__(self, reactor, agent, received=None, metrics=None):
         """
         :param IReactorTime reactor: A reactor to use to schedule periodic ping
             operations.root@52.28.55.192
         :param IConvergenceAgent agent: Convergence agent to notify of changes.
-        """
+        :param ReceivedClusterStatus received: The configuration and state
+            received over earlier connections, or ``None`` if there were none.
+        :param MetricsRegistry metrics: The registry to record metrics of the
+            connection in, or ``None`` to use ``AMP_METRICS``.
+        """
+        if received is None:
+            received = ReceivedClusterStatus()
+        self._received = received
         self._ping_timeout = timeout_for_protocol(reactor, self)
-        locator = _AgentLocator(agent, self._ping_timeout)
-        AMP.__init__(self, locator=locator)
+        locator = _AgentLocator(
+            agent, self._ping_timeout, received, metrics)
+        _InstrumentedAMP.__init__(self, reactor, locator.metrics, locator)
         self.agent = agent
         self._pinger = Pinger(reactor)
 
     def connectionMade(self):
         AMP.connectionMade(self)
+        self._negotiate_encoding()
+        if (self._received.configuration_generation is not None and
+                self._received.state_generation is not None):
+            # Control services that don't know this command will just send
+            # the full configuration and state, as they always have.
+            self.callRemote(
+                ClusterGenerationsCommand,
+                current_configuration_generation=(
+                    self._received.configuration_generation),
+                current_state_generation=self._received.state_generation,
+            ).addErrback(lambda _: None)
         self.agent.connected(self)
         self._pinger.start(self, PING_INTERVAL)
 
+    def _negotiate_encoding(self):
+        """
+        Agree on an encoding and a compression with the control service.
+        Until it responds, and forever if it predates encoding negotiation,
+        JSON is used without compression.
+        """
+        def negotiated(response):
+            self.wire_encoding = choose_wire_encoding([response["encoding"]])
+            self.wire_compression = choose_wire_compression(
+                [response["compression"]])
+            self.node_state_diffs = bool(response["node_state_diffs"])
+        self.callRemote(
+            VersionCommand, encodings=list(WIRE_ENCODINGS),
+            compressions=list(WIRE_COMPRESSIONS),
+        ).addCallbacks(negotiated, lambda _: None)
+
     def connectionLost(self, reason):
-        AMP.connectionLost(self, reason)
+        _InstrumentedAMP.connectionLost(self, reason)
         self.agent.disconnected()
         self._pinger.stop()
         self._ping_timeout.cancel()
@@ -0,0 +1,290 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_sqlite -*-
+
+"""
+Storage of the cluster configuration in an embedded SQLite database.
+"""
+
+import sqlite3
+from collections import defaultdict
+from uuid import UUID
+
+from zope.interface import implementer
+
+from ._model import Deployment, Node, Leases, PersistentState
+from ._persistence import (
+    IConfigurationStore, ConfigurationMigrationError, wire_encode,
+    wire_decode, _CONFIG_VERSION, WIRE_ENCODING_JSON,
+)
+
+
+_SCHEMA = [
+    u"CREATE TABLE IF NOT EXISTS metadata ("
+    u"name TEXT PRIMARY KEY, value BLOB NOT NULL)",
+    u"CREATE TABLE IF NOT EXISTS nodes (uuid TEXT PRIMARY KEY)",
+    u"CREATE TABLE IF NOT EXISTS manifestations ("
+    u"node_uuid TEXT NOT NULL, dataset_id TEXT NOT NULL, "
+    u"manifestation BLOB NOT NULL, PRIMARY KEY (node_uuid, dataset_id))",
+    u"CREATE TABLE IF NOT EXISTS applications ("
+    u"node_uuid TEXT NOT NULL, name TEXT NOT NULL, "
+    u"application BLOB NOT NULL, PRIMARY KEY (node_uuid, name))",
+    u"CREATE TABLE IF NOT EXISTS leases ("
+    u"dataset_id TEXT PRIMARY KEY, lease BLOB NOT NULL)",
+    u"CREATE TABLE IF NOT EXISTS history ("
+    u"sequence INTEGER PRIMARY KEY, generation TEXT NOT NULL, "
+    u"diff BLOB NOT NULL)",
+]
+
+# The row of the ``metadata`` table holding the configuration version:
+_VERSION = u"version"
+# The row of the ``metadata`` table holding the ``PersistentState``:
+_PERSISTENT_STATE = u"persistent_state"
+
+
+def _changes(previous, latest):
+    """
+    Compare two versions of a mapping.
+
+    Values shared between the two are recognized by identity, so comparing
+    versions of a mapping that differ by one item is cheap.
+
+    :param previous: The earlier ``PMap``.
+    :param latest: The later ``PMap``.
+
+    :return: A tuple of a ``list`` of the ``(key, value)`` items of
+        ``latest`` which are not in ``previous``, and a ``list`` of the keys
+        of ``previous`` which are not in ``latest``.
+    """
+    if previous is latest:
+        return [], []
+    changed = []
+    for key, value in latest.iteritems():
+        old = previous.get(key)
+        if old is not value and old != value:
+            changed.append((key, value))
+    removed = [key for key in previous if key not in latest]
+    return changed, removed
+
+
+@implementer(IConfigurationStore)
+class SQLiteConfigurationStore(object):
+    """
+    Store the configuration in an SQLite database.
+
+    Each node, manifestation, application and lease is a separate row, so a
+    save only writes the rows for the parts of the configuration that
+    changed, in a single transaction.  Values are stored in their
+    ``wire_encode`` encoding.
+
+    :ivar _connection: The ``sqlite3.Connection`` to the database, or
+        ``None`` if it is not open.
+    :ivar Deployment _deployment: The configuration most recently loaded or
+        saved.
+    """
+    def __init__(self, path, encoding=WIRE_ENCODING_JSON, migrate_from=None):
+        """
+        :param FilePath path: The database file.
+        :param unicode encoding: The ``WIRE_ENCODINGS`` member to store values
+            in.  Values in any of them can be loaded.
+        :param IConfigurationStore migrate_from: A store whose configuration
+            is copied into the database when the database is created, or
+            ``None``.
+        """
+        self._path = path
+        self._encoding = encoding
+        self._migrate_from = migrate_from
+        self._connection = None
+        self._deployment = None
+
+    def _encode(self, value):
+        """
+        :return: ``value`` encoded for storing in a ``BLOB`` column.
+        """
+        return sqlite3.Binary(wire_encode(value, self._encoding))
+
+    def _open(self):
+        """
+        Connect to the database, creating its tables if necessary.
+
+        :return bool: Whether the database is newly created, or was never
+            populated.
+        """
+        parent = self._path.parent()
+        if not parent.exists():
+            parent.makedirs()
+        # The service calls the store from its writer thread, one call at a
+        # time, having loaded it in the reactor thread:
+        self._connection = sqlite3.connect(
+            self._path.path, check_same_thread=False)
+        self._connection.execute(u"PRAGMA journal_mode = WAL")
+        self._connection.execute(u"PRAGMA synchronous = FULL")
+        with self._connection:
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+        row = self._connection.execute(
+            u"SELECT value FROM metadata WHERE name = ?", (_VERSION,)
+        ).fetchone()
+        if row is None:
+            # The version is only recorded by ``load`` once the database is
+            # populated.
+            return True
+        if row[0] != _CONFIG_VERSION:
+            self.close()
+            raise ConfigurationMigrationError(
+                "Configuration database {} has version {} but {} is "
+                "required".format(self._path.path, row[0], _CONFIG_VERSION))
+        return False
+
+    def load(self):
+        """
+        Rows are decoded one at a time as they are read, rather than the
+        whole configuration being parsed as one document.
+        """
+        self.close()
+        if self._open():
+            self._deployment = Deployment()
+            deployment, history = Deployment(), []
+            if self._migrate_from is not None:
+                deployment, history = self._migrate_from.load()
+                self._migrate_from.close()
+            # Recording the version in the same transaction as the migrated
+            # rows means an interrupted migration is retried by the next
+            # load, rather than leaving a database that looks populated:
+            self._write(deployment, history, len(history), created=True)
+            return self._deployment, self._load_history()
+
+        cursor = self._connection.cursor()
+        manifestations = defaultdict(dict)
+        for node_uuid, dataset_id, value in cursor.execute(
+                u"SELECT node_uuid, dataset_id, manifestation "
+                u"FROM manifestations"):
+            manifestations[node_uuid][dataset_id] = wire_decode(bytes(value))
+        applications = defaultdict(dict)
+        for node_uuid, name, value in cursor.execute(
+                u"SELECT node_uuid, name, application FROM applications"):
+            applications[node_uuid][name] = wire_decode(bytes(value))
+        nodes = {}
+        for (node_uuid,) in cursor.execute(u"SELECT uuid FROM nodes"):
+            uuid = UUID(node_uuid)
+            nodes[uuid] = Node(
+                uuid=uuid,
+                manifestations=manifestations.pop(node_uuid, {}),
+                applications=applications.pop(node_uuid, {}),
+            )
+        leases = Leases({
+            UUID(dataset_id): wire_decode(bytes(value))
+            for dataset_id, value in cursor.execute(
+                u"SELECT dataset_id, lease FROM leases")
+        })
+        row = cursor.execute(
+            u"SELECT value FROM metadata WHERE name = ?", (_PERSISTENT_STATE,)
+        ).fetchone()
+        persistent_state = (
+            PersistentState() if row is None else wire_decode(bytes(row[0])))
+        self._deployment = Deployment(
+            nodes=nodes, leases=leases, persistent_state=persistent_state)
+        return self._deployment, self._load_history()
+
+    def _load_history(self):
+        """
+        :return: ``list`` of the ``(bytes, Diff)`` pairs in the ``history``
+            table, oldest first.
+        """
+        return [
+            (generation, wire_decode(bytes(diff)))
+            for generation, diff in self._connection.execute(
+                u"SELECT generation, diff FROM history ORDER BY sequence")
+        ]
+
+    def _write_rows(self, table, columns, scope, previous, latest):
+        """
+        Write the rows for the items of a mapping that changed.
+
+        :param unicode table: The table the rows are in.
+        :param columns: The names of the table's columns: those identifying
+            the mapping, then the key column and the value column.
+        :param tuple scope: The values of the columns identifying the mapping.
+        :param previous: The mapping as it is currently stored.
+        :param latest: The mapping as it should be stored.
+        """
+        changed, removed = _changes(previous, latest)
+        if removed:
+            self._connection.executemany(
+                u"DELETE FROM {} WHERE {}".format(table, u" AND ".join(
+                    u"{} = ?".format(column) for column in columns[:-1])),
+                [scope + (unicode(key),) for key in removed])
+        if changed:
+            self._connection.executemany(
+                u"INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+                    table, u", ".join(columns),
+                    u", ".join(u"?" for _ in columns)),
+                [scope + (unicode(key), self._encode(value))
+                 for key, value in changed])
+
+    def _write(self, deployment, changes, history_size, created=False):
+        """
+        Write the differences between the stored configuration and a new one
+        in a single transaction.
+
+        :param Deployment deployment: The new configuration.
+        :param changes: ``(bytes, Diff)`` pairs to add to the history, oldest
+            first.
+        :param int history_size: The number of most recent history entries
+            to keep.
+        :param bool created: Whether this is the first write to a new
+            database, which also records the configuration version.
+        """
+        previous = self._deployment
+        with self._connection:
+            if created:
+                self._connection.execute(
+                    u"INSERT INTO metadata (name, value) VALUES (?, ?)",
+                    (_VERSION, _CONFIG_VERSION))
+            changed, removed = _changes(previous.nodes, deployment.nodes)
+            for uuid in removed:
+                for table, column in [(u"nodes", u"uuid"),
+                                      (u"manifestations", u"node_uuid"),
+                                      (u"applications", u"node_uuid")]:
+                    self._connection.execute(
+                        u"DELETE FROM {} WHERE {} = ?".format(table, column),
+                        (unicode(uuid),))
+            empty = Node(uuid=UUID(int=0))
+            for uuid, node in changed:
+                scope = (unicode(uuid),)
+                old = previous.nodes.get(uuid, empty)
+                self._connection.execute(
+                    u"INSERT OR IGNORE INTO nodes (uuid) VALUES (?)", scope)
+                self._write_rows(
+                    u"manifestations",
+                    (u"node_uuid", u"dataset_id", u"manifestation"), scope,
+                    old.manifestations, node.manifestations)
+                self._write_rows(
+                    u"applications",
+                    (u"node_uuid", u"name", u"application"), scope,
+                    old.applications, node.applications)
+            self._write_rows(
+                u"leases", (u"dataset_id", u"lease"), (),
+                previous.leases, deployment.leases)
+            if previous.persistent_state != deployment.persistent_state:
+                self._connection.execute(
+                    u"INSERT OR REPLACE INTO metadata (name, value) "
+                    u"VALUES (?, ?)",
+                    (_PERSISTENT_STATE,
+                     self._encode(deployment.persistent_state)))
+            self._connection.executemany(
+                u"INSERT INTO history (generation, diff) VALUES (?, ?)",
+                [(generation, self._encode(diff))
+                 for generation, diff in changes])
+            self._connection.execute(
+                u"DELETE FROM history WHERE sequence NOT IN ("
+                u"SELECT sequence FROM history ORDER BY sequence DESC "
+                u"LIMIT ?)", (history_size,))
+        self._deployment = deployment
+
+    def save(self, deployment, change, history):
+        self._write(deployment, [change], len(history))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
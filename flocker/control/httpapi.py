@@ -4,6 +4,7 @@ A HTTP REST API for controlling the Dataset Manager.
 """
 
 from uuid import uuid4, UUID
+from base64 import b16encode
 from datetime import datetime
 from functools import wraps
 from json import dumps
@@ -19,12 +20,13 @@ from twisted.protocols.tls import TLSMemoryBIOFactory
 from twisted.python.filepath import FilePath
 from twisted.web.http import (
     CONFLICT, CREATED, NOT_FOUND, OK, NOT_ALLOWED as METHOD_NOT_ALLOWED,
-    BAD_REQUEST, PRECONDITION_FAILED,
+    BAD_REQUEST, PRECONDITION_FAILED, NOT_MODIFIED,
 )
 from twisted.web.server import Site
 from twisted.web.resource import Resource
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred, CancelledError
 
 from klein import Klein
 
@@ -34,7 +36,7 @@ from repoze.lru import lru_cache
 
 from ..restapi import (
     EndpointResponse, structured, user_documentation, make_bad_request,
-    private_api
+    private_api, ResponseCache, BadRequest,
 )
 from . import (
     Dataset, Manifestation, Application, DockerImage, Port,
@@ -45,8 +47,9 @@ from ._config import (
     model_from_configuration, FigConfiguration, FlockerConfiguration,
     ConfigurationError
 )
-from ._persistence import update_leases
+from ._persistence import update_leases, generation_hash
 from ._model import LeaseError
+from ._metrics import MetricsRegistry
 
 from .. import __version__, REST_API_PORT as _port
 REST_API_PORT = _port  # Some modules expect this constant to be here
@@ -92,12 +95,24 @@ LEASE_NOT_FOUND = make_bad_request(
     code=NOT_FOUND, description=u"Lease not found.")
 LEASE_HELD = make_bad_request(
     code=CONFLICT, description=u"Lease already held.")
+NODE_NOT_FOUND = make_bad_request(
+    code=NOT_FOUND, description=u"Node not found.")
 NODE_BY_ERA_NOT_FOUND = make_bad_request(
     code=NOT_FOUND, description=u"No node found with given era.")
 
 _UNDEFINED_MAXIMUM_SIZE = object()
 
+# The hits and misses of the caches of serialized responses:
+REST_API_METRICS = MetricsRegistry()
+
 IF_MATCHES_HEADER = b"X-If-Configuration-Matches"
+ENTITY_TAG_HEADER = b"ETag"
+IF_NONE_MATCH_HEADER = b"If-None-Match"
+WAIT_FOR_CHANGE_ARGUMENT = b"wait_for_change_since"
+
+# Seconds a request waiting for a change is held open before the unchanged
+# response is sent:
+WAIT_FOR_CHANGE_TIMEOUT = 30
 
 
 def get_configuration_tag(api):
@@ -136,6 +151,185 @@ def _if_configuration_matches(original):
     return render_if_matches
 
 
+def get_state_tag(api):
+    """
+    Return tag value for the cluster state.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: Tag as ``bytes``.
+    """
+    return b16encode(
+        generation_hash(api.cluster_state_service.as_deployment())).lower()
+
+
+def _get_leases_tag(api):
+    """
+    Return tag value for the leases, if their serialization doesn't depend
+    on the time.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: Tag as ``bytes``, or ``None`` if any lease expires, since the
+        time left until it expires changes with every request.
+    """
+    for lease in api.persistence_service.get().leases.values():
+        if lease.expiration is not None:
+            return None
+    return get_configuration_tag(api)
+
+
+def _response_cache(endpoint, generation):
+    """
+    :param unicode endpoint: The name of an endpoint.
+    :param generation: Callable returning the tag of what the endpoint
+        returns, such as ``get_configuration_tag``.
+
+    :return ResponseCache: A cache of the endpoint's responses recording its
+        hits and misses in ``REST_API_METRICS``.
+    """
+    return ResponseCache(
+        generation, name=u"rest.{}".format(endpoint),
+        metrics=REST_API_METRICS)
+
+
+def _tag_matches(if_none_match, entity_tag):
+    """
+    :param list if_none_match: The values of the ``If-None-Match`` headers of
+        a request.
+    :param bytes entity_tag: The quoted entity tag of the current
+        representation.
+
+    :return bool: Whether any of the tags in the headers match it, using the
+        weak comparison ``If-None-Match`` calls for.
+    """
+    for value in if_none_match:
+        for tag in value.split(b","):
+            tag = tag.strip()
+            if tag.startswith(b"W/"):
+                tag = tag[2:]
+            if tag in (b"*", entity_tag):
+                return True
+    return False
+
+
+def _if_none_match(get_tag):
+    """
+    Decorator that includes an ``ETag`` header derived from ``get_tag`` in
+    responses, and responds ``NOT_MODIFIED`` without calling the original
+    function to requests whose ``If-None-Match`` header matches it.
+
+    :param get_tag: Function taking the ``ConfigurationAPIUserV1`` and
+        returning the ``bytes`` tag of what the endpoint returns, such as
+        ``get_configuration_tag``.
+    :return: Decorator for a function.
+    """
+    def decorator(original):
+        @wraps(original)
+        def render_if_none_match(self, request, **route_arguments):
+            entity_tag = b'"%s"' % (get_tag(self),)
+            request.responseHeaders.setRawHeaders(
+                ENTITY_TAG_HEADER, [entity_tag])
+            if _tag_matches(
+                    request.requestHeaders.getRawHeaders(
+                        IF_NONE_MATCH_HEADER, []), entity_tag):
+                request.setResponseCode(NOT_MODIFIED)
+                return b""
+            return original(self, request, **route_arguments)
+        return render_if_none_match
+    return decorator
+
+
+class _ChangeWatchers(object):
+    """
+    Functions to call when something the API returns may have changed.
+
+    :ivar set _watchers: The functions to call, with no arguments.
+    """
+    def __init__(self):
+        self._watchers = set()
+
+    def add(self, watcher):
+        self._watchers.add(watcher)
+
+    def discard(self, watcher):
+        self._watchers.discard(watcher)
+
+    def changed(self):
+        """
+        Call all the watchers.
+        """
+        for watcher in list(self._watchers):
+            watcher()
+
+
+def _wait_for_change(clock, watchers, get_tag, since, timeout):
+    """
+    Wait until a tag changes.
+
+    :param IReactorTime clock: The clock to use for the timeout.
+    :param _ChangeWatchers watchers: The watchers notified when the tag may
+        have changed.
+    :param get_tag: No-argument callable returning the current tag.
+    :param bytes since: The tag to wait for a change from.
+    :param float timeout: Seconds to wait for at most.
+
+    :return: ``Deferred`` that fires with ``None`` when ``get_tag`` returns
+        something other than ``since`` or ``timeout`` has passed.  Cancelling
+        it stops the wait.
+    """
+    def stop():
+        watchers.discard(check)
+        if timer.active():
+            timer.cancel()
+
+    def finish():
+        stop()
+        waiting.callback(None)
+
+    def check():
+        if get_tag() != since:
+            finish()
+
+    waiting = Deferred(lambda _: stop())
+    timer = clock.callLater(timeout, finish)
+    watchers.add(check)
+    return waiting
+
+
+def _when_changed_since(get_tag, get_watchers):
+    """
+    Decorator that holds requests with a ``wait_for_change_since`` query
+    argument open until the tag from ``get_tag`` differs from it, or
+    ``WAIT_FOR_CHANGE_TIMEOUT`` seconds pass, before calling the original
+    function.
+
+    :param get_tag: Function taking the ``ConfigurationAPIUserV1`` and
+        returning the ``bytes`` tag of what the endpoint returns, such as
+        ``get_configuration_tag``.
+    :param get_watchers: Function taking the ``ConfigurationAPIUserV1`` and
+        returning the ``_ChangeWatchers`` notified when the tag may change.
+    :return: Decorator for a function.
+    """
+    def decorator(original):
+        @wraps(original)
+        def render_when_changed(self, request, **route_arguments):
+            since = request.args.get(WAIT_FOR_CHANGE_ARGUMENT)
+            if since is not None:
+                # The tag may be given quoted, as in the ``ETag`` header:
+                since = since[0].strip(b'"')
+            if since is None or get_tag(self) != since:
+                return original(self, request, **route_arguments)
+            # Klein cancels this if the client disconnects while waiting:
+            waiting = _wait_for_change(
+                self.clock, get_watchers(self), lambda: get_tag(self),
+                since, WAIT_FOR_CHANGE_TIMEOUT)
+            waiting.addCallbacks(
+                lambda _: original(self, request, **route_arguments),
+                lambda failure: failure.trap(CancelledError))
+            return waiting
+        return render_when_changed
+    return decorator
+
+
 @lru_cache(1)
 def _extract_containers_state(deployment_state):
     """
@@ -188,6 +382,10 @@ class ConfigurationAPIUserV1(object):
         self.persistence_service = persistence_service
         self.cluster_state_service = cluster_state_service
         self.clock = clock
+        self.configuration_watchers = _ChangeWatchers()
+        self.state_watchers = _ChangeWatchers()
+        persistence_service.register(self.configuration_watchers.changed)
+        cluster_state_service.register(self.state_watchers.changed)
 
     @app.route("/version", methods=['GET'])
     @user_documentation(
@@ -220,6 +418,9 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get configured datasets"],
         section=u"dataset",
     )
+    @_when_changed_since(
+        get_configuration_tag, lambda api: api.configuration_watchers)
+    @_if_none_match(get_configuration_tag)
     @structured(
         inputSchema={},
         outputSchema={
@@ -227,6 +428,8 @@ class ConfigurationAPIUserV1(object):
             '/v1/endpoints.json#/definitions/configuration_datasets_list',
         },
         schema_store=SCHEMAS,
+        cache=_response_cache(
+            u"get_dataset_configuration", get_configuration_tag),
     )
     def get_dataset_configuration(self):
         """
@@ -298,43 +501,12 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        if dataset_id is None:
-            dataset_id = unicode(uuid4())
-        dataset_id = dataset_id.lower()
-
-        if metadata is None:
-            metadata = {}
-
-        primary = UUID(hex=primary)
-
-        # Use persistence_service to get a Deployment for the cluster
-        # configuration.
-        deployment = self.persistence_service.get()
-        for node in deployment.nodes.itervalues():
-            for manifestation in node.manifestations.values():
-                if manifestation.dataset.dataset_id == dataset_id:
-                    raise DATASET_ID_COLLISION
-
-        # XXX Check cluster state to determine if the given primary node
-        # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
-        # See FLOC-1278
-
-        dataset = Dataset(
-            dataset_id=dataset_id,
-            maximum_size=maximum_size,
-            metadata=pmap(metadata)
-        )
-        manifestation = Manifestation(dataset=dataset, primary=True)
-
-        primary_node = deployment.get_node(primary)
-
-        new_node_config = primary_node.transform(
-            ("manifestations", manifestation.dataset_id), manifestation)
-        new_deployment = deployment.update_node(new_node_config)
+        new_deployment, result = _create_dataset(
+            self.persistence_service.get(), primary, dataset_id,
+            maximum_size, metadata)
         saving = self.persistence_service.save(new_deployment)
 
         def saved(ignored):
-            result = api_dataset_from_dataset_and_node(dataset, primary)
             return EndpointResponse(CREATED, result)
         saving.addCallback(saved)
         return saving
@@ -374,24 +546,11 @@ class ConfigurationAPIUserV1(object):
             as deleted in the cluster configuration or giving error
             information if this is not possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # XXX this doesn't handle replicas
-        # https://clusterhq.atlassian.net/browse/FLOC-1240
-        _, origin_node = _find_manifestation_and_node(
-            deployment, dataset_id)
-
-        new_node = origin_node.transform(
-            ("manifestations", dataset_id, "dataset", "deleted"), True)
-        deployment = deployment.update_node(new_node)
-
+        deployment, result = _delete_dataset(
+            self.persistence_service.get(), dataset_id)
         saving = self.persistence_service.save(deployment)
 
         def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                new_node.manifestations[dataset_id].dataset, new_node.uuid,
-            )
             return EndpointResponse(OK, result)
         saving.addCallback(saved)
         return saving
@@ -441,39 +600,119 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
+        deployment, result = _move_dataset(
+            self.persistence_service.get(), dataset_id, primary)
+        saving = self.persistence_service.save(deployment)
 
-        # Raises DATASET_NOT_FOUND if the ``dataset_id`` is not found.
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
+        # Return an API response dictionary containing the dataset with updated
+        # primary address.
+        def saved(ignored):
+            return EndpointResponse(OK, result)
+        saving.addCallback(saved)
+        return saving
 
-        if primary_manifestation.dataset.deleted:
-            raise DATASET_DELETED
+    @app.route("/configuration/datasets/_bulk", methods=['POST'])
+    @user_documentation(
+        u"""
+        Apply a list of operations to datasets, saving the resulting
+        configuration once.  Each operation is one of:
 
-        if primary is not None:
-            deployment = _update_dataset_primary(
-                deployment, dataset_id, UUID(hex=primary)
-            )
+        * ``create``, taking the same parameters as creating a single
+          dataset.
+        * ``move``, taking a ``dataset_id`` and a new ``primary``.
+        * ``resize``, taking a ``dataset_id`` and a new ``maximum_size``.
+        * ``delete``, taking a ``dataset_id``.
 
-        saving = self.persistence_service.save(deployment)
+        Operations are applied in order.  The response has a result for each
+        operation, either the resulting ``dataset`` or the ``error`` that
+        would have been returned had the operation been requested on its
+        own.  Operations that fail do not prevent the others from being
+        applied.
 
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
+        Supports ``X-If-Configuration-Matches`` header in the request to
+        ensure the operations only happen if the configuration hasn't
+        changed.
+        """,
+        header=u"Update many datasets",
+        examples=[
+            u"bulk update datasets",
+        ],
+        section=u"dataset",
+    )
+    @_if_configuration_matches
+    @structured(
+        inputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_bulk'},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/'
+            'configuration_datasets_bulk_results'},
+        schema_store=SCHEMAS,
+    )
+    def bulk_update_datasets(self, operations):
+        """
+        Apply several operations to datasets in the cluster configuration.
+
+        :param list operations: ``dict`` s each with an ``operation`` naming
+            one of ``_DATASET_OPERATIONS`` and the parameters it takes.
+
+        :return: A ``dict`` with a ``results`` list giving, for each
+            operation, either a ``dataset`` describing the resulting dataset
+            or an ``error`` describing why the operation was not possible.
+        """
+        deployment = self.persistence_service.get()
+        results = []
+        for operation in operations:
+            arguments = dict(operation)
+            apply_operation = _DATASET_OPERATIONS[arguments.pop(u"operation")]
+            try:
+                deployment, dataset = apply_operation(deployment, **arguments)
+            except BadRequest as e:
+                error = dict(e.result, code=e.code)
+                results.append({u"error": error})
+            else:
+                results.append({u"dataset": dataset})
+        saving = self.persistence_service.save(deployment)
 
-        # Return an API response dictionary containing the dataset with updated
-        # primary address.
         def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                primary_manifestation.dataset,
-                current_node.uuid,
-            )
-            return EndpointResponse(OK, result)
+            return EndpointResponse(OK, {u"results": results})
         saving.addCallback(saved)
         return saving
 
+    @app.route("/configuration/datasets/<dataset_id>", methods=['GET'])
+    @user_documentation(
+        u"""
+        The dataset is looked up directly, so this is cheaper than listing
+        all datasets when only one is of interest.  Deleted datasets are
+        included, with ``deleted`` set to true.
+        """,
+        header=u"Get a dataset's configuration",
+        examples=[
+            u"get configured dataset",
+            u"get configured dataset with unknown dataset id",
+        ],
+        section=u"dataset",
+    )
+    @structured(
+        inputSchema={},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets'},
+        schema_store=SCHEMAS,
+    )
+    def get_dataset(self, dataset_id):
+        """
+        Get the configuration of a dataset.
+
+        :param unicode dataset_id: The unique identifier of the dataset.
+
+        :return: A ``dict`` describing the dataset.
+        """
+        _, result = _updated_dataset(
+            self.persistence_service.get(), dataset_id)
+        return result
+
     @app.route("/state/datasets", methods=['GET'])
     @user_documentation(
         u"""
@@ -485,12 +724,16 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get state datasets"],
         section=u"dataset",
     )
+    @_when_changed_since(
+        get_state_tag, lambda api: api.state_watchers)
+    @_if_none_match(get_state_tag)
     @structured(
         inputSchema={},
         outputSchema={
             '$ref': '/v1/endpoints.json#/definitions/state_datasets_array'
             },
-        schema_store=SCHEMAS
+        schema_store=SCHEMAS,
+        cache=_response_cache(u"state_datasets", get_state_tag),
     )
     def state_datasets(self):
         """
@@ -505,27 +748,72 @@ class ConfigurationAPIUserV1(object):
         # includes metadata and deleted flags which should not be part of the
         # dataset state response.
         # Refactor. See FLOC-2207.
-        response = []
         deployment_state = self.cluster_state_service.as_deployment()
-        get_manifestation_path = self.cluster_state_service.manifestation_path
+        return [
+            self._state_dataset_response(dataset, node)
+            for dataset, node in deployment_state.all_datasets()
+        ]
 
-        for dataset, node in deployment_state.all_datasets():
-            response_dataset = dict(
-                dataset_id=dataset.dataset_id,
-            )
+    def _state_dataset_response(self, dataset, node):
+        """
+        :param Dataset dataset: A dataset in the cluster state.
+        :param NodeState node: The node with its primary manifestation, or
+            ``None`` if it is not manifest.
 
-            if node is not None:
-                response_dataset[u"primary"] = unicode(node.uuid)
-                response_dataset[u"path"] = get_manifestation_path(
+        :return: A ``dict`` describing the state of the dataset.
+        """
+        response_dataset = dict(
+            dataset_id=dataset.dataset_id,
+        )
+
+        if node is not None:
+            response_dataset[u"primary"] = unicode(node.uuid)
+            response_dataset[u"path"] = (
+                self.cluster_state_service.manifestation_path(
                     node.uuid,
                     dataset.dataset_id
-                ).path.decode("utf-8")
+                ).path.decode("utf-8"))
 
-            if dataset.maximum_size is not None:
-                response_dataset[u"maximum_size"] = dataset.maximum_size
+        if dataset.maximum_size is not None:
+            response_dataset[u"maximum_size"] = dataset.maximum_size
+        return response_dataset
 
-            response.append(response_dataset)
-        return response
+    @app.route("/state/datasets/<dataset_id>", methods=['GET'])
+    @user_documentation(
+        u"""
+        The result reflects the control service's knowledge, which may be
+        out of date or incomplete. E.g. a dataset agent has not connected
+        or updated the control service yet.
+        """,
+        header=u"Get the current state of a dataset",
+        examples=[u"get state dataset"],
+        section=u"dataset",
+    )
+    @structured(
+        inputSchema={},
+        outputSchema={
+            '$ref': '/v1/endpoints.json#/definitions/state_dataset'
+            },
+        schema_store=SCHEMAS,
+    )
+    def state_dataset(self, dataset_id):
+        """
+        Return the state of a primary manifest or non-manifest dataset.
+
+        :param unicode dataset_id: The unique identifier of the dataset.
+
+        :return: A ``dict`` describing the state of the dataset.
+        """
+        deployment_state = self.cluster_state_service.as_deployment()
+        for node in deployment_state.nodes_with_manifestation(dataset_id):
+            manifestation = node.manifestations[dataset_id]
+            if manifestation.primary:
+                return self._state_dataset_response(
+                    manifestation.dataset, node)
+        dataset = deployment_state.nonmanifest_datasets.get(dataset_id)
+        if dataset is None:
+            raise DATASET_NOT_FOUND
+        return self._state_dataset_response(dataset, None)
 
     @app.route("/configuration/containers", methods=['GET'])
     @user_documentation(
@@ -537,6 +825,9 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get configured containers"],
         section=u"container",
     )
+    @_when_changed_since(
+        get_configuration_tag, lambda api: api.configuration_watchers)
+    @_if_none_match(get_configuration_tag)
     @structured(
         inputSchema={},
         outputSchema={
@@ -544,6 +835,8 @@ class ConfigurationAPIUserV1(object):
             '/v1/endpoints.json#/definitions/configuration_containers_array',
         },
         schema_store=SCHEMAS,
+        cache=_response_cache(
+            u"get_containers_configuration", get_configuration_tag),
     )
     def get_containers_configuration(self):
         """
@@ -555,6 +848,44 @@ class ConfigurationAPIUserV1(object):
         return list(
             _containers_from_deployment(self.persistence_service.get()))
 
+    @app.route("/configuration/containers/<name>", methods=['GET'])
+    @user_documentation(
+        u"""
+        The container is looked up directly, so this is cheaper than
+        listing all containers when only one is of interest.  It may or may
+        not actually exist on the cluster.
+        """,
+        header=u"Get a named container's configuration",
+        examples=[u"get configured container"],
+        section=u"container",
+    )
+    @structured(
+        inputSchema={},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_container',
+        },
+        schema_store=SCHEMAS,
+    )
+    def get_container_configuration(self, name):
+        """
+        Get the configuration of a container.
+
+        :param unicode name: A unique identifier for the container within
+            the Flocker cluster.
+
+        :return: A ``dict`` describing the container.
+        """
+        for node in self.persistence_service.get().nodes_with_application(
+                name):
+            application = node.applications.get(name)
+            if application:
+                return container_configuration_response(
+                    application, node.uuid)
+
+        # Didn't find the application:
+        raise CONTAINER_NOT_FOUND
+
     @app.route("/state/containers", methods=['GET'])
     @user_documentation(
         u"""
@@ -566,6 +897,9 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get actual containers"],
         section=u"container",
     )
+    @_when_changed_since(
+        get_state_tag, lambda api: api.state_watchers)
+    @_if_none_match(get_state_tag)
     @structured(
         inputSchema={},
         outputSchema={
@@ -573,6 +907,7 @@ class ConfigurationAPIUserV1(object):
             '/v1/endpoints.json#/definitions/state_containers_array',
         },
         schema_store=SCHEMAS,
+        cache=_response_cache(u"get_containers_state", get_state_tag),
     )
     def get_containers_state(self):
         """
@@ -603,9 +938,10 @@ class ConfigurationAPIUserV1(object):
             raise DATASET_NOT_FOUND
         if not any(n for (_, n) in instances if n.uuid == node_uuid):
             raise DATASET_ON_DIFFERENT_NODE
-        if any(app for app in deployment.applications() if
-                app.volume and
-                app.volume.manifestation.dataset_id == volume[u"dataset_id"]):
+        if any(app for _, node in instances
+               for app in node.applications.values() if
+               app.volume and
+               app.volume.manifestation.dataset_id == volume[u"dataset_id"]):
             raise DATASET_IN_USE
 
         return AttachedVolume(
@@ -704,9 +1040,8 @@ class ConfigurationAPIUserV1(object):
 
         # Check if container by this name already exists, if it does
         # return error.
-        for node in deployment.nodes.itervalues():
-            if name in node.applications:
-                raise CONTAINER_NAME_COLLISION
+        if deployment.nodes_with_application(name):
+            raise CONTAINER_NAME_COLLISION
 
         # Find the volume, if any; currently we only support one volume
         # https://clusterhq.atlassian.net/browse/FLOC-49
@@ -832,7 +1167,7 @@ class ConfigurationAPIUserV1(object):
         deployment = self.persistence_service.get()
         node_uuid = UUID(hex=node_uuid)
         target_node = deployment.get_node(node_uuid)
-        for node in deployment.nodes.itervalues():
+        for node in deployment.nodes_with_application(name):
             application = node.applications.get(name)
             if application:
                 deployment = deployment.move_application(
@@ -882,7 +1217,7 @@ class ConfigurationAPIUserV1(object):
         """
         deployment = self.persistence_service.get()
 
-        for node in deployment.nodes.itervalues():
+        for node in deployment.nodes_with_application(name):
             application = node.applications.get(name)
             if application:
                 updated_node = node.transform(
@@ -914,13 +1249,40 @@ class ConfigurationAPIUserV1(object):
         inputSchema={},
         outputSchema={"$ref":
                       '/v1/endpoints.json#/definitions/nodes_array'},
-        schema_store=SCHEMAS
+        schema_store=SCHEMAS,
+        cache=_response_cache(u"list_current_nodes", get_state_tag),
     )
     def list_current_nodes(self):
         return [{u"host": node.hostname, u"uuid": unicode(node.uuid)}
                 for node in
                 self.cluster_state_service.as_deployment().nodes.itervalues()]
 
+    @app.route("/state/nodes/<node_uuid>", methods=['GET'])
+    @user_documentation(
+        u"""
+        The node may not be found if its agents are disconnected from the
+        cluster. IP addresses may be private IP addresses that are not
+        publicly routable.
+        """,
+        header=u"Get a known node in the cluster",
+        examples=[
+            u"get known node",
+        ],
+        section=u"common",
+    )
+    @structured(
+        inputSchema={},
+        outputSchema={"$ref":
+                      '/v1/endpoints.json#/definitions/known_node'},
+        schema_store=SCHEMAS
+    )
+    def get_current_node(self, node_uuid):
+        node = self.cluster_state_service.as_deployment().nodes.get(
+            UUID(node_uuid))
+        if node is None:
+            raise NODE_NOT_FOUND
+        return {u"host": node.hostname, u"uuid": unicode(node.uuid)}
+
     @app.route("/state/nodes/by_era/<era>", methods=['GET'])
     @user_documentation(
         u"""
@@ -1011,7 +1373,8 @@ class ConfigurationAPIUserV1(object):
             '$ref':
             '/v1/endpoints.json#/definitions/list_leases'
         },
-        schema_store=SCHEMAS
+        schema_store=SCHEMAS,
+        cache=_response_cache(u"list_leases", _get_leases_tag),
     )
     def list_leases(self):
         """
@@ -1023,6 +1386,37 @@ class ConfigurationAPIUserV1(object):
             result.append(lease_response(lease, now))
         return result
 
+    @app.route("/configuration/leases/<dataset_id>", methods=['GET'])
+    @user_documentation(
+        u"""
+        Get the lease on a dataset, including which node the lease is for
+        and when if ever the lease will expire.
+        """,
+        header=u"Get the lease on a dataset",
+        examples=[
+            u"get a lease",
+        ],
+        section=u"dataset",
+    )
+    @structured(
+        inputSchema={},
+        outputSchema={'$ref': '/v1/endpoints.json#/definitions/lease'},
+        schema_store=SCHEMAS
+    )
+    def get_lease(self, dataset_id):
+        """
+        Get a lease from the cluster configuration.
+
+        :param unicode dataset_id: The dataset whose lease is wanted.
+
+        :return: A ``dict`` describing the lease.
+        """
+        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
+        lease = self.persistence_service.get().leases.get(UUID(dataset_id))
+        if lease is None:
+            raise LEASE_NOT_FOUND
+        return lease_response(lease, now)
+
     @app.route("/configuration/leases/<dataset_id>", methods=['DELETE'])
     @user_documentation(
         u"""
@@ -1161,6 +1555,153 @@ def _find_manifestation_and_node(deployment, dataset_id):
     return primary_manifestation, origin_node
 
 
+def _create_dataset(deployment, primary, dataset_id=None, maximum_size=None,
+                    metadata=None):
+    """
+    Add a new dataset to the configuration.
+
+    :param Deployment deployment: The configuration to add the dataset to.
+    :param unicode primary: The UUID of the node on which the primary
+        manifestation of the dataset will be created.
+    :param unicode dataset_id: The identifier to assign to the dataset, or
+        ``None`` to generate one.
+    :param maximum_size: The maximum number of bytes the dataset will be
+        capable of storing or ``None`` to make the dataset size unlimited.
+    :param dict metadata: Unicode key/value pairs to associate with the
+        dataset, or ``None`` for none.
+
+    :raise BadRequest: If the dataset cannot be created.
+    :return: Tuple of the updated ``Deployment`` and the API ``dict``
+        describing the new dataset.
+    """
+    if dataset_id is None:
+        dataset_id = unicode(uuid4())
+    dataset_id = dataset_id.lower()
+
+    if metadata is None:
+        metadata = {}
+
+    primary = UUID(hex=primary)
+
+    if deployment.nodes_with_manifestation(dataset_id):
+        raise DATASET_ID_COLLISION
+
+    # XXX Check cluster state to determine if the given primary node
+    # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
+    # See FLOC-1278
+
+    dataset = Dataset(
+        dataset_id=dataset_id,
+        maximum_size=maximum_size,
+        metadata=pmap(metadata)
+    )
+    manifestation = Manifestation(dataset=dataset, primary=True)
+
+    primary_node = deployment.get_node(primary)
+
+    new_node_config = primary_node.transform(
+        ("manifestations", manifestation.dataset_id), manifestation)
+    return (deployment.update_node(new_node_config),
+            api_dataset_from_dataset_and_node(dataset, primary))
+
+
+def _delete_dataset(deployment, dataset_id):
+    """
+    Mark a dataset as deleted in the configuration.
+
+    :param Deployment deployment: The configuration containing the dataset.
+    :param unicode dataset_id: The identifier of the dataset.
+
+    :raise BadRequest: If the dataset cannot be deleted.
+    :return: Tuple of the updated ``Deployment`` and the API ``dict``
+        describing the deleted dataset.
+    """
+    # XXX this doesn't handle replicas
+    # https://clusterhq.atlassian.net/browse/FLOC-1240
+    _, origin_node = _find_manifestation_and_node(deployment, dataset_id)
+
+    new_node = origin_node.transform(
+        ("manifestations", dataset_id, "dataset", "deleted"), True)
+    return (deployment.update_node(new_node),
+            api_dataset_from_dataset_and_node(
+                new_node.manifestations[dataset_id].dataset, new_node.uuid))
+
+
+def _existing_dataset(deployment, dataset_id):
+    """
+    Check a dataset can be updated.
+
+    :param Deployment deployment: The configuration containing the dataset.
+    :param unicode dataset_id: The identifier of the dataset.
+
+    :raise BadRequest: If the dataset is not found or has been deleted.
+    """
+    primary_manifestation, _ = _find_manifestation_and_node(
+        deployment, dataset_id)
+    if primary_manifestation.dataset.deleted:
+        raise DATASET_DELETED
+
+
+def _updated_dataset(deployment, dataset_id):
+    """
+    :return: Tuple of ``deployment`` and the API ``dict`` describing the
+        dataset with the given identifier in it.
+    """
+    primary_manifestation, current_node = _find_manifestation_and_node(
+        deployment, dataset_id)
+    return deployment, api_dataset_from_dataset_and_node(
+        primary_manifestation.dataset, current_node.uuid)
+
+
+def _move_dataset(deployment, dataset_id, primary=None):
+    """
+    Move a dataset to a new primary node in the configuration.
+
+    :param Deployment deployment: The configuration containing the dataset.
+    :param unicode dataset_id: The identifier of the dataset.
+    :param unicode primary: The UUID of the node to which the dataset will
+        be moved, or ``None`` indicating no change.
+
+    :raise BadRequest: If the dataset cannot be moved.
+    :return: Tuple of the updated ``Deployment`` and the API ``dict``
+        describing the moved dataset.
+    """
+    _existing_dataset(deployment, dataset_id)
+    if primary is not None:
+        deployment = _update_dataset_primary(
+            deployment, dataset_id, UUID(hex=primary))
+    return _updated_dataset(deployment, dataset_id)
+
+
+def _resize_dataset(deployment, dataset_id, maximum_size):
+    """
+    Change the maximum size of a dataset in the configuration.
+
+    :param Deployment deployment: The configuration containing the dataset.
+    :param unicode dataset_id: The identifier of the dataset.
+    :param maximum_size: The new size of the dataset or ``None`` to remove
+        the size limit.
+
+    :raise BadRequest: If the dataset cannot be resized.
+    :return: Tuple of the updated ``Deployment`` and the API ``dict``
+        describing the resized dataset.
+    """
+    _existing_dataset(deployment, dataset_id)
+    deployment = _update_dataset_maximum_size(
+        deployment, dataset_id, maximum_size)
+    return _updated_dataset(deployment, dataset_id)
+
+
+# Map the names of the operations accepted by the bulk dataset endpoint to
+# functions applying them to a ``Deployment``:
+_DATASET_OPERATIONS = {
+    u"create": _create_dataset,
+    u"move": _move_dataset,
+    u"resize": _resize_dataset,
+    u"delete": _delete_dataset,
+}
+
+
 def _update_dataset_primary(deployment, dataset_id, primary):
     """
     Update the ``deployment`` so that the ``Dataset`` with the supplied
@@ -1205,12 +1746,11 @@ def _update_dataset_maximum_size(deployment, dataset_id, maximum_size):
     :returns: An updated ``Deployment``.
     """
     _, node = _find_manifestation_and_node(deployment, dataset_id)
-    deployment = deployment.set(nodes=deployment.nodes.discard(node))
     node = node.transform(
         ['manifestations', dataset_id, 'dataset', 'maximum_size'],
         maximum_size
     )
-    return deployment.set(nodes=deployment.nodes.add(node))
+    return deployment.update_node(node)
 
 
 def manifestations_from_deployment(deployment, dataset_id):
@@ -1225,9 +1765,8 @@ def manifestations_from_deployment(deployment, dataset_id):
     :return: Iterable returning all manifestations of the supplied
         ``dataset_id``.
     """
-    for node in deployment.nodes.itervalues():
-        if dataset_id in node.manifestations:
-            yield node.manifestations[dataset_id], node
+    for node in deployment.nodes_with_manifestation(dataset_id):
+        yield node.manifestations[dataset_id], node
 
 
 def datasets_from_deployment(deployment):
@@ -10,25 +10,45 @@ import signal
 from functools import partial
 from time import clock
 
-from twisted.python.usage import Options
+from twisted.python.usage import Options, UsageError
+from twisted.python.threadpool import ThreadPool
 from twisted.internet.endpoints import serverFromString
 from twisted.python.filepath import FilePath
 from twisted.application.service import MultiService
 from twisted.internet.ssl import Certificate
 
 from .httpapi import create_api_service, REST_API_PORT
-from ._persistence import ConfigurationPersistenceService
+from ._persistence import (
+    ConfigurationPersistenceService, FileConfigurationStore,
+)
+from ._sqlite import SQLiteConfigurationStore
 from ._clusterstate import ClusterStateService
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, main_for_service,
     enable_profiling, disable_profiling)
-from ._protocol import ControlAMPService
+from ._protocol import (
+    ControlAMPService, CONTROL_SERVICE_BATCHING_DELAY,
+    CONTROL_SERVICE_MINIMUM_BATCHING_DELAY,
+)
 from ..ca import (
     rest_api_context_factory, ControlCredential, amp_server_context_factory,
 )
 
 DEFAULT_CERTIFICATE_PATH = b"/etc/flocker"
 
+# Ways the configuration can be stored in the data path:
+CONFIGURATION_STORES = (b"file", b"sqlite")
+
+
+def _configuration_store(value):
+    """
+    Validate the ``--configuration-store`` option.
+    """
+    if value not in CONFIGURATION_STORES:
+        raise ValueError(
+            "must be one of: {}".format(", ".join(CONFIGURATION_STORES)))
+    return value
+
 
 @flocker_standard_options
 class ControlOptions(Options):
@@ -42,12 +62,32 @@ class ControlOptions(Options):
          "The external API port to listen on."],
         ["agent-port", "a", 'tcp:4524',
          "The port convergence agents will connect to."],
+        ["configuration-store", None, b"file",
+         "How to store the configuration in the data path: 'file' for "
+         "JSON files, or 'sqlite' for an SQLite database.  Configuration "
+         "stored in files is copied into a new SQLite database.",
+         _configuration_store],
+        ["minimum-batching-delay", None,
+         CONTROL_SERVICE_MINIMUM_BATCHING_DELAY,
+         "The shortest time in seconds to wait for changes to build up "
+         "before sending them to agents.", float],
+        ["maximum-batching-delay", None, CONTROL_SERVICE_BATCHING_DELAY,
+         "The longest time in seconds to wait for changes to build up "
+         "before sending them to agents.  The wait grows towards this as "
+         "changes become more frequent and more agents connect.", float],
         ["certificates-directory", "c", DEFAULT_CERTIFICATE_PATH,
          ("Absolute path to directory containing the cluster "
           "root certificate (cluster.crt) and control service certificate "
           "and private key (control-service.crt and control-service.key).")],
     ]
 
+    def postOptions(self):
+        if not (0 <= self["minimum-batching-delay"] <=
+                self["maximum-batching-delay"]):
+            raise UsageError(
+                "--minimum-batching-delay must be between 0 and "
+                "--maximum-batching-delay.")
+
 
 class ControlScript(object):
     """
@@ -64,8 +104,21 @@ class ControlScript(object):
             certificates_path, b"service")
 
         top_service = MultiService()
+        store = None
+        if options["configuration-store"] == b"sqlite":
+            store = SQLiteConfigurationStore(
+                options["data-path"].child(b"current_configuration.sqlite"),
+                migrate_from=FileConfigurationStore(options["data-path"]),
+            )
         persistence = ConfigurationPersistenceService(
-            reactor, options["data-path"])
+            reactor, options["data-path"], store=store,
+            # Configuration is written in its own thread so that saves don't
+            # block the reactor:
+            threadpool=ThreadPool(
+                minthreads=1, maxthreads=1,
+                name="flocker-control-persistence",
+            ),
+        )
         persistence.setServiceParent(top_service)
         cluster_state = ClusterStateService(reactor)
         cluster_state.setServiceParent(top_service)
@@ -77,7 +130,9 @@ class ControlScript(object):
         amp_service = ControlAMPService(
             reactor, cluster_state, persistence, serverFromString(
                 reactor, options["agent-port"]),
-            amp_server_context_factory(ca, control_credential))
+            amp_server_context_factory(ca, control_credential),
+            minimum_batching_delay=options["minimum-batching-delay"],
+            maximum_batching_delay=options["maximum-batching-delay"])
         amp_service.setServiceParent(top_service)
         return main_for_service(reactor, top_service)
 
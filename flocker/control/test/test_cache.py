@@ -0,0 +1,104 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._cache``.
+"""
+
+from pyrsistent import pmap
+
+from ...testtools import TestCase
+from .._cache import IdentityCache
+
+
+class IdentityCacheTests(TestCase):
+    """
+    Tests for ``IdentityCache``.
+    """
+    def setUp(self):
+        super(IdentityCacheTests, self).setUp()
+        self.cache = IdentityCache()
+
+    def test_miss(self):
+        """
+        ``IdentityCache.get`` returns the default for an object that has not
+        been cached, and counts a miss.
+        """
+        sentinel = object()
+        self.assertEqual(
+            (self.cache.get(pmap(), sentinel), self.cache.misses),
+            (sentinel, 1),
+        )
+
+    def test_hit(self):
+        """
+        ``IdentityCache.get`` returns the value cached for an object, and
+        counts a hit.
+        """
+        key = pmap({u"a": 1})
+        self.cache[key] = u"value"
+        self.assertEqual(
+            (self.cache.get(key), self.cache.hits, self.cache.misses),
+            (u"value", 1, 0),
+        )
+
+    def test_equal_objects_miss(self):
+        """
+        A value cached for one object is not returned for a different but
+        equal object.
+        """
+        key = pmap({u"a": 1})
+        self.cache[key] = u"value"
+        self.assertIs(None, self.cache.get(pmap({u"a": 1})))
+
+    def test_eviction(self):
+        """
+        The entry for an object is removed once the object is garbage
+        collected, and counted as an eviction.
+        """
+        key = pmap({u"a": 1})
+        self.cache[key] = u"value"
+        del key
+        self.assertEqual(
+            (len(self.cache), self.cache.evictions), (0, 1))
+
+    def test_replace(self):
+        """
+        Caching a new value for an object replaces the old one.
+        """
+        key = pmap({u"a": 1})
+        self.cache[key] = u"old"
+        self.cache[key] = u"new"
+        self.assertEqual(
+            (self.cache.get(key), len(self.cache)), (u"new", 1))
+
+    def test_not_weakly_referenceable(self):
+        """
+        Objects that can't be weakly referenced are not cached.
+        """
+        key = (1, 2)
+        self.cache[key] = u"value"
+        self.assertEqual(
+            (self.cache.get(key), len(self.cache)), (None, 0))
+
+    def test_clear(self):
+        """
+        ``IdentityCache.clear`` removes all entries.
+        """
+        key = pmap({u"a": 1})
+        self.cache[key] = u"value"
+        self.cache.clear()
+        self.assertIs(None, self.cache.get(key))
+
+    def test_statistics(self):
+        """
+        ``IdentityCache.statistics`` returns the counters and current size.
+        """
+        key = pmap({u"a": 1})
+        self.cache[key] = u"value"
+        self.cache.get(key)
+        self.cache.get(pmap())
+        self.cache[pmap({u"b": 2})] = u"gone"
+        self.assertEqual(
+            dict(hits=1, misses=1, evictions=1, size=1),
+            self.cache.statistics(),
+        )
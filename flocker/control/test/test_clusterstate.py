@@ -6,11 +6,13 @@ Tests for ``flocker.control._clusterstate``.
 
 from uuid import uuid4
 
+from eliot.testing import capture_logging, assertHasMessage
+
 from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 
 from .._model import ChangeSource
-from .._clusterstate import ClusterStateService
+from .._clusterstate import ClusterStateService, _LOG_WIPE_EXPIRED
 from .. import (
     Application, DockerImage, NodeState, DeploymentState, Manifestation,
     Dataset,
@@ -26,6 +28,20 @@ MANIFESTATION = Manifestation(dataset=Dataset(dataset_id=unicode(uuid4())),
                               primary=True)
 
 
+class _CountingSource(ChangeSource):
+    """
+    A ``ChangeSource`` which counts how often it is asked for its last
+    activity.
+
+    :ivar int calls: The number of calls to ``last_activity``.
+    """
+    calls = 0
+
+    def last_activity(self):
+        self.calls += 1
+        return ChangeSource.last_activity(self)
+
+
 class ClusterStateServiceTests(TestCase):
     """
     Tests for ``ClusterStateService``.
@@ -167,6 +183,43 @@ class ClusterStateServiceTests(TestCase):
             [DeploymentState(nodes=[self.WITH_APPS]), DeploymentState()],
         )
 
+    def test_register_changes(self):
+        """
+        Functions passed to ``register`` are called when changes are applied.
+        """
+        service = self.service()
+        called = []
+        service.register(lambda: called.append(True))
+        service.apply_changes([self.WITH_APPS])
+        self.assertEqual([True], called)
+
+    def test_register_unchanged(self):
+        """
+        Functions passed to ``register`` are not called when applied changes
+        leave the state as it was.
+        """
+        service = self.service()
+        source = ChangeSource()
+        source.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_source(source, [self.WITH_APPS])
+        called = []
+        service.register(lambda: called.append(True))
+        service.apply_changes_from_source(source, [self.WITH_APPS])
+        self.assertEqual([], called)
+
+    def test_register_expiration(self):
+        """
+        Functions passed to ``register`` are called when information is wiped
+        because it expired.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        called = []
+        service.register(lambda: called.append(True))
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        self.assertEqual([True], called)
+
     def test_expiration_from_inactivity(self):
         """
         Information updates from a source with no activity for more than the
@@ -253,3 +306,50 @@ class ClusterStateServiceTests(TestCase):
             service.as_deployment(),
             DeploymentState(nodes=[self.WITH_APPS]),
         )
+
+    def test_active_sources_not_checked(self):
+        """
+        Sources are not asked for their last activity until their information
+        could have expired.
+        """
+        service = self.service()
+        sources = [_CountingSource() for _ in range(3)]
+        for source in sources:
+            source.set_last_activity(self.clock.seconds())
+            service.apply_changes_from_source(source, [self.WITH_APPS])
+        advance_rest(self.clock)
+        self.assertEqual([1, 1, 1], [source.calls for source in sources])
+
+    def test_replaced_source_not_checked(self):
+        """
+        A source whose information has all come from other sources since is
+        not asked for its last activity.
+        """
+        service = self.service()
+        old, new = _CountingSource(), _CountingSource()
+        old.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_source(old, [self.WITH_APPS])
+        advance_some(self.clock)
+        new.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_source(new, [self.WITH_APPS])
+        advance_rest(self.clock)
+        self.assertEqual(
+            (1, DeploymentState(nodes=[self.WITH_APPS])),
+            (old.calls, service.as_deployment()))
+
+    @capture_logging(None)
+    def test_wipes_logged(self, logger):
+        """
+        The number of sources which expired and wipes applied in a check are
+        logged and counted.
+        """
+        service = self.service()
+        for state in [self.WITH_APPS, self.WITH_MANIFESTATION]:
+            source = ChangeSource()
+            source.set_last_activity(self.clock.seconds())
+            service.apply_changes_from_source(source, [state])
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        assertHasMessage(self, logger, _LOG_WIPE_EXPIRED,
+                         dict(sources=2, wipes=2))
+        self.assertEqual(2, service.wipes_applied)
@@ -0,0 +1,196 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._compact``.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+from pytz import UTC
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from twisted.python.filepath import FilePath
+
+from pyrsistent import PClass, PRecord, pmap
+
+from ...testtools import TestCase
+from .._compact import (
+    COMPACT_MAGIC, _CLASS_NAMES, compact_encode, compact_decode,
+)
+from .._diffing import create_diff
+from .._model import (
+    SERIALIZABLE_CLASSES, Deployment, DeploymentState, NodeState, Node,
+    Manifestation, Dataset, Lease, Leases,
+)
+from .._persistence import wire_encode, wire_decode, make_generation_hash
+from .test_persistence import DEPLOYMENTS, LATEST_TEST_DEPLOYMENT
+
+
+def _deployment(number_of_datasets):
+    """
+    :param int number_of_datasets: The number of datasets to include.
+
+    :return Deployment: A configuration with ten nodes sharing the given
+        number of datasets between them.
+    """
+    nodes = [Node(uuid=uuid4()) for _ in range(10)]
+    for index in range(number_of_datasets):
+        dataset_id = unicode(uuid4())
+        manifestation = Manifestation(
+            dataset=Dataset(
+                dataset_id=dataset_id,
+                maximum_size=1024 * 1024 * 1024,
+                metadata={u"name": u"dataset-%d" % (index,)},
+            ),
+            primary=True,
+        )
+        node_index = index % len(nodes)
+        nodes[node_index] = nodes[node_index].transform(
+            ["manifestations", dataset_id], manifestation)
+    return Deployment(nodes=nodes)
+
+
+class CompactEncodingTests(TestCase):
+    """
+    Tests for ``compact_encode`` and ``compact_decode``.
+    """
+    @given(DEPLOYMENTS)
+    def test_roundtrip(self, deployment):
+        """
+        A range of generated configurations can be roundtripped.
+        """
+        self.assertEqual(
+            deployment, compact_decode(compact_encode(deployment)))
+
+    @given(st.one_of(
+        st.none(), st.booleans(), st.integers(), st.floats(allow_nan=False),
+        st.text(), st.lists(st.integers()),
+        st.dictionaries(keys=st.text(), values=st.integers()),
+    ))
+    def test_same_as_json(self, value):
+        """
+        Basic values decode to the same thing they do when JSON encoded.
+        """
+        self.assertEqual(
+            wire_decode(wire_encode(value)),
+            compact_decode(compact_encode(value)),
+        )
+
+    def test_magic(self):
+        """
+        Encoded data starts with ``COMPACT_MAGIC``.
+        """
+        self.assertTrue(
+            compact_encode(LATEST_TEST_DEPLOYMENT).startswith(COMPACT_MAGIC))
+
+    def test_node_state(self):
+        """
+        A ``NodeState`` with ``UUID`` and ``FilePath`` values can be
+        roundtripped.
+        """
+        node_state = NodeState(hostname=u'127.0.0.1', uuid=uuid4(),
+                               manifestations={}, paths={},
+                               devices={uuid4(): FilePath(b"/tmp")})
+        self.assertEqual(
+            node_state, compact_decode(compact_encode(node_state)))
+
+    def test_leases(self):
+        """
+        ``Leases``, whose expiration times are ``datetime`` s, can be
+        roundtripped.
+        """
+        dataset_id = uuid4()
+        leases = Leases().set(dataset_id, Lease(
+            dataset_id=dataset_id, node_id=uuid4(),
+            expiration=datetime.fromtimestamp(1000, UTC)))
+        deployment = Deployment(leases=leases)
+        self.assertEqual(
+            deployment, compact_decode(compact_encode(deployment)))
+
+    def test_diff(self):
+        """
+        A ``Diff`` between configurations can be roundtripped.
+        """
+        before = _deployment(10)
+        uuid = uuid4()
+        after = before.transform(["nodes", uuid], Node(uuid=uuid))
+        diff = create_diff(before, after)
+        self.assertEqual(
+            after, compact_decode(compact_encode(diff)).apply(before))
+
+    def test_generation_hash(self):
+        """
+        A ``GenerationHash`` can be roundtripped.
+        """
+        generation = make_generation_hash(LATEST_TEST_DEPLOYMENT)
+        self.assertEqual(
+            generation, compact_decode(compact_encode(generation)))
+
+    def test_smaller_than_json(self):
+        """
+        The compact encoding of a configuration is smaller than its JSON
+        encoding.
+        """
+        deployment = _deployment(100)
+        self.assertLess(
+            len(compact_encode(deployment)), len(wire_encode(deployment)))
+
+    def test_all_classes_have_identifiers(self):
+        """
+        Every serializable ``PClass`` and ``PRecord`` has a class identifier.
+        """
+        self.assertEqual(
+            set(),
+            set(cls.__name__ for cls in SERIALIZABLE_CLASSES
+                if issubclass(cls, (PClass, PRecord))) - set(_CLASS_NAMES),
+        )
+
+    def test_unknown_class(self):
+        """
+        Encoding an instance of a class that has no identifier raises
+        ``TypeError``.
+        """
+        class Temp(PClass):
+            """A class."""
+        self.assertRaises(TypeError, compact_encode, Temp())
+
+    def test_unknown_class_identifier(self):
+        """
+        Decoding an unknown class identifier raises ``ValueError``.
+        """
+        self.assertRaises(
+            ValueError, compact_decode, COMPACT_MAGIC + b"\x09\x7f\x00")
+
+    def test_truncated(self):
+        """
+        Decoding truncated data raises ``ValueError``.
+        """
+        encoded = compact_encode(LATEST_TEST_DEPLOYMENT)
+        self.assertRaises(ValueError, compact_decode, encoded[:-1])
+
+    def test_trailing_data(self):
+        """
+        Decoding data with more after the encoded object raises
+        ``ValueError``.
+        """
+        encoded = compact_encode(LATEST_TEST_DEPLOYMENT)
+        self.assertRaises(ValueError, compact_decode, encoded + b"\x00")
+
+    def test_not_compact(self):
+        """
+        Decoding data without ``COMPACT_MAGIC`` raises ``ValueError``.
+        """
+        self.assertRaises(
+            ValueError, compact_decode, wire_encode(LATEST_TEST_DEPLOYMENT))
+
+    def test_pmap_of_pmaps(self):
+        """
+        A ``DeploymentState`` containing nested ``PMap`` s can be
+        roundtripped.
+        """
+        state = DeploymentState(nodes=[NodeState(
+            hostname=u"192.0.2.1", uuid=uuid4(), applications=pmap())])
+        self.assertEqual(state, compact_decode(compact_encode(state)))
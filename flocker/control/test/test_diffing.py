@@ -14,10 +14,15 @@ from pyrsistent import PClass, field, pmap, pset, InvariantException
 from twisted.python.monkey import MonkeyPatcher
 
 from .._diffing import (
+    Diff,
     create_diff,
     compose_diffs,
     DIFF_COMMIT_ERROR,
     _TransformProxy,
+    _Set,
+    _Remove,
+    _Add,
+    _Replace,
 )
 from .._persistence import wire_encode, wire_decode
 from .._model import Node, Port
@@ -40,6 +45,26 @@ class DiffTestObj(PClass):
     a = field()
 
 
+class _CountingEquality(object):
+    """
+    An object which counts the number of times any instance is compared for
+    equality.
+
+    :ivar int comparisons: The number of comparisons.
+    """
+    comparisons = 0
+
+    def __eq__(self, other):
+        _CountingEquality.comparisons += 1
+        return self is other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(self)
+
+
 class DeploymentDiffTest(TestCase):
     """
     Tests for creating and applying diffs between deployments.
@@ -210,6 +235,87 @@ class DeploymentDiffTest(TestCase):
             Equals(object_b)
         )
 
+    def test_shared_parts_not_compared(self):
+        """
+        Parts shared by the two objects are not compared for equality, so
+        the number of comparisons does not depend on how much is shared.
+        """
+        def comparisons(size):
+            object_a = pmap({
+                key: DiffTestObj(a=pset([_CountingEquality()]))
+                for key in range(size)
+            })
+            object_b = object_a.set(
+                0, DiffTestObj(a=pset([_CountingEquality()])))
+            _CountingEquality.comparisons = 0
+            diff = create_diff(object_a, object_b)
+            result = _CountingEquality.comparisons
+            self.assertEqual(object_b, diff.apply(object_a))
+            return result
+        self.assertEqual(comparisons(10), comparisons(100))
+
+
+class ComposeDiffsTests(TestCase):
+    """
+    Tests for ``compose_diffs``.
+    """
+    @given(related_deployments_strategy(5))
+    def test_related_deployments(self, deployments):
+        """
+        Composing the diffs between a series of related deployments gives a
+        diff from the first to the last.
+        """
+        diffs = [create_diff(a, b)
+                 for a, b in zip(deployments[:-1], deployments[1:])]
+        self.assertEqual(
+            deployments[-1], compose_diffs(diffs).apply(deployments[0]))
+
+    def test_last_set_wins(self):
+        """
+        Only the last of several changes setting the same key is kept.
+        """
+        values = [pmap({u"a": i}) for i in range(5)]
+        diffs = [create_diff(a, b) for a, b in zip(values[:-1], values[1:])]
+        self.assertEqual(
+            [_Set(path=[], key=u"a", value=4)],
+            list(compose_diffs(diffs).changes))
+
+    def test_add_then_remove(self):
+        """
+        An item added to a set and then removed is only removed.
+        """
+        diffs = [create_diff(pset(), pset([1])),
+                 create_diff(pset([1]), pset())]
+        self.assertEqual(
+            [_Remove(path=[], item=1)], list(compose_diffs(diffs).changes))
+
+    def test_changes_within_replaced_object_dropped(self):
+        """
+        Changes within an object that is later set to a new value are
+        dropped, while changes elsewhere are kept in order.
+        """
+        diffs = [
+            Diff(changes=[_Set(path=[u"a"], key=u"b", value=1),
+                          _Add(path=[u"c"], item=2)]),
+            Diff(changes=[_Set(path=[], key=u"a", value=pmap())]),
+        ]
+        self.assertEqual(
+            [_Add(path=[u"c"], item=2), _Set(path=[], key=u"a", value=pmap())],
+            list(compose_diffs(diffs).changes))
+
+    def test_replace_drops_earlier(self):
+        """
+        Changes before one that replaces the whole object are dropped.
+        """
+        diffs = [
+            create_diff(pmap({u"a": 1}), pmap({u"a": 2})),
+            Diff(changes=[_Replace(value=pmap())]),
+            create_diff(pmap(), pmap({u"b": 3})),
+        ]
+        self.assertEqual(
+            [_Replace(value=pmap()), _Set(path=[], key=u"b", value=3)],
+            list(compose_diffs(diffs).changes))
+
 
 class DiffTestObjInvariant(PClass):
     """
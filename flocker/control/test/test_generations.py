@@ -4,12 +4,15 @@
 Tests for ``flocker.node._generations``.
 """
 
+from uuid import uuid4
+
 from testtools.matchers import Equals, Is, Not, HasLength
 
 from ...testtools import TestCase
 
 from ..testtools import related_deployments_strategy
 from .._generations import GenerationTracker
+from .._model import Deployment, Node
 from .._persistence import make_generation_hash
 
 
@@ -99,3 +102,85 @@ class GenerationTrackerTests(TestCase):
             missing_diff,
             Is(None)
         )
+
+    def test_load_history(self):
+        """
+        After ``load_history`` a ``GenerationTracker`` returns ``Diff`` s
+        to the latest object from each of the generations in the loaded
+        history.
+        """
+        deployments = list(related_deployments_strategy(5).example())
+        original = GenerationTracker(10)
+        for d in deployments:
+            original.insert_latest(d)
+        history = [
+            (record.generation_hash, record.diff_to_next)
+            for record in original._queue
+        ]
+
+        tracker_under_test = GenerationTracker(10)
+        tracker_under_test.load_history(deployments[-1], history)
+
+        self.assertThat(
+            (tracker_under_test.get_latest(),
+             tracker_under_test.get_latest_hash(),
+             [tracker_under_test.get_diff_from_hash_to_latest(
+                 make_generation_hash(d)).apply(d) for d in deployments]),
+            Equals((deployments[-1], make_generation_hash(deployments[-1]),
+                    [deployments[-1]] * len(deployments)))
+        )
+
+    def test_diff_memoized(self):
+        """
+        Looking up the ``Diff`` from the same generation again returns the
+        same object without composing it again, and the lookups are counted.
+        """
+        deployments = related_deployments_strategy(4).example()
+        tracker_under_test = GenerationTracker(10)
+        for d in deployments:
+            tracker_under_test.insert_latest(d)
+        generation = make_generation_hash(deployments[0])
+        first = tracker_under_test.get_diff_from_hash_to_latest(generation)
+        second = tracker_under_test.get_diff_from_hash_to_latest(generation)
+        self.assertThat(
+            (second, tracker_under_test.hits, tracker_under_test.misses),
+            Equals((first, 1, 1))
+        )
+        self.assertThat(second, Is(first))
+
+    def test_memoized_diff_invalidated(self):
+        """
+        Inserting a new generation invalidates the memoized ``Diff`` s, so
+        they convert to the new latest object.
+        """
+        deployments = related_deployments_strategy(4).example()
+        tracker_under_test = GenerationTracker(10)
+        for d in deployments[:-1]:
+            tracker_under_test.insert_latest(d)
+        generation = make_generation_hash(deployments[0])
+        tracker_under_test.get_diff_from_hash_to_latest(generation)
+        tracker_under_test.insert_latest(deployments[-1])
+        self.assertThat(
+            tracker_under_test.get_diff_from_hash_to_latest(
+                generation).apply(deployments[0]),
+            Equals(deployments[-1])
+        )
+
+    def test_repeated_generation(self):
+        """
+        When the object returns to an earlier generation, the ``Diff`` from
+        that generation starts from its most recent occurrence, including
+        after the older occurrence has run out of the cache.
+        """
+        deployments = [Deployment()]
+        for _ in range(2):
+            deployments.append(deployments[-1].update_node(Node(uuid=uuid4())))
+        tracker_under_test = GenerationTracker(3)
+        for d in [deployments[0], deployments[1], deployments[0],
+                  deployments[1], deployments[2]]:
+            tracker_under_test.insert_latest(d)
+        self.assertThat(
+            [tracker_under_test.get_diff_from_hash_to_latest(
+                make_generation_hash(d)).apply(d) for d in deployments],
+            Equals([deployments[2]] * 3)
+        )
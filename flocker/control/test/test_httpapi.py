@@ -14,13 +14,12 @@ from pytz import UTC
 
 from zope.interface.verify import verifyObject
 
-from twisted.internet import reactor
-from twisted.internet.defer import gatherResults
+from twisted.internet.defer import Deferred, gatherResults, maybeDeferred
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.web.http import (
     CREATED, OK, CONFLICT, BAD_REQUEST, NOT_FOUND,
-    NOT_ALLOWED as METHOD_NOT_ALLOWED, PRECONDITION_FAILED,
+    NOT_ALLOWED as METHOD_NOT_ALLOWED, PRECONDITION_FAILED, NOT_MODIFIED,
 )
 from twisted.web.client import readBody
 from twisted.application.service import IService
@@ -40,7 +39,7 @@ from .. import (
 from ..httpapi import (
     ConfigurationAPIUserV1, create_api_service, datasets_from_deployment,
     api_dataset_from_dataset_and_node, container_configuration_response,
-    IF_MATCHES_HEADER,
+    IF_MATCHES_HEADER, REST_API_METRICS, WAIT_FOR_CHANGE_TIMEOUT,
 )
 from .._persistence import ConfigurationPersistenceService
 from .._clusterstate import ClusterStateService
@@ -76,15 +75,106 @@ class APITestsMixin(APIAssertionsMixin):
         """
         Create initial objects for the ``ConfigurationAPIUserV1``.
         """
+        self.clock = Clock()
         self.persistence_service = ConfigurationPersistenceService(
-            reactor, FilePath(self.mktemp()))
+            self.clock, FilePath(self.mktemp()))
         self.persistence_service.startService()
         self.cluster_state_service = ClusterStateService(Clock())
         self.cluster_state_service.startService()
-        self.clock = Clock()
         self.addCleanup(self.cluster_state_service.stopService)
         self.addCleanup(self.persistence_service.stopService)
 
+    def get_entity_tag(self, path):
+        """
+        Issue a ``GET`` request for ``path``.
+
+        :return: ``Deferred`` firing with the ``ETag`` header values of the
+            response.
+        """
+        d = self.assertResponseCode(b"GET", path, None, OK)
+
+        def got_response(response):
+            reading = readBody(response)
+            reading.addCallback(
+                lambda _: response.headers.getRawHeaders(b"ETag"))
+            return reading
+        d.addCallback(got_response)
+        return d
+
+    def assertNotModified(self, path):
+        """
+        Assert that a ``GET`` request for ``path`` with the ``ETag`` of the
+        previous response in its ``If-None-Match`` header gets an empty
+        ``NOT_MODIFIED`` response.
+        """
+        d = self.get_entity_tag(path)
+        d.addCallback(
+            lambda tags: self.assertResponseCode(
+                b"GET", path, None, NOT_MODIFIED,
+                additional_headers={b"If-None-Match": tags}))
+        d.addCallback(readBody)
+        d.addCallback(lambda body: self.assertEqual(b"", body))
+        return d
+
+    def assertModified(self, path, change):
+        """
+        Assert that a ``GET`` request for ``path`` with the ``ETag`` of the
+        previous response in its ``If-None-Match`` header gets a full
+        response once ``change`` has been called.
+
+        :param change: No-argument callable changing what ``path`` returns,
+            which may return a ``Deferred``.
+        """
+        d = self.get_entity_tag(path)
+
+        def got_tags(tags):
+            changing = maybeDeferred(change)
+            changing.addCallback(
+                lambda _: self.assertResponseCode(
+                    b"GET", path, None, OK,
+                    additional_headers={b"If-None-Match": tags}))
+            return changing
+        d.addCallback(got_tags)
+        d.addCallback(readBody)
+        return d
+
+    def assertWaitsForChange(self, path, watchers, change, expected_result):
+        """
+        Assert that a ``GET`` request for ``path`` with the ``ETag`` of the
+        previous response as its ``wait_for_change_since`` query argument is
+        only answered once ``change`` has been called.
+
+        :param _ChangeWatchers watchers: The watchers the request waits on.
+        :param change: No-argument callable changing what ``path`` returns,
+            or letting the wait time out.
+        :param expected_result: The JSON result expected once ``change`` has
+            been called.
+        """
+        waiting = Deferred()
+        add = watchers.add
+
+        def add_and_notify(watcher):
+            add(watcher)
+            waiting.callback(None)
+        self.patch(watchers, "add", add_and_notify)
+
+        d = self.get_entity_tag(path)
+
+        def got_tags(tags):
+            requesting = self.assertResult(
+                b"GET", b"%s?wait_for_change_since=%s" % (
+                    path, tags[0].strip(b'"')),
+                None, OK, expected_result)
+
+            def held(_):
+                self.assertNoResult(requesting)
+                change()
+                return requesting
+            waiting.addCallback(held)
+            return waiting
+        d.addCallback(got_tags)
+        return d
+
 
 class VersionTestsMixin(APITestsMixin):
     """
@@ -101,9 +191,10 @@ class VersionTestsMixin(APITestsMixin):
 
 def _build_app(test):
     test.initialize()
-    return ConfigurationAPIUserV1(test.persistence_service,
-                                  test.cluster_state_service,
-                                  test.clock).app
+    test.api = ConfigurationAPIUserV1(test.persistence_service,
+                                      test.cluster_state_service,
+                                      test.clock)
+    return test.api.app
 RealTestsAPI, MemoryTestsAPI = buildIntegrationTests(
     VersionTestsMixin, "API", _build_app)
 
@@ -1231,6 +1322,45 @@ class GetContainerConfigurationTestsMixin(APITestsMixin):
         ]
         return self._containers_test(deployment, expected)
 
+    def test_not_modified(self):
+        """
+        A request with an ``If-None-Match`` header matching the current
+        configuration gets a ``NOT_MODIFIED`` response.
+        """
+        return self.assertNotModified(b"/configuration/containers")
+
+    def test_get_container(self):
+        """
+        A container can be retrieved by its name.
+        """
+        application = Application(
+            name=u'postgres',
+            image=DockerImage.from_string('postgres')
+        )
+        other = Application(
+            name=u'mysql',
+            image=DockerImage.from_string('mysql')
+        )
+        d = self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 applications={other.name: other}),
+            Node(uuid=self.NODE_B_UUID,
+                 applications={application.name: application}),
+        }))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/containers/postgres", None, OK,
+            container_configuration_response(application, self.NODE_B)))
+        return d
+
+    def test_get_unknown_container(self):
+        """
+        NOT_FOUND is returned if the requested container is not in the
+        configuration.
+        """
+        return self.assertResult(
+            b"GET", b"/configuration/containers/postgres", None, NOT_FOUND,
+            {u"description": u"Container not found."})
+
 
 RealTestsGetContainerConfiguration, MemoryTestsGetContainerConfiguration = (
     buildIntegrationTests(
@@ -2421,6 +2551,167 @@ def _manifestation(**kwargs):
     return Manifestation(dataset=existing_dataset, primary=primary)
 
 
+class BulkDatasetsTestsMixin(APITestsMixin):
+    """
+    Tests for the bulk dataset endpoint at ``/configuration/datasets/_bulk``.
+    """
+    SIZE = 1024 * 1024 * 128
+
+    def _setup_manifestations(self):
+        """
+        Create and save a configuration with a single node that has two
+        manifestations.
+
+        :return: ``Deferred`` firing with the ``Manifestation`` s.
+        """
+        manifestations = [_manifestation(), _manifestation()]
+        node_a = Node(
+            uuid=self.NODE_A_UUID,
+            manifestations={manifestation.dataset_id: manifestation
+                            for manifestation in manifestations}
+        )
+        d = self.persistence_service.save(Deployment(nodes={node_a}))
+        d.addCallback(lambda _: manifestations)
+        return d
+
+    def test_operations(self):
+        """
+        Each operation is applied in order and its resulting dataset
+        returned.  The configuration is updated with all of them.
+        """
+        new_dataset_id = unicode(uuid4())
+        created = {u"dataset_id": new_dataset_id, u"primary": self.NODE_A,
+                   u"metadata": {u"name": u"new"}, u"deleted": False}
+
+        def got_manifestations((moving, resizing)):
+            moved = {u"dataset_id": moving.dataset_id,
+                     u"primary": self.NODE_B, u"metadata": {},
+                     u"deleted": False}
+            resized = {u"dataset_id": resizing.dataset_id,
+                       u"primary": self.NODE_A, u"metadata": {},
+                       u"deleted": False, u"maximum_size": self.SIZE}
+            d = self.assertResult(
+                b"POST", b"/configuration/datasets/_bulk",
+                {u"operations": [
+                    {u"operation": u"create", u"primary": self.NODE_A,
+                     u"dataset_id": new_dataset_id,
+                     u"metadata": {u"name": u"new"}},
+                    {u"operation": u"move", u"dataset_id": moving.dataset_id,
+                     u"primary": self.NODE_B},
+                    {u"operation": u"resize",
+                     u"dataset_id": resizing.dataset_id,
+                     u"maximum_size": self.SIZE},
+                    {u"operation": u"delete", u"dataset_id": new_dataset_id},
+                ]},
+                OK,
+                {u"results": [
+                    {u"dataset": created},
+                    {u"dataset": moved},
+                    {u"dataset": resized},
+                    {u"dataset": dict(created, deleted=True)},
+                ]})
+            d.addCallback(lambda _: self.assertItemsEqual(
+                [dict(created, deleted=True), moved, resized],
+                datasets_from_deployment(self.persistence_service.get())))
+            return d
+        d = self._setup_manifestations()
+        d.addCallback(got_manifestations)
+        return d
+
+    def test_one_save(self):
+        """
+        The configuration is saved once for all the operations.
+        """
+        history = len(self.persistence_service.configuration_history())
+        d = self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"operation": u"create", u"primary": self.NODE_A},
+                {u"operation": u"create", u"primary": self.NODE_B},
+            ]},
+            OK)
+        d.addCallback(lambda _: self.assertEqual(
+            (history + 1, 2),
+            (len(self.persistence_service.configuration_history()),
+             len(list(datasets_from_deployment(
+                 self.persistence_service.get()))))))
+        return d
+
+    def test_errors(self):
+        """
+        Operations that are not possible are reported with the error they
+        would have had on their own, without preventing the other operations.
+        """
+        unknown_dataset_id = unicode(uuid4())
+
+        def got_manifestations((deleting, existing)):
+            d = self.assertResult(
+                b"POST", b"/configuration/datasets/_bulk",
+                {u"operations": [
+                    {u"operation": u"move", u"dataset_id": unknown_dataset_id,
+                     u"primary": self.NODE_B},
+                    {u"operation": u"create", u"primary": self.NODE_B,
+                     u"dataset_id": existing.dataset_id},
+                    {u"operation": u"delete",
+                     u"dataset_id": deleting.dataset_id},
+                    {u"operation": u"resize",
+                     u"dataset_id": deleting.dataset_id,
+                     u"maximum_size": None},
+                ]},
+                OK,
+                {u"results": [
+                    {u"error": {u"code": NOT_FOUND,
+                                u"description": u"Dataset not found."}},
+                    {u"error": {u"code": CONFLICT,
+                                u"description":
+                                u"The provided dataset_id is already in "
+                                u"use."}},
+                    {u"dataset": {u"dataset_id": deleting.dataset_id,
+                                  u"primary": self.NODE_A,
+                                  u"metadata": {}, u"deleted": True}},
+                    {u"error": {u"code": METHOD_NOT_ALLOWED,
+                                u"description":
+                                u"The dataset has been deleted."}},
+                ]})
+            return d
+        d = self._setup_manifestations()
+        d.addCallback(got_manifestations)
+        return d
+
+    def test_if_matches_success(self):
+        """
+        If an ``X-If-Configuration-Matches`` header is sent with a matching
+        tag, the operations succeed.
+        """
+        return self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"operation": u"create", u"primary": self.NODE_A}]},
+            OK,
+            additional_headers={IF_MATCHES_HEADER: [
+                self.persistence_service.configuration_hash()]})
+
+    def test_if_matches_failure(self):
+        """
+        If an ``X-If-Configuration-Matches`` header is sent with a
+        non-matching tag, none of the operations are applied.
+        """
+        deployment = self.persistence_service.get()
+        d = self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"operation": u"create", u"primary": self.NODE_A}]},
+            PRECONDITION_FAILED,
+            additional_headers={IF_MATCHES_HEADER: [b"willnotmatch"]})
+        d.addCallback(lambda _: self.assertEqual(
+            deployment, self.persistence_service.get()))
+        return d
+
+
+RealTestsBulkDatasets, MemoryTestsBulkDatasets = buildIntegrationTests(
+    BulkDatasetsTestsMixin, "BulkDatasets", _build_app)
+
+
 class GetDatasetConfigurationTestsMixin(APITestsMixin):
     """
     Tests for the dataset configuration retrieval endpoint at
@@ -2449,6 +2740,131 @@ class GetDatasetConfigurationTestsMixin(APITestsMixin):
                 [self.persistence_service.configuration_hash()]))
         return d
 
+    def test_entity_tag(self):
+        """
+        The response includes an ``ETag`` header with the configuration hash.
+        """
+        d = self.get_entity_tag(b"/configuration/datasets")
+        d.addCallback(
+            self.assertEqual,
+            [b'"%s"' % (self.persistence_service.configuration_hash(),)])
+        return d
+
+    def test_not_modified(self):
+        """
+        A request with an ``If-None-Match`` header matching the current
+        configuration gets a ``NOT_MODIFIED`` response.
+        """
+        return self.assertNotModified(b"/configuration/datasets")
+
+    def test_response_cached(self):
+        """
+        Repeated requests for an unchanged configuration are answered from the
+        response cache.
+        """
+        metric = u"rest.get_dataset_configuration.cache_hits"
+        hits = REST_API_METRICS.counter(metric)
+        d = self.assertResult(
+            b"GET", b"/configuration/datasets", None, OK, [])
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/datasets", None, OK, []))
+        d.addCallback(lambda _: self.assertEqual(
+            hits + 1, REST_API_METRICS.counter(metric)))
+        return d
+
+    def test_wait_for_change(self):
+        """
+        A request with a ``wait_for_change_since`` query argument matching the
+        current configuration is answered once the configuration changes.
+        """
+        dataset_id = unicode(uuid4())
+        manifestation = Manifestation(
+            dataset=Dataset(dataset_id=dataset_id), primary=True)
+        deployment = Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 manifestations={dataset_id: manifestation}),
+        })
+        return self.assertWaitsForChange(
+            b"/configuration/datasets", self.api.configuration_watchers,
+            lambda: self.persistence_service.save(deployment),
+            [{u"dataset_id": dataset_id, u"primary": self.NODE_A,
+              u"deleted": False, u"metadata": {}}])
+
+    def test_wait_for_change_timeout(self):
+        """
+        A request with a ``wait_for_change_since`` query argument matching the
+        current configuration is answered with the unchanged configuration
+        after ``WAIT_FOR_CHANGE_TIMEOUT`` seconds.
+        """
+        return self.assertWaitsForChange(
+            b"/configuration/datasets", self.api.configuration_watchers,
+            lambda: self.clock.advance(WAIT_FOR_CHANGE_TIMEOUT), [])
+
+    def test_wait_for_change_stale(self):
+        """
+        A request with a ``wait_for_change_since`` query argument not matching
+        the current configuration is answered immediately.
+        """
+        return self.assertResult(
+            b"GET", b"/configuration/datasets?wait_for_change_since=abc",
+            None, OK, [])
+
+    def test_get_dataset(self):
+        """
+        A dataset can be retrieved by its ``dataset_id``, including if it has
+        been deleted.
+        """
+        manifestation = _manifestation(
+            maximum_size=1024 * 1024 * 64, deleted=True,
+            metadata={u"name": u"x"})
+        other = _manifestation()
+        d = self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 manifestations={manifestation.dataset_id: manifestation}),
+            Node(uuid=self.NODE_B_UUID,
+                 manifestations={other.dataset_id: other}),
+        }))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET",
+            b"/configuration/datasets/%s" % (
+                manifestation.dataset_id.encode("ascii"),),
+            None, OK,
+            {u"dataset_id": manifestation.dataset_id,
+             u"primary": self.NODE_A, u"maximum_size": 1024 * 1024 * 64,
+             u"metadata": {u"name": u"x"}, u"deleted": True}))
+        return d
+
+    def test_get_unknown_dataset(self):
+        """
+        NOT_FOUND is returned if the requested dataset is not in the
+        configuration.
+        """
+        return self.assertResult(
+            b"GET", b"/configuration/datasets/%s" % (uuid4(),), None,
+            NOT_FOUND, {u"description": u"Dataset not found."})
+
+    def test_if_none_match_list(self):
+        """
+        A request with an ``If-None-Match`` header listing several tags, one
+        of them a weak version of the current tag, gets a ``NOT_MODIFIED``
+        response.
+        """
+        return self.assertResponseCode(
+            b"GET", b"/configuration/datasets", None, NOT_MODIFIED,
+            additional_headers={b"If-None-Match": [
+                b'"abc", W/"%s"' % (
+                    self.persistence_service.configuration_hash(),)]})
+
+    def test_configuration_changed(self):
+        """
+        A request with an ``If-None-Match`` header matching an earlier
+        configuration gets the full response.
+        """
+        return self.assertModified(
+            b"/configuration/datasets",
+            lambda: self.persistence_service.save(
+                Deployment(nodes={Node(uuid=self.NODE_A_UUID)})))
+
     def _dataset_test(self, deployment, expected):
         """
         Verify that when the control service has ``deployment``
@@ -2782,6 +3198,83 @@ class DatasetsStateTestsMixin(APITestsMixin):
             b"GET", b"/state/datasets", None, OK, response
         )
 
+    def test_not_modified(self):
+        """
+        A request with an ``If-None-Match`` header matching the current
+        cluster state gets a ``NOT_MODIFIED`` response.
+        """
+        return self.assertNotModified(b"/state/datasets")
+
+    def test_state_changed(self):
+        """
+        A request with an ``If-None-Match`` header matching an earlier
+        cluster state gets the full response.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        return self.assertModified(
+            b"/state/datasets",
+            lambda: self.cluster_state_service.apply_changes([
+                NonManifestDatasets(datasets={dataset.dataset_id: dataset})
+            ]))
+
+    def test_wait_for_change(self):
+        """
+        A request with a ``wait_for_change_since`` query argument matching the
+        current cluster state is answered once the cluster state changes.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        return self.assertWaitsForChange(
+            b"/state/datasets", self.api.state_watchers,
+            lambda: self.cluster_state_service.apply_changes([
+                NonManifestDatasets(datasets={dataset.dataset_id: dataset})
+            ]),
+            [{u"dataset_id": dataset.dataset_id}])
+
+    def test_get_manifest_dataset(self):
+        """
+        A manifest dataset can be retrieved by its ``dataset_id``.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()),
+                          maximum_size=1024 * 1024 * 64)
+        node_uuid = uuid4()
+        self.cluster_state_service.apply_changes([
+            NodeState(
+                hostname=u"192.0.2.101",
+                uuid=node_uuid,
+                manifestations={dataset.dataset_id: Manifestation(
+                    dataset=dataset, primary=True)},
+                paths={dataset.dataset_id: FilePath(b"/path/dataset")},
+                devices={},
+            )
+        ])
+        return self.assertResult(
+            b"GET", b"/state/datasets/%s" % (
+                dataset.dataset_id.encode("ascii"),), None, OK,
+            dict(dataset_id=dataset.dataset_id, primary=unicode(node_uuid),
+                 path=u"/path/dataset", maximum_size=1024 * 1024 * 64))
+
+    def test_get_nonmanifest_dataset(self):
+        """
+        A non-manifest dataset can be retrieved by its ``dataset_id``.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        self.cluster_state_service.apply_changes([
+            NonManifestDatasets(datasets={dataset.dataset_id: dataset})
+        ])
+        return self.assertResult(
+            b"GET", b"/state/datasets/%s" % (
+                dataset.dataset_id.encode("ascii"),), None, OK,
+            dict(dataset_id=dataset.dataset_id))
+
+    def test_get_unknown_dataset(self):
+        """
+        NOT_FOUND is returned if the requested dataset is not in the cluster
+        state.
+        """
+        return self.assertResult(
+            b"GET", b"/state/datasets/%s" % (uuid4(),), None, NOT_FOUND,
+            {u"description": u"Dataset not found."})
+
 RealTestsDatasetsStateAPI, MemoryTestsDatasetsStateAPI = buildIntegrationTests(
     DatasetsStateTestsMixin, "DatasetsStateAPI", _build_app)
 
@@ -3225,6 +3718,13 @@ class ContainerStateTestsMixin(APITestsMixin):
             b"GET", b"/state/containers", None, OK, response
         )
 
+    def test_not_modified(self):
+        """
+        A request with an ``If-None-Match`` header matching the current
+        cluster state gets a ``NOT_MODIFIED`` response.
+        """
+        return self.assertNotModified(b"/state/containers")
+
 RealTestsContainerStateAPI, MemoryTestsContainerStateAPI = (
     buildIntegrationTests(ContainerStateTestsMixin, "ContainerStateAPI",
                           _build_app))
@@ -3260,6 +3760,29 @@ class NodesStateTestsMixin(APITestsMixin):
              {u"host": hostname2, "uuid": unicode(uuid2)}],
         )
 
+    def test_get_node(self):
+        """
+        A node in the current cluster state can be retrieved by its UUID.
+        """
+        uuid1 = uuid4()
+        self.cluster_state_service.apply_changes(
+            [NodeState(uuid=uuid1, hostname=u"192.0.2.101"),
+             NodeState(uuid=uuid4(), hostname=u"192.0.2.102")])
+        return self.assertResult(
+            b"GET", b"/state/nodes/%s" % (uuid1,), None, OK,
+            {u"host": u"192.0.2.101", u"uuid": unicode(uuid1)},
+        )
+
+    def test_get_unknown_node(self):
+        """
+        NOT_FOUND is returned if the requested node is not in the current
+        cluster state.
+        """
+        return self.assertResult(
+            b"GET", b"/state/nodes/%s" % (uuid4(),), None, NOT_FOUND,
+            {u"description": u"Node not found."},
+        )
+
 
 RealTestsNodesStateAPI, MemoryTestsNodesStateAPI = (
     buildIntegrationTests(NodesStateTestsMixin, "NodesStateAPI",
@@ -3467,6 +3990,52 @@ class LeasesTestsMixin(APITestsMixin):
         ))
         return d
 
+    def test_get_expiring_not_cached(self):
+        """
+        GET ``/configuration/leases`` returns the time left until leases
+        expire at the time of the request, even if the leases are unchanged.
+        """
+        d = self.save_leases()
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"GET", b"/configuration/leases", None, OK))
+        d.addCallback(readBody)
+
+        def listed(_):
+            self.clock.advance(1)
+            return self.assertResultItems(
+                method=b"GET",
+                path=b"/configuration/leases",
+                request_body=None,
+                expected_code=OK,
+                expected_result=[
+                    dict(self.expected_lease1,
+                         expires=self.expected_lease1[u"expires"] - 1),
+                    self.expected_lease2],
+            )
+        d.addCallback(listed)
+        return d
+
+    def test_get_one(self):
+        """
+        GET ``/configuration/leases/<dataset_id>`` returns that lease.
+        """
+        d = self.save_leases()
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/leases/%s" % (self.dataset1,), None,
+            OK, self.expected_lease1))
+        return d
+
+    def test_get_one_unknown(self):
+        """
+        GET ``/configuration/leases/<dataset_id>`` for a dataset without a
+        lease returns a NOT_FOUND error.
+        """
+        d = self.save_leases()
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/leases/%s" % (self.dataset3,), None,
+            NOT_FOUND, {u"description": u"Lease not found."}))
+        return d
+
     def test_delete_existing(self):
         """
         DELETE ``/configuration/leases/<dataset_id>`` releases that lease.
@@ -0,0 +1,74 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._metrics``.
+"""
+
+from ...testtools import TestCase
+from .._metrics import MetricsRegistry
+
+
+class MetricsRegistryTests(TestCase):
+    """
+    Tests for ``MetricsRegistry``.
+    """
+    def setUp(self):
+        super(MetricsRegistryTests, self).setUp()
+        self.metrics = MetricsRegistry()
+
+    def test_counter(self):
+        """
+        ``MetricsRegistry.counter`` returns the sum of the amounts a counter
+        was incremented by.
+        """
+        self.metrics.increment(u"a")
+        self.metrics.increment(u"a", 3)
+        self.assertEqual(4, self.metrics.counter(u"a"))
+
+    def test_unknown_counter(self):
+        """
+        A counter that was never incremented is zero.
+        """
+        self.assertEqual(0, self.metrics.counter(u"a"))
+
+    def test_distribution(self):
+        """
+        ``MetricsRegistry.distribution`` returns the number, total, minimum
+        and maximum of the values recorded.
+        """
+        for value in [3, 1, 2]:
+            self.metrics.record(u"a", value)
+        self.assertEqual(
+            dict(count=3, total=6, minimum=1, maximum=3),
+            self.metrics.distribution(u"a"))
+
+    def test_unknown_distribution(self):
+        """
+        A distribution with no values recorded has a count of zero and no
+        minimum or maximum.
+        """
+        self.assertEqual(
+            dict(count=0, total=0, minimum=None, maximum=None),
+            self.metrics.distribution(u"a"))
+
+    def test_snapshot(self):
+        """
+        ``MetricsRegistry.snapshot`` returns the counters and distributions
+        whose names start with the given prefix.
+        """
+        self.metrics.increment(u"a.count")
+        self.metrics.record(u"a.size", 5)
+        self.metrics.increment(u"b.count")
+        self.assertEqual(
+            {u"a.count": 1,
+             u"a.size": dict(count=1, total=5, minimum=5, maximum=5)},
+            self.metrics.snapshot(u"a."))
+
+    def test_clear(self):
+        """
+        ``MetricsRegistry.clear`` forgets all the metrics.
+        """
+        self.metrics.increment(u"a")
+        self.metrics.record(u"b", 1)
+        self.metrics.clear()
+        self.assertEqual({}, self.metrics.snapshot())
@@ -10,7 +10,7 @@ from uuid import uuid4, UUID
 
 from pyrsistent import (
     InvariantException, pset, PClass, PSet, pmap, PMap, thaw, PVector,
-    pvector, PRecord
+    pvector, PRecord, discard
 )
 
 from testtools.matchers import Equals, IsInstance
@@ -23,7 +23,10 @@ from hypothesis.strategies import sampled_from
 from zope.interface.verify import verifyObject
 
 from ...testtools import make_with_init_tests, TestCase
-from .._model import pset_field, pmap_field, pvector_field, ip_to_uuid
+from .._model import (
+    pset_field, pmap_field, pvector_field, ip_to_uuid, node_view,
+)
+from ..testtools import related_deployments_strategy
 
 from .. import (
     IClusterStateChange, IClusterStateWipe,
@@ -769,6 +772,83 @@ class DeploymentTests(TestCase):
         updated = original.move_application(application, nodes[0])
         self.assertEqual(original, updated)
 
+    def test_nodes_with_manifestation(self):
+        """
+        ``Deployment.nodes_with_manifestation`` returns the nodes with a
+        manifestation of the given dataset.
+        """
+        manifestation = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4())), primary=True)
+        node = Node(uuid=uuid4(), manifestations={
+            manifestation.dataset_id: manifestation})
+        deployment = Deployment(nodes=[node, Node(uuid=uuid4())])
+        self.assertEqual(
+            ([node], []),
+            (deployment.nodes_with_manifestation(manifestation.dataset_id),
+             deployment.nodes_with_manifestation(unicode(uuid4()))))
+
+    def test_nodes_with_manifestation_updated(self):
+        """
+        ``Deployment.nodes_with_manifestation`` reflects manifestations
+        added, moved and removed by ``update_node`` and ``transform``.
+        """
+        manifestation = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4())), primary=True)
+        dataset_id = manifestation.dataset_id
+        first, second = Node(uuid=uuid4()), Node(uuid=uuid4())
+        empty = Deployment(nodes=[first, second])
+        added = empty.update_node(first.transform(
+            ["manifestations", dataset_id], manifestation))
+        moved = added.update_node(second.transform(
+            ["manifestations", dataset_id], manifestation)).transform(
+                ["nodes", first.uuid, "manifestations", dataset_id], discard)
+        removed = moved.transform(["nodes", second.uuid], discard)
+        self.assertEqual(
+            [[], [first.uuid], [second.uuid], []],
+            [[node.uuid for node in deployment.nodes_with_manifestation(
+                dataset_id)]
+             for deployment in [empty, added, moved, removed]])
+
+    def test_nodes_with_application(self):
+        """
+        ``Deployment.nodes_with_application`` returns the nodes with an
+        application of the given name, following ``update_node``.
+        """
+        application = Application(
+            name=u"mycontainer", image=DockerImage.from_string(u"busybox"))
+        node = Node(uuid=uuid4())
+        deployment = Deployment(nodes=[node])
+        updated = deployment.update_node(node.transform(
+            ["applications", application.name], application))
+        self.assertEqual(
+            ([], [updated.nodes[node.uuid]]),
+            (deployment.nodes_with_application(application.name),
+             updated.nodes_with_application(application.name)))
+
+    @given(related_deployments_strategy(4))
+    def test_nodes_with_matches_scan(self, deployments):
+        """
+        ``Deployment.nodes_with_manifestation`` and
+        ``Deployment.nodes_with_application`` agree with looking at every
+        node, for a sequence of related deployments.
+        """
+        for deployment in deployments:
+            nodes = deployment.nodes.values()
+            self.assertEqual(
+                ({dataset_id: {node.uuid for node in nodes
+                               if dataset_id in node.manifestations}
+                  for node in nodes for dataset_id in node.manifestations},
+                 {name: {node.uuid for node in nodes
+                         if name in node.applications}
+                  for node in nodes for name in node.applications}),
+                ({dataset_id: {node.uuid for node in
+                               deployment.nodes_with_manifestation(
+                                   dataset_id)}
+                  for node in nodes for dataset_id in node.manifestations},
+                 {name: {node.uuid for node in
+                         deployment.nodes_with_application(name)}
+                  for node in nodes for name in node.applications}))
+
 
 class RestartOnFailureTests(TestCase):
     """
@@ -1423,6 +1503,105 @@ class DeploymentStateTests(TestCase):
             nodes=[NodeState(hostname=u"1.2.2.4", uuid=uuid4())])
         self.assertEqual(original, original.remove_node(uuid4()))
 
+    def test_nodes_with_manifestation(self):
+        """
+        ``DeploymentState.nodes_with_manifestation`` returns the nodes with a
+        manifestation of the given dataset, following ``update_node`` and
+        ignoring nodes whose manifestations are unknown.
+        """
+        manifestation = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4())), primary=True)
+        node = NodeState(hostname=u"1.2.2.4", uuid=uuid4())
+        unknown = NodeState(hostname=u"1.2.2.5", uuid=uuid4())
+        state = DeploymentState(nodes=[node, unknown])
+        updated = state.update_node(NodeState(
+            hostname=node.hostname, uuid=node.uuid,
+            manifestations={manifestation.dataset_id: manifestation},
+            devices={}, paths={}))
+        self.assertEqual(
+            ([], [updated.nodes[node.uuid]]),
+            (state.nodes_with_manifestation(manifestation.dataset_id),
+             updated.nodes_with_manifestation(manifestation.dataset_id)))
+
+
+class NodeViewTests(TestCase):
+    """
+    Tests for ``node_view``.
+    """
+    def setUp(self):
+        super(NodeViewTests, self).setUp()
+        self.wanted = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4())), primary=True)
+        self.unrelated = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4())), primary=True)
+        self.node = Node(
+            uuid=uuid4(),
+            manifestations={self.wanted.dataset_id: self.wanted})
+        self.other = Node(
+            uuid=uuid4(),
+            manifestations={self.unrelated.dataset_id: self.unrelated})
+        self.configuration = Deployment(
+            nodes={self.node, self.other},
+            leases=Leases().acquire(
+                datetime.datetime.now(), UUID(self.wanted.dataset_id),
+                self.node.uuid),
+        )
+
+    def test_configuration(self):
+        """
+        The configuration view has only the node's own configuration, and
+        all of the leases and persistent state.
+        """
+        view, _ = node_view(
+            self.configuration, DeploymentState(), self.node.uuid)
+        self.assertEqual(
+            self.configuration.set(nodes={self.node.uuid: self.node}), view)
+
+    def test_unknown_node(self):
+        """
+        The views for a node with no configuration or state have no nodes.
+        """
+        self.assertEqual(
+            (Deployment(leases=self.configuration.leases), DeploymentState()),
+            node_view(self.configuration, DeploymentState(), uuid4()))
+
+    def test_state(self):
+        """
+        The state view has the node's own state and era, the non-manifest
+        datasets, and only those manifestations on other nodes of datasets
+        configured on the node.
+        """
+        own = NodeState(
+            hostname=u"10.0.0.1", uuid=self.node.uuid, applications={},
+            manifestations={}, paths={}, devices={})
+        path = FilePath(b"/flocker").child(self.wanted.dataset_id)
+        elsewhere = NodeState(
+            hostname=u"10.0.0.2", uuid=self.other.uuid, applications={},
+            manifestations={self.wanted.dataset_id: self.wanted,
+                            self.unrelated.dataset_id: self.unrelated},
+            paths={self.wanted.dataset_id: path,
+                   self.unrelated.dataset_id: path},
+            devices={})
+        nonmanifest = {self.unrelated.dataset_id: self.unrelated.dataset}
+        era = uuid4()
+        state = DeploymentState(
+            nodes={own, elsewhere},
+            node_uuid_to_era={own.uuid: era, elsewhere.uuid: uuid4()},
+            nonmanifest_datasets=nonmanifest,
+        )
+        _, view = node_view(self.configuration, state, self.node.uuid)
+        self.assertEqual(
+            DeploymentState(
+                nodes={own, NodeState(
+                    hostname=elsewhere.hostname, uuid=elsewhere.uuid,
+                    manifestations={self.wanted.dataset_id: self.wanted},
+                    paths={self.wanted.dataset_id: path},
+                    devices={})},
+                node_uuid_to_era={own.uuid: era},
+                nonmanifest_datasets=nonmanifest,
+            ),
+            view)
+
 
 class SameNodeTests(TestCase):
     """
@@ -3,10 +3,13 @@
 """
 Tests for ``flocker.control._persistence``.
 """
+import errno
 import json
+import os
 import string
 
 from datetime import datetime, timedelta
+from functools import partial
 from uuid import uuid4, UUID
 
 from pytz import UTC
@@ -21,12 +24,17 @@ from hypothesis.extra.datetime import datetimes
 from twisted.internet import reactor
 from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
 
 from pyrsistent import PClass, pset
 
 from testtools.matchers import Is, Equals, Not
 
-from ..testtools import deployment_strategy
+from ..testtools import (
+    deployment_strategy, related_deployments_strategy,
+    make_iconfigurationstore_tests,
+)
 
 from ...testtools import AsyncTestCase, TestCase
 from .._persistence import (
@@ -34,8 +42,12 @@ from .._persistence import (
     _LOG_SAVE, _LOG_STARTUP, migrate_configuration,
     _CONFIG_VERSION, ConfigurationMigration, ConfigurationMigrationError,
     _LOG_UPGRADE, MissingMigrationError, update_leases, _LOG_EXPIRE,
-    _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED, to_unserialized_json, generation_hash
+    _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED, to_unserialized_json, generation_hash,
+    _LOG_JOURNAL_TRUNCATED, make_generation_hash, WIRE_ENCODING_COMPACT,
+    WIRE_ENCODING_JSON, update_generation_hash, FileConfigurationStore,
     )
+from .._compact import COMPACT_MAGIC
+from .._diffing import create_diff
 from .._model import (
     Deployment, Application, DockerImage, Node, Dataset, Manifestation,
     AttachedVolume, SERIALIZABLE_CLASSES, NodeState, Configuration,
@@ -199,6 +211,97 @@ class LeasesTests(AsyncTestCase):
         d.addCallback(saved)
         return d
 
+    def acquire(self, expirations, leases=None):
+        """
+        Save leases on new datasets.
+
+        :param expirations: The number of seconds from now each lease expires
+            in.
+        :param Leases leases: The leases to add to, by default those in the
+            configuration.
+
+        :return: The new ``Leases``.
+        """
+        if leases is None:
+            leases = self.persistence_service.get().leases
+        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
+        for expires in expirations:
+            leases = leases.acquire(now, uuid4(), uuid4(), expires)
+        self.successResultOf(self.persistence_service.save(
+            self.persistence_service.get().set(leases=leases)))
+        return leases
+
+    def test_one_delayed_call(self):
+        """
+        A single delayed call is scheduled however many leases there are.
+        """
+        self.acquire(range(10, 1010))
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+
+    def test_no_leases_no_delayed_call(self):
+        """
+        No delayed call is scheduled if no lease expires.
+        """
+        self.acquire([None])
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_expired_together(self):
+        """
+        Leases expiring within the same second are removed by a single save.
+        """
+        self.clock.advance(0.5)
+        leases = self.acquire([None])
+        self.acquire([10, 10.1, 10.2, 10.3], leases)
+        saves = self.persistence_service.saves_requested
+        self.clock.advance(11)
+        self.assertEqual(
+            (leases, saves + 1),
+            (self.persistence_service.get().leases,
+             self.persistence_service.saves_requested))
+
+    def test_renewed_lease_not_expired(self):
+        """
+        A lease renewed before it expires is not removed at its original
+        expiration time.
+        """
+        leases = self.acquire([10])
+        [(dataset_id, lease)] = leases.items()
+        self.clock.advance(5)
+        renewed = self.acquire([], leases.acquire(
+            datetime.fromtimestamp(self.clock.seconds(), UTC),
+            dataset_id, lease.node_id, 100))
+        self.clock.advance(10)
+        self.assertEqual(renewed, self.persistence_service.get().leases)
+
+    def test_changed_leases_pushed(self):
+        """
+        Leases acquired or renewed by a save are pushed onto the heap without
+        it being rebuilt from every lease.
+        """
+        leases = self.acquire(range(10, 110))
+        [lease_service] = list(self.persistence_service)
+        rebuilds = []
+        self.patch(lease_service, "_rebuild", lambda: rebuilds.append(None))
+        dataset_id, lease = next(leases.iteritems())
+        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
+        self.acquire([5], leases.acquire(now, dataset_id, lease.node_id, 200))
+        self.assertEqual(
+            ([], 102, 5),
+            (rebuilds, len(lease_service._heap),
+             lease_service._heap[0][0] - self.clock.seconds()))
+
+    def test_released_lease_no_save(self):
+        """
+        A lease released before it expires causes no save when it would have
+        expired.
+        """
+        leases = self.acquire([10])
+        [(dataset_id, lease)] = leases.items()
+        self.acquire([], leases.release(dataset_id, lease.node_id))
+        saves = self.persistence_service.saves_requested
+        self.clock.advance(20)
+        self.assertEqual(saves, self.persistence_service.saves_requested)
+
 
 class ConfigurationPersistenceServiceTests(AsyncTestCase):
     """
@@ -216,6 +319,7 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         service = ConfigurationPersistenceService(reactor, path)
         if logger is not None:
             self.patch(service, "logger", logger)
+            self.patch(service._store, "logger", logger)
         service.startService()
         self.addCleanup(service.stopService)
         return service
@@ -499,6 +603,474 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         return d
 
 
+class ConfigurationJournalTests(AsyncTestCase):
+    """
+    Tests for the journal of configuration changes written by
+    ``ConfigurationPersistenceService``.
+    """
+    def setUp(self):
+        super(ConfigurationJournalTests, self).setUp()
+        self.path = FilePath(self.mktemp())
+
+    @property
+    def config_path(self):
+        return self.path.child(b"current_configuration.json")
+
+    @property
+    def journal_path(self):
+        return self.path.child(b"current_configuration.journal")
+
+    def service(self, logger=None, stop=True, **kwargs):
+        """
+        Start a service.
+
+        :param logger: Optional eliot ``Logger`` to set before startup.
+        :param bool stop: Whether to schedule the service to be stopped at
+            the end of the test.
+        :param kwargs: Additional arguments for
+            ``ConfigurationPersistenceService``.
+
+        :return: Started ``ConfigurationPersistenceService``.
+        """
+        service = ConfigurationPersistenceService(reactor, self.path, **kwargs)
+        if logger is not None:
+            self.patch(service, "logger", logger)
+            self.patch(service._store, "logger", logger)
+        service.startService()
+        if stop:
+            self.addCleanup(service.stopService)
+        return service
+
+    def deployments(self, count):
+        """
+        :param int count: The number of deployments to create.
+
+        :return: A ``list`` of ``count`` distinct ``Deployment`` instances,
+            each differing from the previous by one additional node.
+        """
+        result = []
+        deployment = LATEST_TEST_DEPLOYMENT
+        for i in range(count):
+            uuid = uuid4()
+            deployment = deployment.transform(("nodes", uuid), Node(uuid=uuid))
+            result.append(deployment)
+        return result
+
+    def test_save_appends_to_journal(self):
+        """
+        Saving a configuration appends an entry to the journal and leaves the
+        snapshot untouched.
+        """
+        service = self.service()
+        snapshot = self.config_path.getContent()
+        self.successResultOf(service.save(LATEST_TEST_DEPLOYMENT))
+        self.assertEqual(
+            (snapshot, 1),
+            (self.config_path.getContent(),
+             len(self.journal_path.getContent().splitlines())),
+        )
+
+    def test_journal_replayed_on_startup(self):
+        """
+        A new service applies the journal to the snapshot, and then compacts
+        the journal into a new snapshot.
+        """
+        service = self.service(stop=False)
+        deployments = self.deployments(3)
+        for deployment in deployments:
+            self.successResultOf(service.save(deployment))
+        service.stopService()
+
+        new_service = self.service()
+        self.assertEqual(
+            (deployments[-1], deployments[-1], False),
+            (new_service.get(),
+             wire_decode(self.config_path.getContent()).deployment,
+             self.journal_path.exists()),
+        )
+
+    def test_compaction(self):
+        """
+        Once the journal reaches the compaction threshold it is folded into a
+        new snapshot.
+        """
+        service = self.service(compaction_threshold=2)
+        deployments = self.deployments(2)
+        self.successResultOf(service.save(deployments[0]))
+        self.assertTrue(self.journal_path.exists())
+        self.successResultOf(service.save(deployments[1]))
+        self.assertEqual(
+            (deployments[1], False),
+            (wire_decode(self.config_path.getContent()).deployment,
+             self.journal_path.exists()),
+        )
+
+    @validate_logging(assertHasMessage, _LOG_JOURNAL_TRUNCATED,
+                      fields=dict(entries=1))
+    def test_torn_final_entry_ignored(self, logger):
+        """
+        An incomplete final journal entry, as left by a crash during a save,
+        is ignored when the journal is replayed.
+        """
+        service = self.service(stop=False)
+        deployments = self.deployments(2)
+        for deployment in deployments:
+            self.successResultOf(service.save(deployment))
+        service.stopService()
+        content = self.journal_path.getContent()
+        self.journal_path.setContent(content[:-10])
+
+        new_service = self.service(logger)
+        self.assertEqual(deployments[0], new_service.get())
+
+    def test_failed_append_truncated(self):
+        """
+        If appending to the journal fails part of the way through, the partial
+        entry is removed so later entries can still be replayed.
+        """
+        service = self.service(stop=False)
+        deployments = self.deployments(1)
+        real_fsync = os.fsync
+        failures = []
+
+        def fsync(fd):
+            if not failures:
+                # Only part of the entry made it to disk:
+                failures.append(fd)
+                os.ftruncate(fd, os.fstat(fd).st_size - 10)
+                raise OSError(errno.EIO, "I/O error")
+            return real_fsync(fd)
+        self.patch(os, "fsync", fsync)
+        self.failureResultOf(service.save(deployments[0]), OSError)
+        self.successResultOf(service.save(deployments[0]))
+        service.stopService()
+
+        new_service = self.service()
+        self.assertEqual(deployments[0], new_service.get())
+
+    def test_stale_entries_skipped(self):
+        """
+        Journal entries that were already folded into the snapshot, as
+        happens when a compaction is interrupted before the journal is
+        removed, are not applied again.
+        """
+        service = self.service(stop=False, compaction_threshold=3)
+        deployments = self.deployments(2)
+        for deployment in deployments:
+            self.successResultOf(service.save(deployment))
+        journal = self.journal_path.getContent()
+        removed = deployments[-1].transform(
+            ["nodes"], lambda nodes: nodes.remove(next(iter(nodes))))
+        self.successResultOf(service.save(removed))
+        service.stopService()
+        self.journal_path.setContent(journal)
+
+        new_service = self.service()
+        self.assertEqual(removed, new_service.get())
+
+    def test_compact_snapshot(self):
+        """
+        A service configured with the compact encoding writes snapshots in
+        it, and they can be loaded again.
+        """
+        service = self.service(
+            stop=False, compaction_threshold=1, encoding=WIRE_ENCODING_COMPACT)
+        [deployment] = self.deployments(1)
+        self.successResultOf(service.save(deployment))
+        service.stopService()
+        snapshot = self.config_path.getContent()
+
+        new_service = self.service()
+        self.assertEqual(
+            (wire_encode(
+                Configuration(version=_CONFIG_VERSION, deployment=deployment),
+                WIRE_ENCODING_COMPACT),
+             deployment),
+            (snapshot, new_service.get()),
+        )
+
+    def test_change_snapshot_encoding(self):
+        """
+        A JSON snapshot can be loaded by a service configured with the
+        compact encoding, which rewrites it compactly.
+        """
+        service = self.service(stop=False, compaction_threshold=1)
+        [deployment] = self.deployments(1)
+        self.successResultOf(service.save(deployment))
+        service.stopService()
+
+        new_service = self.service(encoding=WIRE_ENCODING_COMPACT)
+        # The encoding follows the iteration order of maps, which can differ
+        # between equal maps, so compare the decoded snapshot:
+        content = self.config_path.getContent()
+        self.assertEqual(
+            (deployment, True,
+             Configuration(version=_CONFIG_VERSION, deployment=deployment)),
+            (new_service.get(), content.startswith(COMPACT_MAGIC),
+             wire_decode(content)),
+        )
+
+    def assert_history_leads_to_latest(self, service, deployments):
+        """
+        Assert that ``configuration_history`` has an entry for each of the
+        given deployments, and that applying the diffs from each one gives
+        the current configuration.
+
+        :param service: The ``ConfigurationPersistenceService`` to check.
+        :param list deployments: The expected deployments, oldest first.
+        """
+        history = service.configuration_history()
+        self.assertEqual(
+            ([make_generation_hash(d) for d in deployments],
+             [service.get()] * len(deployments)),
+            ([generation for generation, _ in history],
+             [reduce(lambda d, entry: entry[1].apply(d), history[i:], d)
+              for i, d in enumerate(deployments)]),
+        )
+
+    def test_history(self):
+        """
+        ``configuration_history`` returns the hashes of earlier
+        configurations along with the diffs from each to the next.
+        """
+        service = self.service()
+        deployments = self.deployments(3)
+        for deployment in deployments:
+            self.successResultOf(service.save(deployment))
+        self.assert_history_leads_to_latest(
+            service, [Deployment()] + deployments[:-1])
+
+    def test_history_size(self):
+        """
+        Only the most recent ``history_size`` changes are kept in the
+        history.
+        """
+        service = self.service(history_size=2)
+        deployments = self.deployments(3)
+        for deployment in deployments:
+            self.successResultOf(service.save(deployment))
+        self.assert_history_leads_to_latest(service, deployments[:-1])
+
+    def test_history_survives_restart(self):
+        """
+        The history is still available after restarting, both from changes
+        replayed from the journal and from ones written by an earlier
+        compaction.
+        """
+        service = self.service(stop=False, compaction_threshold=2)
+        deployments = self.deployments(3)
+        for deployment in deployments:
+            self.successResultOf(service.save(deployment))
+        service.stopService()
+
+        new_service = self.service(compaction_threshold=2)
+        self.assert_history_leads_to_latest(
+            new_service, [Deployment()] + deployments[:-1])
+
+    def test_stale_history_ignored(self):
+        """
+        History written for a different configuration than the snapshot, as
+        happens when the snapshot write of a compaction is interrupted, is
+        ignored.
+        """
+        service = self.service(stop=False, compaction_threshold=1)
+        deployments = self.deployments(2)
+        self.successResultOf(service.save(deployments[0]))
+        snapshot = self.config_path.getContent()
+        self.successResultOf(service.save(deployments[1]))
+        service.stopService()
+        self.config_path.setContent(snapshot)
+
+        new_service = self.service()
+        self.assertEqual(
+            (deployments[0], []),
+            (new_service.get(), new_service.configuration_history()),
+        )
+
+
+class _ManualThreadPool(object):
+    """
+    A thread pool stand-in that runs work only when told to.
+
+    :ivar list pending: Calls which have been submitted but not yet run.
+    """
+    def __init__(self):
+        self.pending = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def callInThreadWithCallback(self, on_result, f, *args, **kwargs):
+        self.pending.append((on_result, f, args, kwargs))
+
+    def run(self):
+        """
+        Run the oldest pending call.
+        """
+        on_result, f, args, kwargs = self.pending.pop(0)
+        try:
+            result = f(*args, **kwargs)
+        except:
+            on_result(False, Failure())
+        else:
+            on_result(True, result)
+
+
+class _ThreadlessClock(Clock):
+    """
+    A ``Clock`` that supports ``callFromThread`` by calling immediately.
+    """
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+class GroupCommitTests(AsyncTestCase):
+    """
+    Tests for writing saves of ``ConfigurationPersistenceService`` in a thread
+    pool.
+    """
+    def setUp(self):
+        super(GroupCommitTests, self).setUp()
+        self.path = FilePath(self.mktemp())
+        self.threadpool = _ManualThreadPool()
+        self.service = ConfigurationPersistenceService(
+            _ThreadlessClock(), self.path, threadpool=self.threadpool,
+        )
+        self.service.startService()
+        self.deployments = []
+        deployment = LATEST_TEST_DEPLOYMENT
+        for i in range(3):
+            uuid = uuid4()
+            deployment = deployment.transform(("nodes", uuid), Node(uuid=uuid))
+            self.deployments.append(deployment)
+
+    def test_saves_coalesced(self):
+        """
+        Saves requested while a write is in progress are written together by
+        a single subsequent write, and each save's ``Deferred`` fires only
+        once the write including it is finished.
+        """
+        first = self.service.save(self.deployments[0])
+        second = self.service.save(self.deployments[1])
+        third = self.service.save(self.deployments[2])
+        self.assertEqual(
+            (1, False, False),
+            (len(self.threadpool.pending), first.called, second.called),
+        )
+        self.threadpool.run()
+        self.assertEqual(
+            (True, False, False),
+            (first.called, second.called, third.called),
+        )
+        self.threadpool.run()
+        self.successResultOf(second)
+        self.successResultOf(third)
+        self.assertEqual(
+            (3, 2, 2),
+            (self.service.saves_requested, self.service.writes_performed,
+             len(self.path.child(
+                 b"current_configuration.journal").getContent().splitlines())),
+        )
+
+    def test_get_before_durable(self):
+        """
+        ``get`` returns a newly saved configuration even before it has been
+        written.
+        """
+        self.service.save(self.deployments[0])
+        self.assertEqual(self.deployments[0], self.service.get())
+
+    def test_callbacks_after_durable(self):
+        """
+        Change callbacks are called once the new configuration has been
+        written, not when it is saved.
+        """
+        callbacks = []
+        self.service.register(lambda: callbacks.append(self.service.get()))
+        self.service.save(self.deployments[0])
+        before = list(callbacks)
+        self.threadpool.run()
+        self.assertEqual(([], [self.deployments[0]]), (before, callbacks))
+
+    def test_unchanged_save_waits(self):
+        """
+        Saving an unchanged configuration while it is still being written
+        returns a ``Deferred`` that fires once that write is finished.
+        """
+        self.service.save(self.deployments[0])
+        d = self.service.save(self.deployments[0])
+        self.assertNoResult(d)
+        self.threadpool.run()
+        self.successResultOf(d)
+
+    def test_failed_write(self):
+        """
+        If writing a save fails its ``Deferred`` fails, ``get`` returns the
+        configuration last written, and saving the same configuration again
+        writes it.
+        """
+        store = self.service._store
+        original_save = store.save
+        saves = []
+
+        def save(*args):
+            saves.append(args)
+            if len(saves) == 1:
+                raise IOError("disk full")
+            return original_save(*args)
+        self.patch(store, "save", save)
+        written = self.service.get()
+        first = self.service.save(self.deployments[0])
+        self.threadpool.run()
+        self.failureResultOf(first, IOError)
+        self.assertEqual(written, self.service.get())
+        second = self.service.save(self.deployments[0])
+        self.threadpool.run()
+        self.successResultOf(second)
+        self.service.stopService()
+        new_service = ConfigurationPersistenceService(
+            _ThreadlessClock(), self.path)
+        new_service.startService()
+        self.addCleanup(new_service.stopService)
+        self.assertEqual(
+            (2, self.deployments[0]), (len(saves), new_service.get()))
+
+    def test_stop_writes_outstanding(self):
+        """
+        Stopping the service waits for outstanding saves to be written.
+        """
+        self.service.save(self.deployments[0])
+        stopping = self.service.stopService()
+        self.assertNoResult(stopping)
+        self.threadpool.run()
+        self.successResultOf(stopping)
+
+    def test_real_threadpool(self):
+        """
+        Configuration saved in a real thread pool can be loaded by a new
+        service.
+        """
+        self.service.stopService()
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(
+            reactor, path, threadpool=ThreadPool(minthreads=1, maxthreads=1),
+        )
+        service.startService()
+        d = service.save(self.deployments[0])
+        d.addCallback(lambda _: service.stopService())
+
+        def stopped(_):
+            new_service = ConfigurationPersistenceService(reactor, path)
+            new_service.startService()
+            self.addCleanup(new_service.stopService)
+            self.assertEqual(self.deployments[0], new_service.get())
+        d.addCallback(stopped)
+        return d
+
+
 class StubMigration(object):
     """
     A simple stub migration class, used to test ``migrate_configuration``.
@@ -767,6 +1339,33 @@ class WireEncodeDecodeTests(TestCase):
         """
         self.assertRaises(ValueError, wire_encode, datetime.now())
 
+    @given(DEPLOYMENTS)
+    def test_compact_roundtrip(self, deployment):
+        """
+        ``wire_decode`` decodes objects encoded by ``wire_encode`` using the
+        compact encoding.
+        """
+        self.assertEqual(
+            deployment,
+            wire_decode(wire_encode(deployment, WIRE_ENCODING_COMPACT)),
+        )
+
+    def test_json_by_default(self):
+        """
+        ``wire_encode`` uses JSON unless told otherwise.
+        """
+        self.assertEqual(
+            wire_encode(LATEST_TEST_DEPLOYMENT, WIRE_ENCODING_JSON),
+            wire_encode(LATEST_TEST_DEPLOYMENT),
+        )
+
+    def test_unknown_encoding(self):
+        """
+        ``wire_encode`` raises ``ValueError`` if given an unknown encoding.
+        """
+        self.assertRaises(
+            ValueError, wire_encode, LATEST_TEST_DEPLOYMENT, u"unknown")
+
 
 class ConfigurationMigrationTests(TestCase):
     """
@@ -973,3 +1572,72 @@ class GenerationHashTests(TestCase):
             generation_hash(TEST_DEPLOYMENT_2),
             Equals(TEST_DEPLOYMENT_2_HASH)
         )
+
+
+class UpdateGenerationHashTests(TestCase):
+    """
+    Tests for ``update_generation_hash``.
+    """
+    def assert_updated_hash(self, previous, latest):
+        """
+        ``update_generation_hash`` gives the same hash for ``latest`` as
+        ``generation_hash`` does.
+        """
+        expected = generation_hash(latest)
+        # Use an equal but distinct object, so neither cached hashes of
+        # ``latest`` nor of its parts can mask the computation:
+        latest = wire_decode(wire_encode(latest))
+        diff = create_diff(previous, latest)
+        self.assertThat(
+            update_generation_hash(previous, diff, latest),
+            Equals(expected)
+        )
+
+    @given(related_deployments_strategy(2))
+    def test_related_deployments(self, deployments):
+        """
+        The hash of a configuration can be computed from the hash of a
+        related configuration and the diff between them.
+        """
+        previous, latest = deployments
+        self.assert_updated_hash(previous, latest)
+
+    def test_set_items(self):
+        """
+        Items added to and removed from a set are accounted for.
+        """
+        with_port = TEST_DEPLOYMENT_1.transform(
+            ["nodes", NODE_UUID, "applications", u"myapp", "ports"],
+            lambda ports: ports.add(Port(internal_port=80,
+                                         external_port=8080)),
+        )
+        self.assert_updated_hash(TEST_DEPLOYMENT_1, with_port)
+        self.assert_updated_hash(with_port, TEST_DEPLOYMENT_1)
+
+    def test_removed_keys(self):
+        """
+        Keys removed from a mapping are accounted for.
+        """
+        self.assert_updated_hash(
+            TEST_DEPLOYMENT_1,
+            TEST_DEPLOYMENT_1.transform(["nodes"], lambda n: n.remove(
+                NODE_UUID)),
+        )
+
+    def test_replaced(self):
+        """
+        A ``Diff`` that replaces the whole object gives the hash of the new
+        object.
+        """
+        self.assert_updated_hash(
+            NodeState(hostname=u"192.0.2.1"), TEST_DEPLOYMENT_2)
+
+
+class FileConfigurationStoreInterfaceTests(
+        make_iconfigurationstore_tests(
+            lambda test: partial(
+                FileConfigurationStore, FilePath(test.mktemp())))
+):
+    """
+    ``IConfigurationStore`` tests for ``FileConfigurationStore``.
+    """
@@ -21,7 +21,7 @@ from twisted.internet.error import ConnectionDone
 from twisted.test.iosim import connectedServerAndClient
 from twisted.protocols.amp import (
     MAX_VALUE_LENGTH, IArgumentType, Command, String, ListOf, Integer,
-    CommandLocator, AMP, parseString,
+    CommandLocator, AMP, AmpBox, parseString,
 )
 from twisted.python.failure import Failure
 from twisted.internet.error import ConnectionLost
@@ -41,17 +41,27 @@ from ...testtools.amp import (
 from .._protocol import (
     PING_INTERVAL, Big, SerializableArgument,
     VersionCommand, ClusterStatusCommand, ClusterStatusDiffCommand,
-    NodeStateCommand, IConvergenceAgent, NoOp, AgentAMP, ControlAMP,
+    NodeStateCommand, NodeStateDiffCommand, IConvergenceAgent, NoOp,
+    AgentAMP, ControlAMP,
     _AgentLocator, ControlServiceLocator, LOG_SEND_CLUSTER_STATE,
     LOG_SEND_TO_AGENT, AGENT_CONNECTED, caching_wire_encode, SetNodeEraCommand,
-    timeout_for_protocol, CONTROL_SERVICE_BATCHING_DELAY
+    timeout_for_protocol, CONTROL_SERVICE_BATCHING_DELAY,
+    CONTROL_SERVICE_MINIMUM_BATCHING_DELAY, _BatchingWindow, _box_size,
+    WIRE_COMPRESSION_ZLIB, WIRE_COMPRESSIONS,
+    ClusterGenerationsCommand, ReceivedClusterStatus,
+    _ConfigAndStateGeneration,
 )
 from .. import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
     Dataset, DeploymentState, NonManifestDatasets,
 )
-from .._persistence import wire_encode, make_generation_hash
-from .._diffing import create_diff
+from .._persistence import (
+    wire_encode, make_generation_hash, WIRE_ENCODINGS, WIRE_ENCODING_JSON,
+    WIRE_ENCODING_COMPACT,
+)
+from .._metrics import MetricsRegistry
+from .._model import GenerationHash, node_view
+from .._diffing import create_diff, _Replace
 from .clusterstatetools import advance_some, advance_rest
 
 
@@ -269,6 +279,67 @@ class BigArgumentTests(TestCase):
 
         self.assert_roundtrips(self.CommandWithBigArgument, big=big_bytes)
 
+    def test_chunks_reused(self):
+        """
+        Serializing the same value again reuses the chunks it was split into,
+        rather than copying it again.
+        """
+        medium_bytes = b"x" * (MAX_VALUE_LENGTH + 1)
+        first, second = [
+            self.CommandWithBigArgument.makeArguments(
+                dict(big=medium_bytes), None)
+            for _ in range(2)
+        ]
+        self.assertEqual(
+            [(True, True)],
+            list(set((first[key] is second[key], first[key] == second[key])
+                     for key in first)),
+        )
+
+    def test_roundtrip_compressed(self):
+        """
+        ``Big`` compresses large values sent over a connection that agreed to
+        compression, and they can still be unserialized.
+        """
+        command = self.CommandWithBigArgument
+        proto = AMP()
+        proto.wire_compression = WIRE_COMPRESSION_ZLIB
+        big_bytes = b"x" * (MAX_VALUE_LENGTH * 3)
+        argument_box = command.makeArguments(dict(big=big_bytes), proto)
+        [roundtripped] = parseString(argument_box.serialize())
+        self.assertEqual(
+            ([b"big.0", b"big.compression"], dict(big=big_bytes)),
+            (sorted(argument_box.keys()),
+             command.parseArguments(roundtripped, AMP())),
+        )
+
+    def test_small_not_compressed(self):
+        """
+        ``Big`` doesn't compress values too small to be worth compressing.
+        """
+        proto = AMP()
+        proto.wire_compression = WIRE_COMPRESSION_ZLIB
+        argument_box = self.CommandWithBigArgument.makeArguments(
+            dict(big=b"hello world"), proto)
+        self.assertEqual([b"big.0"], argument_box.keys())
+
+    def test_compressed_once(self):
+        """
+        An object sent to many connections is compressed only once.
+        """
+        argument = Big(SerializableArgument(Deployment))
+        proto = AMP()
+        proto.wire_compression = WIRE_COMPRESSION_ZLIB
+        deployment = Deployment(nodes={
+            Node(uuid=uuid4(), applications={APP1.name: APP1})
+            for _ in range(20)})
+        boxes = [AmpBox(), AmpBox()]
+        for box in boxes:
+            argument.toBox(b"big", box, dict(big=deployment), proto)
+        self.assertEqual(
+            [b"big.0", b"big.compression"], sorted(boxes[0].keys()))
+        self.assertIs(boxes[0][b"big.0"], boxes[1][b"big.0"])
+
     def test_two_big_arguments(self):
         """
         AMP can serialize and unserialize a ``Command`` with multiple ``Big``
@@ -329,6 +400,22 @@ class SerializationTests(TestCase):
             [type(as_bytes), deserialized],
         )
 
+    def test_connection_encoding(self):
+        """
+        ``SerializableArgument`` encodes objects using the ``wire_encoding``
+        of the connection, and can decode any encoding.
+        """
+        class Connection(object):
+            wire_encoding = WIRE_ENCODING_COMPACT
+
+        argument = SerializableArgument(Deployment)
+        as_bytes = argument.toStringProto(_TEST_DEPLOYMENT, Connection())
+        self.assertEqual(
+            [wire_encode(_TEST_DEPLOYMENT, WIRE_ENCODING_COMPACT),
+             _TEST_DEPLOYMENT],
+            [as_bytes, argument.fromStringProto(as_bytes, Connection())],
+        )
+
     def test_multiple_type_serialization(self):
         """
         ``SerializableArgument`` can be given multiple types to allow instances
@@ -482,7 +569,72 @@ class ControlAMPTests(ControlTestCase):
         """
         self.assertEqual(
             self.successResultOf(self.client.callRemote(VersionCommand)),
-            {"major": 1})
+            {"major": 1, "encoding": None, "compression": None,
+             "node_state_diffs": True})
+
+    def test_version_negotiates_encoding(self):
+        """
+        ``VersionCommand`` with a list of encodings responds with the first
+        one the control service supports, and switches the connection to it.
+        """
+        response = self.successResultOf(self.client.callRemote(
+            VersionCommand, encodings=[u"unknown", WIRE_ENCODING_COMPACT]))
+        self.assertEqual(
+            ({"major": 1, "encoding": WIRE_ENCODING_COMPACT,
+              "compression": None, "node_state_diffs": True},
+             WIRE_ENCODING_COMPACT),
+            (response, self.protocol.wire_encoding),
+        )
+
+    def test_version_without_encodings(self):
+        """
+        ``VersionCommand`` without a list of encodings leaves the connection
+        using JSON.
+        """
+        self.successResultOf(self.client.callRemote(VersionCommand))
+        self.assertEqual(WIRE_ENCODING_JSON, self.protocol.wire_encoding)
+
+    def test_version_negotiates_compression(self):
+        """
+        ``VersionCommand`` with a list of compressions responds with the first
+        one the control service supports, and switches the connection to it.
+        """
+        response = self.successResultOf(self.client.callRemote(
+            VersionCommand, compressions=[u"unknown", WIRE_COMPRESSION_ZLIB]))
+        self.assertEqual(
+            (WIRE_COMPRESSION_ZLIB, WIRE_COMPRESSION_ZLIB),
+            (response["compression"], self.protocol.wire_compression),
+        )
+
+    def test_version_without_compressions(self):
+        """
+        ``VersionCommand`` without a list of compressions leaves the
+        connection uncompressed.
+        """
+        self.successResultOf(self.client.callRemote(VersionCommand))
+        self.assertIs(None, self.protocol.wire_compression)
+
+    def test_cluster_generations(self):
+        """
+        ``ClusterGenerationsCommand`` to the control service records the
+        generations the agent on that connection already has.
+        """
+        self.patch_call_remote([], self.protocol)
+        self.protocol.makeConnection(StringTransportWithAbort())
+        configuration_generation = make_generation_hash(_TEST_DEPLOYMENT)
+        state_generation = make_generation_hash(DeploymentState())
+        self.successResultOf(self.client.callRemote(
+            ClusterGenerationsCommand,
+            current_configuration_generation=configuration_generation,
+            current_state_generation=state_generation,
+        ))
+        self.assertEqual(
+            _ConfigAndStateGeneration(
+                config_hash=configuration_generation,
+                state_hash=state_generation,
+            ),
+            self.control_amp_service._last_received_generation[self.protocol]
+        )
 
     def test_nodestate_updates_node_state(self):
         """
@@ -501,6 +653,80 @@ class ControlAMPTests(ControlTestCase):
             self.control_amp_service.cluster_state.as_deployment(),
         )
 
+    def send_state_diff(self, before, after, start_generation=None):
+        """
+        Send a ``NodeStateDiffCommand`` from one sequence of state changes to
+        another.
+
+        :param tuple before: The state changes to diff from.
+        :param tuple after: The state changes to diff to.
+        :param GenerationHash start_generation: The start generation to send,
+            or ``None`` to send that of ``before``.
+
+        :return: The response to the command.
+        """
+        if start_generation is None:
+            start_generation = make_generation_hash(before)
+        return self.successResultOf(self.client.callRemote(
+            NodeStateDiffCommand,
+            state_diffs=[create_diff(a, b) for a, b in zip(before, after)],
+            start_generation=start_generation,
+            end_generation=make_generation_hash(after),
+            eliot_context=TEST_ACTION))
+
+    def test_nodestate_diff_updates_node_state(self):
+        """
+        ``NodeStateDiffCommand`` applies its diffs to the state last received
+        over the connection and updates the node state with the result.
+        """
+        changes = (NODE_STATE, NONMANIFEST)
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand,
+                                   state_changes=changes,
+                                   eliot_context=TEST_ACTION))
+        changed = (NODE_STATE.set(applications={}), NONMANIFEST)
+        response = self.send_state_diff(changes, changed)
+        self.assertEqual(
+            ({"applied": True},
+             DeploymentState(
+                 nodes={changed[0]},
+                 nonmanifest_datasets=NONMANIFEST.datasets,
+             )),
+            (response,
+             self.control_amp_service.cluster_state.as_deployment()),
+        )
+
+    def test_nodestate_diff_without_state(self):
+        """
+        ``NodeStateDiffCommand`` is not applied if no state has been received
+        over the connection.
+        """
+        response = self.send_state_diff(
+            (NODE_STATE,), (NODE_STATE.set(applications={}),))
+        self.assertEqual(
+            ({"applied": False}, DeploymentState()),
+            (response,
+             self.control_amp_service.cluster_state.as_deployment()),
+        )
+
+    def test_nodestate_diff_generation_mismatch(self):
+        """
+        ``NodeStateDiffCommand`` is not applied if its start generation is not
+        that of the state last received over the connection.
+        """
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand,
+                                   state_changes=(NODE_STATE,),
+                                   eliot_context=TEST_ACTION))
+        response = self.send_state_diff(
+            (NODE_STATE,), (NODE_STATE.set(applications={}),),
+            start_generation=make_generation_hash(SIMPLE_NODE_STATE))
+        self.assertEqual(
+            ({"applied": False}, DeploymentState(nodes={NODE_STATE})),
+            (response,
+             self.control_amp_service.cluster_state.as_deployment()),
+        )
+
     def test_activity_refreshes_node_state(self):
         """
         Any time commands are dispatched by ``ControlAMP`` its activity
@@ -774,6 +1000,247 @@ class ControlAMPServiceTests(ControlTestCase):
             dict(configuration=agent.desired, state=agent.actual),
         )
 
+    def quiet_agent(self, **kwargs):
+        """
+        Connect an agent to a new service and let the initial update to it
+        complete and be forgotten.
+
+        :param kwargs: Additional keyword arguments for
+            ``ControlAMPService``.
+
+        :return: The ``Clock`` of the service, the started service and the
+            ``FakeAgent``.
+        """
+        agent = FakeAgent()
+        client = AgentAMP(Clock(), agent)
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock, **kwargs)
+        service.startService()
+        self.addCleanup(service.stopService)
+        service.connected(LoopbackAMPClient(client.locator))
+        service_clock.advance(100)
+        return service_clock, service, agent
+
+    def test_quiet_update_sent_quickly(self):
+        """
+        When updates are rare, an update is sent to agents once the minimum
+        batching delay has passed.
+        """
+        service_clock, service, agent = self.quiet_agent()
+        service.configuration_service.save(_TEST_DEPLOYMENT)
+        service_clock.advance(CONTROL_SERVICE_MINIMUM_BATCHING_DELAY*2)
+        self.assertEqual(_TEST_DEPLOYMENT, agent.desired)
+
+    def test_batching_delay_bounds(self):
+        """
+        The minimum and maximum batching delays given to
+        ``ControlAMPService`` bound how long updates wait to be sent.
+        """
+        service_clock, service, agent = self.quiet_agent(
+            minimum_batching_delay=3, maximum_batching_delay=5)
+        service.configuration_service.save(_TEST_DEPLOYMENT)
+        service_clock.advance(2.9)
+        before = agent.desired
+        service_clock.advance(0.2)
+        self.assertEqual((Deployment(), _TEST_DEPLOYMENT, True),
+                         (before, agent.desired,
+                          3 <= service.batching_delay <= 5))
+
+    def test_coalesced_statistics(self):
+        """
+        ``ControlAMPService`` counts the batches of updates it sends and the
+        updates which were coalesced into an already pending batch.
+        """
+        service_clock, service, agent = self.quiet_agent()
+        batches = service.batches
+        for _ in range(3):
+            service.configuration_service.save(
+                _TEST_DEPLOYMENT.update_node(Node(uuid=uuid4())))
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        self.assertEqual(
+            (1, 2), (service.batches - batches, service.coalesced))
+
+    def test_diff_after_restart(self):
+        """
+        An agent that tells a restarted control service which generations it
+        has is sent a diff of the configuration from the persisted history,
+        and a replacement of the state the restarted service no longer knows.
+        """
+        path = self.make_temporary_directory()
+        old_service = build_control_amp_service(self, path=path)
+        old_state = DeploymentState()
+        old_service.configuration_service.save(_TEST_DEPLOYMENT)
+        new_configuration = arbitrary_transformation(_TEST_DEPLOYMENT)
+        old_service.configuration_service.save(new_configuration)
+
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock, path=path)
+        service.cluster_state.apply_changes([NODE_STATE])
+        service.startService()
+        server = LoopbackAMPClient(AgentAMP(Clock(), FakeAgent()).locator)
+        sent = []
+        self.patch_call_remote(sent, server)
+        service.connected(server)
+        service.agent_generations(
+            server, make_generation_hash(_TEST_DEPLOYMENT),
+            make_generation_hash(old_state),
+        )
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        [((command,), kwargs)] = sent
+        self.assertEqual(
+            (ClusterStatusDiffCommand, new_configuration,
+             service.cluster_state.as_deployment()),
+            (command, kwargs["configuration_diff"].apply(_TEST_DEPLOYMENT),
+             kwargs["state_diff"].apply(old_state)),
+        )
+
+    def test_oversized_diff_replaced(self):
+        """
+        An agent whose configuration is so far behind that the diff to the
+        latest one is bigger than the latest configuration is sent the
+        latest configuration as a replacement instead.
+        """
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        server = LoopbackAMPClient(AgentAMP(Clock(), FakeAgent()).locator)
+        sent = []
+        self.patch_call_remote(sent, server)
+        service.connected(server)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        old_configuration = service.configuration_service.get()
+        service.agent_generations(
+            server, make_generation_hash(old_configuration),
+            make_generation_hash(service.cluster_state.as_deployment()),
+        )
+        # Each change sets a whole new node, so the diff holds every node as
+        # well as the path to it:
+        configuration = old_configuration
+        for _ in range(5):
+            configuration = configuration.update_node(Node(uuid=uuid4()))
+            service.configuration_service.save(configuration)
+        del sent[:]
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        [((command,), kwargs)] = sent
+        self.assertEqual(
+            (ClusterStatusDiffCommand, [_Replace(value=configuration)]),
+            (command, list(kwargs["configuration_diff"].changes)),
+        )
+
+    def test_same_generation_shares_update(self):
+        """
+        Agents which last received the same generations are sent the same
+        argument objects, so they are only encoded once between them.
+        """
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        servers = [
+            LoopbackAMPClient(AgentAMP(Clock(), FakeAgent()).locator)
+            for _ in range(3)
+        ]
+        sent = []
+        for server in servers:
+            self.patch_call_remote(sent, server)
+            service.connected(server)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        generations = [
+            make_generation_hash(service.configuration_service.get()),
+            make_generation_hash(service.cluster_state.as_deployment()),
+        ]
+        for server in servers:
+            # Equal but separate hashes, as each agent's response would be:
+            service.agent_generations(server, *[
+                GenerationHash(hash_value=generation.hash_value)
+                for generation in generations
+            ])
+        service.configuration_service.save(_TEST_DEPLOYMENT)
+        service.cluster_state.apply_changes([NODE_STATE])
+        del sent[:]
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        [first, second, third] = [kwargs for _, kwargs in sent]
+        self.assertEqual(
+            ([(command, ClusterStatusDiffCommand) for (command,), _ in sent],
+             [(value is second[name], value is third[name])
+              for name, value in first.items()]),
+            ([(ClusterStatusDiffCommand, ClusterStatusDiffCommand)] * 3,
+             [(True, True)] * len(first)),
+        )
+
+    def scoped_agent(self, configuration):
+        """
+        Connect an agent which asks for the view of the cluster of a node in
+        a configuration, and let it be sent the view.
+
+        :param Deployment configuration: The configuration to save.
+
+        :return: A ``tuple`` of the service, its clock, the agent, its
+            connection and the node.
+        """
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        node = Node(uuid=uuid4(), manifestations={
+            MANIFESTATION.dataset_id: MANIFESTATION})
+        service.configuration_service.save(configuration.update_node(node))
+        service.cluster_state.apply_changes([NODE_STATE])
+        agent = FakeAgent()
+        server = LoopbackAMPClient(AgentAMP(Clock(), agent).locator)
+        service.connected(server)
+        service.scope_to_node(server, node.uuid)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        return service, service_clock, agent, server, node
+
+    def test_scoped_agent_sent_node_view(self):
+        """
+        An agent which asked for the view of the cluster for its node is sent
+        that rather than the whole cluster.
+        """
+        service, _, agent, _, node = self.scoped_agent(_TEST_DEPLOYMENT)
+        self.assertEqual(
+            node_view(service.configuration_service.get(),
+                      service.cluster_state.as_deployment(), node.uuid),
+            (agent.desired, agent.actual),
+        )
+
+    def test_scoped_agent_relevant_changes(self):
+        """
+        An agent which asked for the view of the cluster for its node is only
+        sent an update when its view changes.
+        """
+        service, service_clock, agent, _, node = self.scoped_agent(
+            _TEST_DEPLOYMENT)
+        counts = [agent.cluster_updated_count]
+        configuration = service.configuration_service.get()
+        for configuration in [
+                configuration.update_node(Node(uuid=uuid4())),
+                configuration.update_node(node.transform(
+                    ["manifestations", MANIFESTATION.dataset_id, "primary"],
+                    False)),
+        ]:
+            service.configuration_service.save(configuration)
+            service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+            counts.append(agent.cluster_updated_count)
+        self.assertEqual(
+            ([counts[0], counts[0], counts[0] + 1],
+             node_view(configuration, service.cluster_state.as_deployment(),
+                       node.uuid)),
+            (counts, (agent.desired, agent.actual)),
+        )
+
+    def test_scope_forgotten_on_disconnect(self):
+        """
+        The view of the cluster for a node is no longer tracked once no agent
+        that asked for it is connected.
+        """
+        service, _, _, server, _ = self.scoped_agent(_TEST_DEPLOYMENT)
+        service.disconnected(server)
+        self.assertEqual(
+            ({}, {}), (service._node_scopes, service._node_view_trackers))
+
     def test_coalesced_sends_within_time(self):
         """
         Updating config multiple times within a second only actually causes 1
@@ -1113,6 +1580,98 @@ class AgentClientTests(TestCase):
         self.assertEqual(self.agent, FakeAgent(is_connected=True,
                                                is_disconnected=True))
 
+    def test_no_generations_sent_initially(self):
+        """
+        An agent that has not received any configuration and state only
+        negotiates an encoding when it connects, and does not send
+        ``ClusterGenerationsCommand``.
+        """
+        [box] = parseString(self.client.transport.value())
+        self.assertEqual(
+            (VersionCommand.commandName,
+             dict(encodings=list(WIRE_ENCODINGS),
+                  compressions=list(WIRE_COMPRESSIONS))),
+            (box[b"_command"],
+             VersionCommand.parseArguments(box, self.client)),
+        )
+
+    def test_encoding_negotiated(self):
+        """
+        ``AgentAMP`` switches to the encoding the control service chose in
+        response to ``VersionCommand``.
+        """
+        [box] = parseString(self.client.transport.value())
+        self.client.ampBoxReceived(AmpBox(
+            _answer=box[b"_ask"], major=b"1",
+            encoding=WIRE_ENCODING_COMPACT.encode("utf-8")))
+        self.assertEqual(WIRE_ENCODING_COMPACT, self.client.wire_encoding)
+
+    def test_encoding_not_negotiated(self):
+        """
+        ``AgentAMP`` keeps using JSON if the control service does not choose
+        an encoding in response to ``VersionCommand``.
+        """
+        [box] = parseString(self.client.transport.value())
+        self.client.ampBoxReceived(AmpBox(_answer=box[b"_ask"], major=b"1"))
+        self.assertEqual(
+            (WIRE_ENCODING_JSON, None, False),
+            (self.client.wire_encoding, self.client.wire_compression,
+             self.client.node_state_diffs))
+
+    def test_compression_negotiated(self):
+        """
+        ``AgentAMP`` switches to the compression the control service chose in
+        response to ``VersionCommand``.
+        """
+        [box] = parseString(self.client.transport.value())
+        self.client.ampBoxReceived(AmpBox(
+            _answer=box[b"_ask"], major=b"1",
+            compression=WIRE_COMPRESSION_ZLIB.encode("utf-8")))
+        self.assertEqual(WIRE_COMPRESSION_ZLIB, self.client.wire_compression)
+
+    def test_node_state_diffs_negotiated(self):
+        """
+        ``AgentAMP`` sends node state diffs if the control service says it
+        accepts them in response to ``VersionCommand``.
+        """
+        [box] = parseString(self.client.transport.value())
+        self.client.ampBoxReceived(AmpBox(
+            _answer=box[b"_ask"], major=b"1", node_state_diffs=b"True"))
+        self.assertTrue(self.client.node_state_diffs)
+
+    def test_reconnect_sends_generations(self):
+        """
+        An ``AgentAMP`` connecting with the configuration and state received
+        over an earlier connection tells the control service which
+        generations it has.
+        """
+        received = ReceivedClusterStatus()
+        client = AgentAMP(self.reactor, self.agent, received)
+        client.makeConnection(StringTransportWithAbort())
+        server = LoopbackAMPClient(client.locator)
+        actual = DeploymentState(nodes=[])
+        self.successResultOf(server.callRemote(
+            ClusterStatusCommand,
+            configuration=_TEST_DEPLOYMENT,
+            configuration_generation=make_generation_hash(_TEST_DEPLOYMENT),
+            state=actual,
+            state_generation=make_generation_hash(actual),
+            eliot_context=TEST_ACTION
+        ))
+
+        reconnected = AgentAMP(self.reactor, self.agent, received)
+        transport = StringTransportWithAbort()
+        reconnected.makeConnection(transport)
+        [_, box] = parseString(transport.value())
+        self.assertEqual(
+            (ClusterGenerationsCommand.commandName,
+             dict(current_configuration_generation=(
+                 make_generation_hash(_TEST_DEPLOYMENT)),
+                 current_state_generation=make_generation_hash(actual))),
+            (box[b"_command"],
+             ClusterGenerationsCommand.parseArguments(box, reconnected)),
+        )
+
     def test_too_long_configuration(self):
         """
         AMP protocol can transmit configurations with 800 applications.
@@ -1617,6 +2176,153 @@ class PingTestsMixin(object):
         )
 
 
+class BatchingWindowTests(TestCase):
+    """
+    Tests for ``_BatchingWindow``.
+    """
+    def test_rare_requests(self):
+        """
+        When requests are rare and few agents are connected, the delay is
+        the minimum.
+        """
+        window = _BatchingWindow(0.1, 1.0)
+        for now in range(0, 100, 10):
+            window.request(now)
+        self.assertAlmostEqual(0.1, window.delay(0), places=4)
+
+    def test_frequent_requests(self):
+        """
+        The delay grows with the rate of requests, up to the maximum.
+        """
+        window = _BatchingWindow(0.1, 1.0)
+        delays = []
+        for i in range(20):
+            window.request(i * 0.05)
+            delays.append(window.delay(0))
+        self.assertEqual(
+            (sorted(delays), 0.1, 1.0), (delays, delays[0], delays[-1]))
+
+    def test_many_connections(self):
+        """
+        The delay grows with the number of connected agents, up to the
+        maximum.
+        """
+        window = _BatchingWindow(0.1, 1.0)
+        window.request(0)
+        self.assertEqual(
+            [0.1, 0.2, 1.0],
+            [window.delay(connections) for connections in (0, 100, 10000)])
+
+    def test_zero_maximum(self):
+        """
+        With a maximum of zero, the delay is always zero.
+        """
+        window = _BatchingWindow(0, 0)
+        window.request(0)
+        window.request(0)
+        self.assertEqual(0, window.delay(10))
+
+
+class MetricsTests(TestCase):
+    """
+    Tests for the metrics recorded by ``ControlAMP``, ``AgentAMP`` and
+    ``ControlAMPService``.
+    """
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        self.reactor = Clock()
+        self.service = build_control_amp_service(
+            self, self.reactor, metrics=MetricsRegistry())
+        self.agent_metrics = MetricsRegistry()
+
+    def connect(self):
+        """
+        Connect an ``AgentAMP`` to a ``ControlAMP`` of the service.
+
+        :return: The ``IOPump`` moving data between them.
+        """
+        return connectedServerAndClient(
+            lambda: ControlAMP(self.reactor, self.service),
+            lambda: AgentAMP(
+                self.reactor, FakeAgent(), metrics=self.agent_metrics),
+        )[2]
+
+    def test_box_size(self):
+        """
+        ``_box_size`` returns the length of the serialized box.
+        """
+        box = AmpBox(_command=b"Command", key=b"value" * 10)
+        self.assertEqual(len(box.serialize()), _box_size(box))
+
+    def test_request_and_response(self):
+        """
+        Both sides of a connection record the sizes of the requests and
+        responses of each command, and the side sending the request records
+        the time taken to encode it and for the response to arrive.
+        """
+        self.connect().flush()
+        command = u"amp." + VersionCommand.commandName.decode("ascii")
+        self.assertEqual(
+            ([1] * 4, [1] * 2),
+            ([self.agent_metrics.distribution(command + suffix)["count"]
+              for suffix in (u".request_bytes", u".response_bytes",
+                             u".encode_seconds", u".round_trip_seconds")],
+             [self.service.metrics.distribution(command + suffix)["count"]
+              for suffix in (u".request_bytes", u".response_bytes")]))
+
+    def test_decode(self):
+        """
+        The side receiving a command records how long decoding each of its
+        ``Big`` arguments took.
+        """
+        pump = self.connect()
+        pump.flush()
+        self.reactor.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        pump.flush()
+        self.assertEqual(
+            1,
+            self.agent_metrics.distribution(
+                u"amp.ClusterStatusCommand.configuration.decode_seconds"
+            )["count"])
+
+    def test_full_update_acknowledged(self):
+        """
+        ``ControlAMPService`` counts the updates it sends in full and records
+        how long agents take to acknowledge them.
+        """
+        pump = self.connect()
+        pump.flush()
+        self.reactor.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        pump.flush()
+        self.assertEqual(
+            (1, 0, 1),
+            (self.service.metrics.counter(u"control.updates.full"),
+             self.service.metrics.counter(u"control.updates.diff"),
+             self.service.metrics.distribution(
+                 u"control.updates.acknowledge_seconds")["count"]))
+
+    def test_delayed_and_elided(self):
+        """
+        ``ControlAMPService`` counts the updates to agents that are delayed
+        or elided because an earlier update hasn't been acknowledged.
+        """
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        server = DelayedAMPClient(
+            LoopbackAMPClient(AgentAMP(Clock(), FakeAgent()).locator))
+        self.service.connected(server)
+        self.reactor.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        configuration = self.service.configuration_service.get()
+        for _ in range(2):
+            configuration = arbitrary_transformation(configuration)
+            self.service.configuration_service.save(configuration)
+            self.reactor.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        self.assertEqual(
+            (1, 1),
+            (self.service.metrics.counter(u"control.updates.delayed"),
+             self.service.metrics.counter(u"control.updates.elided")))
+
+
 class ControlAMPPingTests(TestCase, PingTestsMixin):
     """
     Tests for pinging done by ``ControlAMP``.
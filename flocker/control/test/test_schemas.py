@@ -767,6 +767,49 @@ ConfigurationDatasetsCreateSchemaTests = build_schema_test(
     passing_instances=CONFIGURATION_DATASETS_PASSING_INSTANCES,
 )
 
+ConfigurationDatasetsBulkSchemaTests = build_schema_test(
+    name="ConfigurationDatasetsBulkSchemaTests",
+    schema={'$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_bulk'},
+    schema_store=SCHEMAS,
+    failing_instances={
+        INVALID_OBJECT_PROPERTY_MISSING: [
+            # operations is required
+            {},
+        ],
+        INVALID_OBJECT_NO_MATCH: [
+            # Unknown operation
+            {u"operations": [{u"operation": u"rename",
+                              u"dataset_id": valid_uuid}]},
+            # move requires primary
+            {u"operations": [{u"operation": u"move",
+                              u"dataset_id": valid_uuid}]},
+            # delete takes only dataset_id
+            {u"operations": [{u"operation": u"delete",
+                              u"dataset_id": valid_uuid,
+                              u"primary": valid_uuid}]},
+            # maximum_size less than minimum allowed
+            {u"operations": [{u"operation": u"resize",
+                              u"dataset_id": valid_uuid,
+                              u"maximum_size": 123}]},
+        ],
+    },
+    passing_instances=[
+        {u"operations": []},
+        {u"operations": [
+            {u"operation": u"create", u"primary": valid_uuid},
+            {u"operation": u"create", u"primary": valid_uuid,
+             u"dataset_id": valid_uuid, u"metadata": {u"name": u"x"},
+             u"maximum_size": 1024 * 1024 * 64},
+            {u"operation": u"move", u"dataset_id": valid_uuid,
+             u"primary": valid_uuid},
+            {u"operation": u"resize", u"dataset_id": valid_uuid,
+             u"maximum_size": None},
+            {u"operation": u"delete", u"dataset_id": valid_uuid},
+        ]},
+    ],
+)
+
 StateDatasetsArraySchemaTests = build_schema_test(
     name="StateDatasetsArraySchemaTests",
     schema={'$ref': '/v1/endpoints.json#/definitions/state_datasets_array'},
@@ -1,6 +1,7 @@
 # Copyright ClusterHQ Inc.  See LICENSE file for details.
 
 from twisted.python.filepath import FilePath
+from twisted.python.usage import UsageError
 
 from ..script import ControlOptions, ControlScript
 from ...testtools import (
@@ -69,6 +70,47 @@ class ControlOptionsTests(make_standard_options_test(ControlOptions)):
         options.parseOptions([b"--agent-port", b"tcp:1234"])
         self.assertEqual(options["agent-port"], b"tcp:1234")
 
+    def test_default_configuration_store(self):
+        """
+        The configuration is stored in files by default.
+        """
+        options = ControlOptions()
+        options.parseOptions([])
+        self.assertEqual(options["configuration-store"], b"file")
+
+    def test_unknown_configuration_store(self):
+        """
+        ``--configuration-store`` only accepts known kinds of store.
+        """
+        options = ControlOptions()
+        self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--configuration-store", b"zookeeper"])
+
+    def test_batching_delays(self):
+        """
+        ``--minimum-batching-delay`` and ``--maximum-batching-delay`` set the
+        bounds on how long changes wait before being sent to agents.
+        """
+        options = ControlOptions()
+        options.parseOptions([b"--minimum-batching-delay", b"0.5",
+                              b"--maximum-batching-delay", b"3"])
+        self.assertEqual(
+            (0.5, 3.0),
+            (options["minimum-batching-delay"],
+             options["maximum-batching-delay"]))
+
+    def test_minimum_batching_delay_above_maximum(self):
+        """
+        ``--minimum-batching-delay`` may not be above
+        ``--maximum-batching-delay``.
+        """
+        options = ControlOptions()
+        self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--minimum-batching-delay", b"2",
+             b"--maximum-batching-delay", b"1"])
+
 
 class ControlScriptTests(TestCase):
     """
@@ -86,33 +128,57 @@ class ControlScriptTests(TestCase):
         self.script = ControlScript()
         self.options = ControlOptions()
         self.data_path = FilePath(self.mktemp())
-        self.options.parseOptions([
+        self.arguments = [
             b"--port", b"tcp:8001", b"--agent-port", b"tcp:8002",
             b"--data-path", self.data_path.path,
             b"--certificates-directory", self.certificate_path.path
-        ])
+        ]
+        self.options.parseOptions(self.arguments)
+
+    def main(self):
+        """
+        Run ``ControlScript.main`` with a fake reactor, shutting the reactor
+        down again when the test is done so that the persistence service's
+        writer thread is stopped.
+
+        :return: The fake reactor and the ``Deferred`` returned by ``main``.
+        """
+        reactor = MemoryCoreReactor()
+        result = self.script.main(reactor, self.options)
+        self.addCleanup(reactor.fireSystemEvent, "shutdown")
+        return reactor, result
 
     def test_no_immediate_stop(self):
         """
         The ``Deferred`` returned from ``ControlScript`` is not fired.
         """
-        self.assertNoResult(
-            self.script.main(MemoryCoreReactor(), self.options))
+        reactor, result = self.main()
+        self.assertNoResult(result)
 
     def test_starts_persistence_service(self):
         """
         ``ControlScript.main`` starts a configuration persistence service.
         """
-        reactor = MemoryCoreReactor()
-        self.script.main(reactor, self.options)
+        reactor, _ = self.main()
         self.assertTrue(self.data_path.isdir())
 
+    def test_sqlite_configuration_store(self):
+        """
+        With ``--configuration-store sqlite`` the configuration is stored in
+        an SQLite database in the data path.
+        """
+        self.options = ControlOptions()
+        self.options.parseOptions(self.arguments + [
+            b"--configuration-store", b"sqlite"])
+        self.main()
+        self.assertTrue(
+            self.data_path.child(b"current_configuration.sqlite").exists())
+
     def test_starts_cluster_state_service(self):
         """
         ``ControlScript.main`` starts a cluster state service.
         """
-        reactor = MemoryCoreReactor()
-        self.script.main(reactor, self.options)
+        reactor, _ = self.main()
         server = reactor.tcpServers[0]
         control_resource = server[1].wrappedFactory.resource
         service = control_resource._v1_user.cluster_state_service
@@ -0,0 +1,211 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._sqlite``.
+"""
+
+from functools import partial
+from uuid import uuid4
+
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+
+from ...testtools import TestCase
+from .._diffing import create_diff
+from .._model import Deployment, Node, Manifestation, Dataset
+from .._persistence import (
+    ConfigurationPersistenceService, ConfigurationMigrationError,
+    FileConfigurationStore, WIRE_ENCODING_COMPACT, _configuration_hash,
+    make_generation_hash,
+)
+from .._sqlite import SQLiteConfigurationStore
+from ..testtools import make_iconfigurationstore_tests
+
+
+def _database(test):
+    """
+    :return FilePath: A database file in a new directory.
+    """
+    return FilePath(test.mktemp()).child(b"configuration.sqlite")
+
+
+class SQLiteConfigurationStoreInterfaceTests(
+        make_iconfigurationstore_tests(
+            lambda test: partial(SQLiteConfigurationStore, _database(test)))
+):
+    """
+    ``IConfigurationStore`` tests for ``SQLiteConfigurationStore``.
+    """
+
+
+class CompactSQLiteConfigurationStoreInterfaceTests(
+        make_iconfigurationstore_tests(
+            lambda test: partial(
+                SQLiteConfigurationStore, _database(test),
+                encoding=WIRE_ENCODING_COMPACT))
+):
+    """
+    ``IConfigurationStore`` tests for ``SQLiteConfigurationStore`` storing
+    values in the compact encoding.
+    """
+
+
+def _with_datasets(node, count):
+    """
+    :return Node: ``node`` with ``count`` additional manifestations.
+    """
+    for _ in range(count):
+        dataset_id = unicode(uuid4())
+        node = node.transform(
+            ["manifestations", dataset_id],
+            Manifestation(dataset=Dataset(dataset_id=dataset_id),
+                          primary=True))
+    return node
+
+
+class SQLiteConfigurationStoreTests(TestCase):
+    """
+    Tests for ``SQLiteConfigurationStore``.
+    """
+    def setUp(self):
+        super(SQLiteConfigurationStoreTests, self).setUp()
+        self.path = _database(self)
+
+    def store(self, **kwargs):
+        """
+        :return: A loaded ``SQLiteConfigurationStore``, and what it loaded.
+        """
+        store = SQLiteConfigurationStore(self.path, **kwargs)
+        self.addCleanup(store.close)
+        return store, store.load()
+
+    def save(self, store, previous, deployment, history=()):
+        """
+        Save a configuration.
+
+        :return: The history including the new change.
+        """
+        change = (_configuration_hash(previous),
+                  create_diff(previous, deployment))
+        history = tuple(history) + (change,)
+        store.save(deployment, change, history)
+        return history
+
+    def test_one_row_per_change(self):
+        """
+        Changing one dataset writes the row for that dataset and the history
+        entry for the change, however big the configuration is.
+        """
+        store, (empty, _) = self.store()
+        node = _with_datasets(Node(uuid=uuid4()), 100)
+        deployment = empty.update_node(node).update_node(
+            _with_datasets(Node(uuid=uuid4()), 100))
+        history = self.save(store, empty, deployment)
+        dataset_id = next(iter(node.manifestations))
+        changed = deployment.transform(
+            ["nodes", node.uuid, "manifestations", dataset_id, "dataset",
+             "metadata"], {u"name": u"changed"})
+        before = store._connection.total_changes
+        self.save(store, deployment, changed, history)
+        self.assertEqual(2, store._connection.total_changes - before)
+
+    def test_history_trimmed(self):
+        """
+        Only the number of history entries given to the most recent save are
+        kept.
+        """
+        store, (deployment, _) = self.store()
+        history = ()
+        for _ in range(3):
+            latest = deployment.update_node(Node(uuid=uuid4()))
+            history = self.save(store, deployment, latest, history[-1:])
+            deployment = latest
+        store.close()
+        _, loaded = self.store()
+        self.assertEqual((deployment, list(history)), loaded)
+
+    def test_migrate_from(self):
+        """
+        A new database is populated from the ``migrate_from`` store.
+        """
+        file_store = FileConfigurationStore(FilePath(self.mktemp()))
+        empty, _ = file_store.load()
+        deployment = empty.update_node(_with_datasets(Node(uuid=uuid4()), 3))
+        change = (_configuration_hash(empty), create_diff(empty, deployment))
+        file_store.save(deployment, change, (change,))
+
+        _, loaded = self.store(migrate_from=file_store)
+        self.assertEqual((deployment, [change]), loaded)
+
+    def test_migrate_interrupted(self):
+        """
+        If populating a new database from the ``migrate_from`` store fails,
+        the next load populates it again.
+        """
+        path = FilePath(self.mktemp())
+        file_store = FileConfigurationStore(path)
+        empty, _ = file_store.load()
+        deployment = empty.update_node(Node(uuid=uuid4()))
+        change = (_configuration_hash(empty), create_diff(empty, deployment))
+        file_store.save(deployment, change, (change,))
+
+        def broken_load():
+            raise IOError("unreadable")
+        broken = FileConfigurationStore(path)
+        self.patch(broken, "load", broken_load)
+        store = SQLiteConfigurationStore(self.path, migrate_from=broken)
+        self.addCleanup(store.close)
+        self.assertRaises(IOError, store.load)
+        store.close()
+
+        _, loaded = self.store(migrate_from=file_store)
+        self.assertEqual((deployment, [change]), loaded)
+
+    def test_migrate_only_once(self):
+        """
+        An existing database is not repopulated from the ``migrate_from``
+        store.
+        """
+        store, (empty, _) = self.store()
+        deployment = empty.update_node(Node(uuid=uuid4()))
+        self.save(store, empty, deployment)
+        store.close()
+        file_store = FileConfigurationStore(FilePath(self.mktemp()))
+        _, (loaded, _) = self.store(migrate_from=file_store)
+        self.assertEqual(deployment, loaded)
+
+    def test_version_mismatch(self):
+        """
+        Loading a database written for a different configuration version
+        raises ``ConfigurationMigrationError``.
+        """
+        store, _ = self.store()
+        with store._connection:
+            store._connection.execute(
+                u"UPDATE metadata SET value = 1 WHERE name = 'version'")
+        store.close()
+        self.assertRaises(
+            ConfigurationMigrationError,
+            SQLiteConfigurationStore(self.path).load)
+
+    def test_persistence_service(self):
+        """
+        ``ConfigurationPersistenceService`` can store the configuration in a
+        ``SQLiteConfigurationStore``.
+        """
+        service = ConfigurationPersistenceService(
+            Clock(), store=SQLiteConfigurationStore(self.path))
+        service.startService()
+        deployment = service.get().update_node(Node(uuid=uuid4()))
+        self.successResultOf(service.save(deployment))
+        self.successResultOf(service.stopService())
+
+        new_service = ConfigurationPersistenceService(
+            Clock(), store=SQLiteConfigurationStore(self.path))
+        new_service.startService()
+        self.addCleanup(new_service.stopService)
+        self.assertEqual(
+            (deployment, [make_generation_hash(Deployment())]),
+            (new_service.get(),
+             [generation for generation, _
+              in new_service.configuration_history()]))
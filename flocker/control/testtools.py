@@ -16,19 +16,24 @@ from twisted.test.proto_helpers import MemoryReactor
 from ..testtools import TestCase
 
 from ._clusterstate import ClusterStateService
-from ._persistence import ConfigurationPersistenceService
+from ._persistence import (
+    ConfigurationPersistenceService, IConfigurationStore, _configuration_hash,
+)
 from ._protocol import (
     ControlAMPService, ControlAMP,
 )
 from ._registry import IStatePersister, InMemoryStatePersister
+from ._diffing import create_diff
 from ._model import (
     Application,
     AttachedVolume,
+    BlockDeviceOwnership,
     Dataset,
     DatasetAlreadyOwned,
     Deployment,
     DockerImage,
     Lease,
+    Leases,
     Manifestation,
     Node,
     PersistentState,
@@ -47,6 +52,7 @@ from hypothesis.extra.datetime import datetimes
 __all__ = [
     'build_control_amp_service',
     'InMemoryStatePersister',
+    'make_iconfigurationstore_tests',
     'make_istatepersister_tests',
     'make_loopback_control_client',
 ]
@@ -123,21 +129,152 @@ def make_istatepersister_tests(fixture):
     return IStatePersisterTests
 
 
-def build_control_amp_service(test_case, reactor=None):
+def make_iconfigurationstore_tests(fixture):
+    """
+    Create a TestCase for ``IConfigurationStore``.
+
+    :param fixture: A callable that takes a ``TestCase`` and returns a
+        0-argument callable that returns a new ``IConfigurationStore``
+        provider using the same storage as any others it returned.
+    """
+    class IConfigurationStoreTests(TestCase):
+        """
+        Tests for ``IConfigurationStore`` implementations.
+        """
+        def setUp(self):
+            super(IConfigurationStoreTests, self).setUp()
+            self._new_store = fixture(self)
+
+        def store(self):
+            """
+            :return: A newly loaded store, and what it loaded.
+            """
+            store = self._new_store()
+            self.addCleanup(store.close)
+            return store, store.load()
+
+        def save(self, store, previous, deployment, history=()):
+            """
+            Save a configuration.
+
+            :return: The history including the new change.
+            """
+            change = (_configuration_hash(previous),
+                      create_diff(previous, deployment))
+            history = tuple(history) + (change,)
+            store.save(deployment, change, history)
+            return history
+
+        def test_interface(self):
+            """
+            The object implements ``IConfigurationStore``.
+            """
+            verifyObject(IConfigurationStore, self._new_store())
+
+        def test_empty(self):
+            """
+            A new store loads an empty configuration and no history.
+            """
+            _, loaded = self.store()
+            self.assertEqual((Deployment(), []), loaded)
+
+        def test_save_load(self):
+            """
+            A saved configuration and history are loaded by a new store.
+            """
+            store, (deployment, _) = self.store()
+            node = Node(uuid=uuid4(), applications=[
+                Application(name=u"app", image=DockerImage.from_string(
+                    u"busybox"))
+            ])
+            latest = deployment.update_node(node)
+            history = self.save(store, deployment, latest)
+            store.close()
+            _, loaded = self.store()
+            self.assertEqual((latest, list(history)), loaded)
+
+        def test_changes(self):
+            """
+            Removed nodes, manifestations and leases and changed persistent
+            state are saved.
+            """
+            dataset_id = uuid4()
+            node = Node(uuid=uuid4(), manifestations={
+                unicode(dataset_id): Manifestation(
+                    dataset=Dataset(dataset_id=unicode(dataset_id)),
+                    primary=True,
+                )
+            })
+            store, (deployment, _) = self.store()
+            first = deployment.update_node(node).update_node(
+                Node(uuid=uuid4())
+            ).set(leases=Leases().set(dataset_id, Lease(
+                dataset_id=dataset_id, node_id=node.uuid)))
+            second = first.set(
+                nodes={node.uuid: node.set(manifestations={})},
+                leases=Leases(),
+                persistent_state=PersistentState(
+                    blockdevice_ownership=BlockDeviceOwnership().set(
+                        dataset_id, u"block")),
+            )
+            history = self.save(store, deployment, first)
+            self.save(store, first, second, history)
+            store.close()
+            _, (loaded, _) = self.store()
+            self.assertEqual(second, loaded)
+
+        def test_history(self):
+            """
+            The history of changes leading up to the saved configuration is
+            loaded.
+            """
+            store, (deployment, _) = self.store()
+            first = deployment.update_node(Node(uuid=uuid4()))
+            second = first.update_node(Node(uuid=uuid4()))
+            history = self.save(store, deployment, first)
+            history = self.save(store, first, second, history)
+            store.close()
+            _, loaded = self.store()
+            self.assertEqual((second, list(history)), loaded)
+
+        @given(related_deployments_strategy(2))
+        def test_related_deployments(self, deployments):
+            """
+            Any configuration can be saved and loaded, after an earlier one.
+            """
+            # Hypothesis runs this many times with one ``TestCase``, so
+            # don't share storage between examples:
+            self._new_store = fixture(self)
+            store, (empty, _) = self.store()
+            first, second = deployments
+            history = self.save(store, empty, first)
+            self.save(store, first, second, history)
+            store.close()
+            _, (loaded, _) = self.store()
+            self.assertEqual(second, loaded)
+
+    return IConfigurationStoreTests
+
+
+def build_control_amp_service(test_case, reactor=None, path=None, **kwargs):
     """
     Create a new ``ControlAMPService``.
 
     :param TestCase test_case: The test this service is for.
+    :param FilePath path: The directory to persist configuration in, or
+        ``None`` to use a new temporary directory.
+    :param kwargs: Additional keyword arguments for ``ControlAMPService``.
 
     :return ControlAMPService: Not started.
     """
     if reactor is None:
         reactor = Clock()
+    if path is None:
+        path = test_case.make_temporary_directory()
     cluster_state = ClusterStateService(reactor)
     cluster_state.startService()
     test_case.addCleanup(cluster_state.stopService)
-    persistence_service = ConfigurationPersistenceService(
-        reactor, test_case.make_temporary_directory())
+    persistence_service = ConfigurationPersistenceService(reactor, path)
     persistence_service.startService()
     test_case.addCleanup(persistence_service.stopService)
     return ControlAMPService(
@@ -145,6 +282,7 @@ def build_control_amp_service(test_case, reactor=None):
         TCP4ServerEndpoint(MemoryReactor(), 1234),
         # Easiest TLS context factory to create:
         ClientContextFactory(),
+        **kwargs
     )
 
 
@@ -26,7 +26,7 @@ from klein import Klein
 from ..restapi import (
     structured, EndpointResponse, BadRequest, make_bad_request,
 )
-from ..apiclient import DatasetAlreadyExists, conditional_create
+from ..apiclient import DatasetAlreadyExists, NotFound, conditional_create
 from ..node.agents.blockdevice import PROFILE_METADATA_KEY
 from ..common import (
     RACKSPACE_MINIMUM_VOLUME_SIZE, DEVICEMAPPER_LOOPBACK_SIZE,
@@ -300,16 +300,18 @@ class VolumePlugin(object):
             ``None`` if the dataset is not locally mounted, or errbacks
             with ``_NotFound`` if it is does not exist at all.
         """
-        d = self._flocker_client.list_datasets_state()
+        d = self._flocker_client.get_dataset_state(dataset_id)
 
-        def got_state(datasets):
-            datasets = [dataset for dataset in datasets
-                        if dataset.dataset_id == dataset_id]
-            if datasets and datasets[0].primary == self._node_id:
-                return datasets[0].path
+        def got_state(dataset):
+            if dataset.primary == self._node_id:
+                return dataset.path
             else:
                 return None
-        d.addCallback(got_state)
+
+        def not_found(reason):
+            reason.trap(NotFound)
+            return None
+        d.addCallbacks(got_state, not_found)
         return d
 
     @app.route("/VolumeDriver.Mount", methods=["POST"])
@@ -58,6 +58,12 @@ class IDeployer(Interface):
     :ivar UUID node_uuid: The UUID of the node this deployer is running.
     :ivar unicode hostname: The hostname (really, IP) of the node this
         deployer is managing.
+
+    A deployer may also have a ``node_scoped`` attribute.  If it is ``True``
+    the deployer only looks at the configuration and state of its own node,
+    the leases, the persistent state and the non-manifest datasets, so the
+    agent asks the control service to send only those.  Deployers without it
+    are sent the whole cluster.
     """
     node_uuid = Attribute("")
     hostname = Attribute("")
@@ -50,9 +50,11 @@ from ..common import gather_deferreds
 from ..common.logging import log_info
 from ..control import (
     NodeStateCommand, IConvergenceAgent, AgentAMP, SetNodeEraCommand,
-    IStatePersister, SetBlockDeviceIdForDatasetId,
+    IStatePersister, SetBlockDeviceIdForDatasetId, ReceivedClusterStatus,
+    SetNodeScopeCommand, NodeStateDiffCommand,
 )
-from ..control._persistence import to_unserialized_json
+from ..control._diffing import create_diff
+from ..control._persistence import to_unserialized_json, make_generation_hash
 
 # The maximum number of seconds an agent will wait before attempting to
 # reconnect to the control service.
@@ -402,6 +404,26 @@ LOG_CALCULATED_ACTIONS = MessageType(
     u"The actions we're going to attempt.")
 
 
+def _state_diffs(previous, latest):
+    """
+    Diff the state changes sent to the control service.
+
+    :param previous: The ``tuple`` of ``IClusterStateChange`` last
+        acknowledged by the control service, or ``None``.
+    :param tuple latest: The ``IClusterStateChange`` s to send.
+
+    :return: A ``tuple`` of the ``Diff`` from each of ``previous`` to the
+        corresponding one of ``latest``, or ``None`` if they don't correspond.
+    """
+    if previous is None or len(previous) != len(latest):
+        return None
+    if any(type(before) is not type(after)
+           for before, after in zip(previous, latest)):
+        return None
+    return tuple(create_diff(before, after)
+                 for before, after in zip(previous, latest))
+
+
 class ConvergenceLoop(object):
     """
     World object for the convergence loop state machine, executing the actions
@@ -423,6 +445,9 @@ class ConvergenceLoop(object):
         to the control service.
     :type _last_acknowledged_state: tuple of IClusterStateChange
 
+    :ivar GenerationHash _last_acknowledged_generation: The generation of
+        ``_last_acknowledged_state``.
+
     :ivar _last_discovered_local_state: The discovered local state from
         last iteration done.
 
@@ -442,6 +467,7 @@ class ConvergenceLoop(object):
         self.client = None
         self._last_discovered_local_state = None
         self._last_acknowledged_state = None
+        self._last_acknowledged_generation = None
         self._sleep_timeout = None
         self._unconverged_sleep = _UnconvergedDelay()
 
@@ -485,14 +511,13 @@ class ConvergenceLoop(object):
             local_changes=list(state_changes),
         )
         with context.context():
-            d = DeferredContext(self.client.callRemote(
-                NodeStateCommand,
-                state_changes=state_changes,
-                eliot_context=context)
-            )
+            generation = make_generation_hash(state_changes)
+            d = DeferredContext(
+                self._send_state_changes(state_changes, generation, context))
 
             def record_acknowledged_state(ignored):
                 self._last_acknowledged_state = state_changes
+                self._last_acknowledged_generation = generation
 
             def clear_acknowledged_state(failure):
                 # We don't know if the control service has processed the update
@@ -507,6 +532,42 @@ class ConvergenceLoop(object):
                 u"Failed to send local state to control node.")
             return d.addActionFinish()
 
+    def _send_state_changes(self, state_changes, generation, context):
+        """
+        Send state to the control service, as diffs from the last
+        acknowledged state if the control service accepts them, falling back
+        to the full state if it can't apply them.
+
+        :param tuple state_changes: The ``IClusterStateChange`` s to send.
+        :param GenerationHash generation: The generation of
+            ``state_changes``.
+        :param context: The eliot action to send the state in.
+
+        :return: ``Deferred`` firing when the control service has the state.
+        """
+        def send_full(ignored=None):
+            return self.client.callRemote(
+                NodeStateCommand,
+                state_changes=state_changes,
+                eliot_context=context)
+
+        diffs = None
+        if getattr(self.client, "node_state_diffs", False):
+            diffs = _state_diffs(self._last_acknowledged_state, state_changes)
+        if diffs is None:
+            return send_full()
+        d = self.client.callRemote(
+            NodeStateDiffCommand,
+            state_diffs=diffs,
+            start_generation=self._last_acknowledged_generation,
+            end_generation=generation,
+            eliot_context=context)
+
+        def applied(response):
+            if not response["applied"]:
+                return send_full()
+        return d.addCallback(applied)
+
     def _maybe_send_state_to_control_service(self, state_changes):
         """
         If the given ``state_changes`` differ from those last acknowledged by
@@ -743,6 +804,8 @@ class AgentLoopService(MultiService, object):
     :ivar reconnecting_factory: The underlying factory used to connect to
         the control service, without the TLS wrapper.
     :ivar UUID era: This node's era.
+    :ivar ReceivedClusterStatus received: The configuration and state received
+        from the control service, kept across reconnections.
     """
 
     def __init__(self, context_factory):
@@ -755,8 +818,9 @@ class AgentLoopService(MultiService, object):
         )
         self.logger = convergence_loop.logger
         self.cluster_status = build_cluster_status_fsm(convergence_loop)
+        self.received = ReceivedClusterStatus()
         self.reconnecting_factory = ReconnectingClientFactory.forProtocol(
-            lambda: AgentAMP(self.reactor, self)
+            lambda: AgentAMP(self.reactor, self, self.received)
         )
         self.reconnecting_factory.maxDelay = MAXIMUM_RECONNECT_DELAY
         self.factory = TLSMemoryBIOFactory(context_factory, True,
@@ -781,6 +845,13 @@ class AgentLoopService(MultiService, object):
                               era=unicode(self.era),
                               node_uuid=unicode(self.deployer.node_uuid))
         d.addErrback(writeFailure)
+        if getattr(self.deployer, "node_scoped", False):
+            # Control services that don't know this command will just send
+            # the whole cluster, as they always have.
+            client.callRemote(
+                SetNodeScopeCommand,
+                node_uuid=unicode(self.deployer.node_uuid),
+            ).addErrback(lambda _: None)
         self.cluster_status.receive(_ConnectedToControlService(client=client))
 
     def disconnected(self):
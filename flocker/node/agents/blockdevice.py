@@ -1682,6 +1682,9 @@ class BlockDeviceDeployer(PClass):
     :ivar ICalculator calculator: The object to use to calculate dataset
         changes.
     """
+    # Only this node's part of the cluster is needed; see ``IDeployer``:
+    node_scoped = True
+
     hostname = field(type=unicode, mandatory=True)
     node_uuid = field(type=UUID, mandatory=True)
     block_device_api = field(mandatory=True)
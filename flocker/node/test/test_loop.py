@@ -47,7 +47,12 @@ from ...control import (
     NodeState, Deployment, Manifestation, Dataset, DeploymentState,
     Application, DockerImage, PersistentState,
 )
-from ...control._protocol import NodeStateCommand, AgentAMP, SetNodeEraCommand
+from ...control._diffing import create_diff
+from ...control._persistence import make_generation_hash
+from ...control._protocol import (
+    NodeStateCommand, AgentAMP, SetNodeEraCommand, SetNodeScopeCommand,
+    NodeStateDiffCommand,
+)
 from ...control.testtools import (
     make_istatepersister_tests,
     make_loopback_control_client,
@@ -457,6 +462,89 @@ class ConvergenceLoopFSMTests(TestCase):
             )
         )
 
+    def diffing_amp_client(self, local_state, changed_local_state, applied):
+        """
+        Create AMP client for a control service which accepts node state
+        diffs, that can respond successfully to a ``NodeStateCommand`` with
+        either state and to a ``NodeStateDiffCommand`` from the first to the
+        second.
+
+        :param NodeState local_state: The first state sent.
+        :param NodeState changed_local_state: The second state sent.
+        :param bool applied: Whether the control service can apply the diff.
+
+        :return: The ``FakeAMPClient`` and the arguments the
+            ``NodeStateDiffCommand`` is expected to be sent with.
+        """
+        client = self.make_amp_client([local_state, changed_local_state])
+        client.node_state_diffs = True
+        diff_kwargs = dict(
+            state_diffs=(create_diff(local_state, changed_local_state),),
+            start_generation=make_generation_hash((local_state,)),
+            end_generation=make_generation_hash((changed_local_state,)),
+        )
+        client.register_response(
+            command=NodeStateDiffCommand, kwargs=diff_kwargs,
+            response={"applied": applied},
+        )
+        return client, diff_kwargs
+
+    def converge_twice(self, client, local_state, changed_local_state):
+        """
+        Run two iterations of the convergence loop, discovering first one
+        state and then another.
+        """
+        configuration = Deployment(nodes=[to_node(local_state)])
+        state = DeploymentState(nodes=[local_state])
+        deployer = ControllableDeployer(
+            local_state.hostname,
+            [succeed(local_state), succeed(changed_local_state)],
+            [no_action(), no_action()])
+        reactor = Clock()
+        loop = build_convergence_loop_fsm(reactor, deployer)
+        loop.receive(_ClientStatusUpdate(
+            client=client, configuration=configuration, state=state))
+        reactor.advance(_UNCONVERGED_DELAY)
+
+    def test_convergence_done_changed_sends_diff(self):
+        """
+        If the control service accepts node state diffs, changed state is sent
+        as a diff from the state the control service last acknowledged.
+        """
+        local_state = NodeState(hostname=u'192.0.2.123')
+        changed_local_state = local_state.set(
+            applications=pset([Application(
+                name=u"app",
+                image=DockerImage.from_string(u"nginx"))]),
+        )
+        client, diff_kwargs = self.diffing_amp_client(
+            local_state, changed_local_state, True)
+        self.converge_twice(client, local_state, changed_local_state)
+        self.assertEqual(
+            [(NodeStateCommand, dict(state_changes=(local_state,))),
+             (NodeStateDiffCommand, diff_kwargs)],
+            client.calls)
+
+    def test_convergence_diff_not_applied_sends_state(self):
+        """
+        If the control service can't apply a node state diff, the full state
+        is sent instead.
+        """
+        local_state = NodeState(hostname=u'192.0.2.123')
+        changed_local_state = local_state.set(
+            applications=pset([Application(
+                name=u"app",
+                image=DockerImage.from_string(u"nginx"))]),
+        )
+        client, diff_kwargs = self.diffing_amp_client(
+            local_state, changed_local_state, False)
+        self.converge_twice(client, local_state, changed_local_state)
+        self.assertEqual(
+            [(NodeStateCommand, dict(state_changes=(local_state,))),
+             (NodeStateDiffCommand, diff_kwargs),
+             (NodeStateCommand, dict(state_changes=(changed_local_state,)))],
+            client.calls)
+
     def test_convergence_sent_state_fail_resends(self):
         """
         If sending state to the control node fails the next iteration will send
@@ -1183,6 +1271,19 @@ class UpdateNodeEraLocator(CommandLocator):
         return {}
 
 
+class NodeScopeLocator(UpdateNodeEraLocator):
+    """
+    An AMP locator that can also handle the ``SetNodeScopeCommand`` AMP
+    command.
+    """
+    scope = None
+
+    @SetNodeScopeCommand.responder
+    def set_node_scope(self, node_uuid):
+        self.scope = node_uuid
+        return {}
+
+
 class AgentLoopServiceTests(TestCase):
     """
     Tests for ``AgentLoopService``.
@@ -1260,6 +1361,36 @@ class AgentLoopServiceTests(TestCase):
             dict(era=unicode(self.service.era),
                  uuid=unicode(self.deployer.node_uuid)))
 
+    def scope_on_connect(self):
+        """
+        Connect the agent to a control service.
+
+        :return: The node the agent asked to be sent the view of, or ``None``
+            if it didn't ask.
+        """
+        client = AgentAMP(self.reactor, self.service)
+        server_locator = NodeScopeLocator()
+        server = AMP(locator=server_locator)
+        pump = connectedServerAndClient(lambda: client, lambda: server)[2]
+        pump.flush()
+        return server_locator.scope
+
+    def test_send_scope_on_connect(self):
+        """
+        Upon connecting, an agent whose deployer is ``node_scoped`` sends a
+        ``SetNodeScopeCommand`` with the current node's UUID.
+        """
+        self.deployer.node_scoped = True
+        self.assertEqual(
+            unicode(self.deployer.node_uuid), self.scope_on_connect())
+
+    def test_no_scope_by_default(self):
+        """
+        Upon connecting, an agent whose deployer isn't ``node_scoped`` does
+        not send a ``SetNodeScopeCommand``.
+        """
+        self.assertIs(None, self.scope_on_connect())
+
     def test_connected_resets_factory_delay(self):
         """
         When ``connected()`` is called the reconnect delay on the client
@@ -13,7 +13,9 @@ from json import loads, dumps
 
 from pyrsistent import PClass, field, pvector
 
-from twisted.internet.defer import maybeDeferred
+from repoze.lru import LRUCache
+
+from twisted.internet.defer import maybeDeferred, succeed
 from twisted.web.http import OK, INTERNAL_SERVER_ERROR
 
 from eliot import Logger, writeFailure, Action
@@ -52,6 +54,88 @@ class EndpointResponse(object):
         self.headers = headers
 
 
+class ResponseCache(object):
+    """
+    The serialized responses of an endpoint, reused for as long as the data
+    they were built from is unchanged.
+
+    One response is kept for each of the most recently requested URIs, so
+    requests differing in their route arguments or query are cached
+    separately.
+
+    :ivar int hits: The number of requests answered from the cache.
+    :ivar int misses: The number of cacheable requests which had to be
+        answered by the endpoint.
+    """
+    def __init__(self, generation, size=100, name=None, metrics=None):
+        """
+        :param generation: Callable taking the object the endpoint is a
+            method of and returning ``bytes`` identifying the version of the
+            data the endpoint's responses are built from, or ``None`` if the
+            response should not be cached.
+        :param int size: The number of URIs to keep responses for.
+        :param unicode name: The prefix of the names of the metrics to
+            record hits and misses in.
+        :param metrics: An object with an ``increment(name)`` method, such as
+            ``flocker.control._metrics.MetricsRegistry``, to record hits and
+            misses in, or ``None``.
+        """
+        self._generation = generation
+        self._responses = LRUCache(size)
+        self._name = name
+        self._metrics = metrics
+        self.hits = 0
+        self.misses = 0
+
+    def _record(self, outcome):
+        if self._metrics is not None:
+            self._metrics.increment(u"{}.{}".format(self._name, outcome))
+
+    def key(self, endpoint, request):
+        """
+        :param endpoint: The object the endpoint is a method of.
+        :param request: The request being answered.
+
+        :return: The key to look up and store the response to ``request``
+            under, or ``None`` if it should not be cached.
+        """
+        generation = self._generation(endpoint)
+        if generation is None:
+            return None
+        return (request.uri, generation)
+
+    def get(self, key):
+        """
+        :param key: A key returned by ``key``.
+
+        :return: The ``(code, headers, body)`` of the response stored under
+            ``key``, or ``None`` if there is none.
+        """
+        uri, generation = key
+        stored = self._responses.get(uri)
+        if stored is not None and stored[0] == generation:
+            self.hits += 1
+            self._record(u"cache_hits")
+            return stored[1]
+        self.misses += 1
+        self._record(u"cache_misses")
+        return None
+
+    def put(self, key, response):
+        """
+        :param key: A key returned by ``key``.
+        :param response: The ``(code, headers, body)`` of the response.
+        """
+        uri, generation = key
+        self._responses.put(uri, (generation, response))
+
+    def clear(self):
+        """
+        Forget all the stored responses.
+        """
+        self._responses.clear()
+
+
 def _get_logger(self):
     """
     Find the specific or default ``Logger``.
@@ -164,18 +248,34 @@ except KeyError:
         _validate_responses = False
 
 
-def _serialize(outputValidator):
+def _respond(request, code, headers, body):
+    """
+    Set the code and headers of a response.
+
+    :return: ``body``.
+    """
+    request.responseHeaders.setRawHeaders(
+        b"content-type", [b"application/json"])
+    for key, value in headers.items():
+        request.responseHeaders.setRawHeaders(key, [value])
+    request.setResponseCode(code)
+    return body
+
+
+def _serialize(outputValidator, cache=None):
     """
     Decorate a function so that its return value is automatically JSON encoded
     into a structure indicating a successful result.
 
     @param outputValidator: A L{jsonschema} validator for the returned JSON.
 
+    @param cache: A L{ResponseCache} to answer requests from, or L{None}.
+
     @return: A decorator that decorates a function with the signature
         of a Klein route endpoint that may return a Deferred.
     """
     def deco(original):
-        def success(result, request):
+        def success(result, request, key):
             code = OK
             headers = {}
             if isinstance(result, EndpointResponse):
@@ -184,16 +284,21 @@ def _serialize(outputValidator):
                 result = result.result
             if _validate_responses:
                 outputValidator.validate(result)
-            request.responseHeaders.setRawHeaders(
-                b"content-type", [b"application/json"])
-            for key, value in headers.items():
-                request.responseHeaders.setRawHeaders(key, [value])
-            request.setResponseCode(code)
-            return dumps(result)
+            body = dumps(result)
+            if key is not None:
+                cache.put(key, (code, headers, body))
+            return _respond(request, code, headers, body)
 
         def doit(self, request, **routeArguments):
+            key = None
+            if cache is not None:
+                key = cache.key(self, request)
+                if key is not None:
+                    response = cache.get(key)
+                    if response is not None:
+                        return succeed(_respond(request, *response))
             result = maybeDeferred(original, self, request, **routeArguments)
-            result.addCallback(success, request)
+            result.addCallback(success, request, key)
             return result
 
         return doit
@@ -201,7 +306,7 @@ def _serialize(outputValidator):
 
 
 def structured(inputSchema, outputSchema, schema_store=None,
-               ignore_body=False):
+               ignore_body=False, cache=None):
     """
     Decorate a Klein-style endpoint method so that the request body is
     automatically decoded and the response body is automatically encoded.
@@ -227,6 +332,9 @@ def structured(inputSchema, outputSchema, schema_store=None,
     :param ignore_body: If true, the body is not passed to the endpoint
         regardless of HTTP method, in particular including ``POST``. By
         default the body is only ignored for ``GET`` and ``HEAD``.
+    :param ResponseCache cache: If not ``None``, serialized responses are
+        stored in this and requests are answered from it without calling
+        ``original`` until the data they were built from changes.
     """
     if schema_store is None:
         schema_store = {}
@@ -237,7 +345,7 @@ def structured(inputSchema, outputSchema, schema_store=None,
         @wraps(original)
         @_remote_logging
         @_logging
-        @_serialize(outputValidator)
+        @_serialize(outputValidator, cache)
         def loadAndDispatch(self, request, **routeArguments):
             if request.method in (b"GET", b"DELETE") or ignore_body:
                 objects = {}
@@ -265,6 +373,7 @@ def structured(inputSchema, outputSchema, schema_store=None,
 
         loadAndDispatch.inputSchema = inputSchema
         loadAndDispatch.outputSchema = outputSchema
+        loadAndDispatch.response_cache = cache
         return loadAndDispatch
     return deco
 
@@ -23,7 +23,9 @@ from twisted.web.http import (
 
 from .. import _infrastructure
 from .._infrastructure import (
-    EndpointResponse, user_documentation, structured, UserDocumentation)
+    EndpointResponse, user_documentation, structured, UserDocumentation,
+    ResponseCache,
+)
 from .._logging import REQUEST
 from .._error import DECODING_ERROR_DESCRIPTION, BadRequest
 
@@ -31,6 +33,7 @@ from ..testtools import (EventChannel, dumps, loads,
                          CloseEnoughJSONResponse, dummyRequest, render,
                          asResponse)
 from ...testtools import TestCase
+from ...control._metrics import MetricsRegistry
 from .utils import (
     _assertRequestLogged, _assertTracebackLogged, FAILED_INPUT_VALIDATION)
 
@@ -581,6 +584,127 @@ class StructuredJSONTests(TestCase):
             {"jsonValue": True, "routingValue": "quux"}, app.kwargs)
 
 
+def caching_application(cache):
+    """
+    :param ResponseCache cache: The cache for the application's endpoint.
+
+    :return: An application with an endpoint at ``/cached`` whose responses
+        are cached in ``cache`` under the application's ``generation``
+        attribute.
+    """
+    class CachingApplication(object):
+        app = Klein()
+        logger = None
+
+        def __init__(self):
+            self.generation = b"1"
+            self.result = [u"first"]
+            self.calls = 0
+
+        @app.route(b"/cached")
+        @structured({}, {}, cache=cache)
+        def cached(self):
+            self.calls += 1
+            return self.result
+    return CachingApplication()
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Tests for ``structured`` endpoints with a ``ResponseCache``.
+    """
+    def setUp(self):
+        super(ResponseCacheTests, self).setUp()
+        self.metrics = MetricsRegistry()
+        self.cache = ResponseCache(
+            lambda application: application.generation,
+            name=u"rest.cached", metrics=self.metrics)
+        self.application = caching_application(self.cache)
+
+    def get(self, path=b"/cached"):
+        """
+        Render a ``GET`` request.
+
+        :return: The request.
+        """
+        request = dummyRequest(b"GET", path, Headers(), b"")
+        render(self.application.app.resource(), request)
+        return request
+
+    def test_cached(self):
+        """
+        A request with the same generation as an earlier one is answered with
+        the same response without calling the endpoint.
+        """
+        first = self.get()
+        second = self.get()
+        self.assertEqual(
+            (1, OK, first._responseBody,
+             [b"application/json"], (1, 1)),
+            (self.application.calls, second._code, second._responseBody,
+             second.responseHeaders.getRawHeaders(b"content-type"),
+             (self.cache.hits, self.cache.misses)))
+
+    def test_generation_changed(self):
+        """
+        A request with a different generation to the cached response is
+        answered by the endpoint.
+        """
+        self.get()
+        self.application.generation = b"2"
+        self.application.result = [u"second"]
+        self.assertEqual(
+            ([u"second"], 2),
+            (loads(self.get()._responseBody), self.application.calls))
+
+    def test_uncacheable(self):
+        """
+        Requests for which the generation is ``None`` are always answered by
+        the endpoint, and count as neither hits nor misses.
+        """
+        self.application.generation = None
+        self.get()
+        self.get()
+        self.assertEqual(
+            (2, 0, 0),
+            (self.application.calls, self.cache.hits, self.cache.misses))
+
+    def test_query(self):
+        """
+        Requests with different queries are cached separately.
+        """
+        self.get(b"/cached?a=1")
+        self.application.result = [u"second"]
+        self.assertEqual(
+            [u"second"], loads(self.get(b"/cached?a=2")._responseBody))
+
+    def test_explicit_response(self):
+        """
+        The code and headers of an ``EndpointResponse`` are included in the
+        cached response.
+        """
+        self.application.result = EndpointResponse(
+            GONE, [u"gone"], headers={b"x-key": b"value"})
+        self.get()
+        request = self.get()
+        self.assertEqual(
+            (GONE, [b"value"], 1),
+            (request._code, request.responseHeaders.getRawHeaders(b"x-key"),
+             self.application.calls))
+
+    def test_metrics(self):
+        """
+        Hits and misses are counted in the metrics registry under the given
+        name.
+        """
+        self.get()
+        self.get()
+        self.get()
+        self.assertEqual(
+            {u"rest.cached.cache_hits": 2, u"rest.cached.cache_misses": 1},
+            self.metrics.snapshot(u"rest.cached."))
+
+
 class UserDocumentationTests(TestCase):
     """
     Tests for L{user_documentation}.